@@ -0,0 +1,185 @@
+import argparse
+import os
+import shutil
+import sys
+import time
+from multiprocessing import Pool
+import ujson as json
+from setting import config
+from utils import iter_records
+from model_artifact import load_model_artifact
+
+
+def iter_chunks(records, chunk_size):
+    """
+    This function groups a stream of records into lists of chunk_size records.
+    """
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def score_chunk(model, records, explain=0):
+    """
+    This function scores a chunk of feature records and formats the results as JSON lines.
+
+    Inputs:
+        model (model_artifact.ScoringModel): The model.
+        records (list): The feature records.
+        explain (int): The number of top contributing features stored with every verdict (0 for none).
+
+    Returns:
+        lines (str): One JSON line per record: its sha256, decision score and verdict (1 for malicious),
+                     and its explanation as [feature name, contribution] pairs.
+    """
+    if explain:
+        scores, explanations = model.explain_records(records, explain)
+    else:
+        scores, explanations = model.score_records(records), None
+    verdicts = model.verdicts(scores)
+    results = [{'sha256': record.get('sha256'), 'score': float(score), 'verdict': int(verdict)}
+               for record, score, verdict in zip(records, scores, verdicts)]
+    if explanations is not None:
+        for result, explanation in zip(results, explanations):
+            result['explanation'] = explanation
+    return ''.join(json.dumps(result) + '\n' for result in results)
+
+
+def score_reports(model, records, output, chunk_size=10000, explain=0):
+    """
+    This function scores a stream of feature reports chunk by chunk, writing the results of every
+    chunk as soon as it is scored, so the memory does not depend on the number of reports.
+
+    Inputs:
+        model (model_artifact.ScoringModel): The model.
+        records (iterable): The feature records.
+        output (file): The file the JSON lines are written to.
+        chunk_size (int): The number of records scored at once.
+        explain (int): The number of top contributing features stored with every verdict.
+
+    Returns:
+        count (int): The number of scored reports.
+    """
+    count = 0
+    for chunk in iter_chunks(records, chunk_size):
+        output.write(score_chunk(model, chunk, explain))
+        count += len(chunk)
+    return count
+
+
+def _iter_lines(filename, start, end):
+    # the JSON lines starting in [start, end): a line crossing start belongs to the previous range
+    with open(filename, 'rb') as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+        position = f.tell()
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            if line.strip():
+                yield json.loads(line)
+
+
+def _score_range(task):
+    artifact_dir, filename, start, end, part_path, chunk_size, explain = task
+    model = load_model_artifact(artifact_dir)
+    with open(part_path, 'w') as output:
+        return score_reports(model, _iter_lines(filename, start, end), output, chunk_size, explain)
+
+
+def _is_json_lines(filename):
+    with open(filename, 'rb') as f:
+        return f.read(4096).lstrip()[:1] != b'['
+
+
+def score_file(artifact_dir, filename, output_path=None, chunk_size=10000, processes=1, explain=0):
+    """
+    This function scores every feature report of a result file (data.json or a JSON lines file).
+    With several processes, a JSON lines file is split in byte ranges scored in parallel, each worker
+    writing its own part, and the parts are concatenated in order; a JSON array is parsed by the
+    parent and its chunks are scored in parallel.
+
+    Inputs:
+        artifact_dir (str): The folder of the model artifact.
+        filename (str): The filepath of the feature reports.
+        output_path (str): The filepath of the JSON lines results, None for the standard output.
+        chunk_size (int): The number of reports scored at once.
+        processes (int): The number of worker processes.
+        explain (int): The number of top contributing features stored with every verdict.
+
+    Returns:
+        count (int): The number of scored reports.
+    """
+    output = sys.stdout if output_path is None else open(output_path, 'w')
+    try:
+        if processes <= 1:
+            return score_reports(load_model_artifact(artifact_dir), iter_records(filename), output, chunk_size,
+                                 explain)
+        if not _is_json_lines(filename):
+            with Pool(processes, initializer=_init_worker, initargs=(artifact_dir, explain)) as pool:
+                count = 0
+                for lines, n in pool.imap(_score_records, iter_chunks(iter_records(filename), chunk_size)):
+                    output.write(lines)
+                    count += n
+                return count
+        size = os.path.getsize(filename)
+        bounds = [size * k // processes for k in range(processes + 1)]
+        prefix = output_path or os.path.join(os.path.dirname(os.path.abspath(filename)), 'scores')
+        tasks = [(artifact_dir, filename, bounds[k], bounds[k + 1], f'{prefix}.part{k}', chunk_size, explain)
+                 for k in range(processes)]
+        with Pool(processes) as pool:
+            counts = pool.map(_score_range, tasks, chunksize=1)
+        output.flush()
+        for task in tasks:
+            with open(task[4], 'r') as part:
+                shutil.copyfileobj(part, output)
+            os.remove(task[4])
+        return sum(counts)
+    finally:
+        if output_path is not None:
+            output.close()
+
+
+# the model of the worker processes scoring the chunks of a JSON array, and their explanation size
+_model = None
+_explain = 0
+
+
+def _init_worker(artifact_dir, explain=0):
+    global _model, _explain
+    _model = load_model_artifact(artifact_dir)
+    _explain = explain
+
+
+def _score_records(records):
+    return score_chunk(_model, records, _explain), len(records)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Score the feature reports of a result file with the saved model.')
+    parser.add_argument('input', nargs='?', default=config['apksResultJsonPath'],
+                        help='data.json or a JSON lines file of feature reports')
+    parser.add_argument('-o', '--output', default=None, help='the JSON lines results (default: standard output)')
+    parser.add_argument('--artifact', default=config['artifactPath'], help='the folder of the model artifact')
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--explain', type=int, default=0, metavar='N',
+                        help='store the N features contributing most to every verdict')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    start = time.perf_counter()
+    count = score_file(args.artifact, args.input, args.output, args.chunk_size, args.processes, args.explain)
+    elapsed = time.perf_counter() - start
+    print(f'{count} reports scored in {elapsed:.2f} s ({count / max(elapsed, 1e-9) * 60:.0f} per minute)',
+          file=sys.stderr)
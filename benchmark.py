@@ -0,0 +1,201 @@
+import argparse
+import os
+import time
+import tracemalloc
+from sklearn.model_selection import train_test_split
+from scipy import sparse
+from sklearn.preprocessing import StandardScaler
+from setting import config
+from utils import load_data
+from classification_utils import preprocess_data
+from classification import train_model, evaluate_model, train_regularization_path
+from feature_selection import select_features
+import numpy as np
+import warnings
+warnings.simplefilter(action='ignore', category=FutureWarning)
+
+
+def measure(function, *args, **kwargs):
+    """
+    This function runs a function and measures its wall time and the peak of the memory it allocates.
+
+    Inputs:
+        function (callable): The function to run.
+        *args, **kwargs: Its arguments.
+
+    Returns:
+        result: The result of the function.
+        elapsed (float): The wall time in seconds.
+        peak (int): The peak of the traced memory in bytes.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def print_row(name, elapsed, peak):
+    print(f'{name:<32} {elapsed:>10.3f} s {peak / 2 ** 20:>12.1f} MiB')
+
+
+def _dense_fit(X, y, C, epsilon):
+    X_scaled = StandardScaler().fit_transform(X.toarray())
+    return train_model(X_scaled, y, C=C, epsilon=epsilon, random_state_val=0)
+
+
+def _sparse_fit(X, y, C, epsilon, scaling):
+    X_scaled, y_encoded, _, _ = preprocess_data(X, y, scaling)
+    return train_model(X_scaled, y_encoded, C=C, epsilon=epsilon, random_state_val=0)
+
+
+def benchmark_preprocessing(X, y, C=0.021, epsilon=1e-3):
+    """
+    This function compares the time and memory of preprocessing + fit on the former dense path
+    (densify, center and scale) and on the sparse path of preprocess_data.
+
+    Inputs:
+        X (scipy.sparse.csr_matrix): The feature matrix.
+        y (numpy.ndarray): The labels.
+        C (float): The regularization parameter.
+        epsilon (float): The tolerance of the fit.
+    """
+    print(f'{X.shape[0]} apps, {X.shape[1]} features, density {X.nnz / max(1, X.shape[0] * X.shape[1]):.5f}')
+    _, elapsed, peak = measure(_dense_fit, X, y, C, epsilon)
+    print_row('dense StandardScaler', elapsed, peak)
+    for scaling in ('standard', 'maxabs'):
+        _, elapsed, peak = measure(_sparse_fit, X, y, C, epsilon, scaling)
+        print_row(f'sparse {scaling}', elapsed, peak)
+
+
+def benchmark_feature_selection(X, y, C=0.021, epsilon=1e-3, k_values=(500, 2000)):
+    """
+    This function reports the training time, model size and accuracy/precision/recall trade-off
+    of every feature selection method against training on all features.
+
+    Inputs:
+        X (scipy.sparse.csr_matrix): The feature matrix.
+        y (numpy.ndarray): The labels.
+        C (float): The regularization parameter.
+        epsilon (float): The tolerance of the fit.
+        k_values (tuple): The numbers of features kept by the ranking methods.
+    """
+    X_scaled, y_encoded, _, _ = preprocess_data(X, y)
+    X_train, X_test, y_train, y_test = train_test_split(
+        X_scaled, y_encoded, test_size=0.1, random_state=0, stratify=y_encoded)
+    settings = [('all features', None, None)]
+    settings += [(f'{method} k={k}', method, k) for method in ('chi2', 'mutual_info') for k in k_values]
+    settings += [('min_df only', 'min_df', None), ('l1', 'l1', None)]
+    print(f'{"selection":<24} {"features":>9} {"select s":>9} {"fit s":>8} {"nonzero w":>10} '
+          f'{"accuracy":>9} {"precision":>10} {"recall":>7}')
+    for name, method, k in settings:
+        start = time.perf_counter()
+        if method is None:
+            columns = slice(None)
+            n_features = X_train.shape[1]
+        else:
+            columns = select_features(X_train, y_train, None if method == 'min_df' else method, k=k or 0)
+            n_features = len(columns)
+        select_time = time.perf_counter() - start
+        model, fit_time, _ = measure(train_model, X_train[:, columns], y_train, C=C,
+                                     epsilon=epsilon, random_state_val=0)
+        accuracy, precision, recall = evaluate_model(model, X_test[:, columns], y_test)
+        print(f'{name:<24} {n_features:>9} {select_time:>9.3f} {fit_time:>8.3f} '
+              f'{int((model.coef_ != 0).sum()):>10} {accuracy:>9.3f} {precision:>10.3f} {recall:>7.3f}')
+
+
+def benchmark_parallel_training(X, y, C=0.021, epsilon=1e-3, max_jobs=None, replicate=1, modes=('sync', 'async')):
+    """
+    This function reports the training time, speedup and parallel efficiency (speedup / workers)
+    of ParallelSecSVM from 1 to max_jobs worker processes, in the synchronous and asynchronous modes.
+
+    Inputs:
+        X (scipy.sparse.csr_matrix): The feature matrix.
+        y (numpy.ndarray): The labels.
+        C (float): The regularization parameter.
+        epsilon (float): The tolerance of the fit.
+        max_jobs (int): The largest number of workers (default: all cores).
+        replicate (int): The number of copies of the rows, to benchmark on a larger corpus.
+        modes (tuple): The training modes to benchmark.
+    """
+    X_scaled, y_encoded, _, _ = preprocess_data(X, y)
+    if replicate > 1:
+        X_scaled = sparse.vstack([X_scaled] * replicate, format='csr')
+        y_encoded = np.tile(y_encoded, replicate)
+    max_jobs = max_jobs or os.cpu_count()
+    jobs = sorted({1, max_jobs} | {2 ** i for i in range(max_jobs.bit_length()) if 2 ** i <= max_jobs})
+    print(f'{X_scaled.shape[0]} apps, {X_scaled.shape[1]} features, {os.cpu_count()} cores')
+    print(f'{"mode":<6} {"workers":>7} {"fit s":>8} {"speedup":>8} {"efficiency":>10} {"epochs":>7} {"accuracy":>9}')
+    for mode in modes:
+        baseline = None
+        for n_jobs in jobs:
+            model, elapsed, _ = measure(train_model, X_scaled, y_encoded, C=C, epsilon=epsilon,
+                                        random_state_val=0, classifier='parallel_secsvm',
+                                        n_jobs=n_jobs, mode=mode)
+            baseline = baseline or elapsed
+            accuracy = float(np.mean(model.predict(X_scaled) == y_encoded))
+            print(f'{mode:<6} {n_jobs:>7} {elapsed:>8.3f} {baseline / elapsed:>8.2f} '
+                  f'{baseline / elapsed / n_jobs:>10.2f} {model.n_iter_:>7} {accuracy:>9.3f}')
+
+
+def benchmark_regularization_path(X, y, epsilon=1e-3, Cs=None, classifier='secsvm'):
+    """
+    This function compares the warm-started regularization path with independent fits of every C,
+    and prints the validation metrics and sparsity of every point of the path.
+
+    Inputs:
+        X (scipy.sparse.csr_matrix): The feature matrix.
+        y (numpy.ndarray): The labels.
+        epsilon (float): The tolerance of the fits.
+        Cs (list): The values of C (default: 9 values around 0.021, from 0.0021 to 0.21).
+        classifier (str): The classifier (see classification.train_regularization_path).
+    """
+    Cs = np.geomspace(0.0021, 0.21, 9) if Cs is None else Cs
+    X_scaled, y_encoded, _, _ = preprocess_data(X, y)
+    X_train, X_val, y_train, y_val = train_test_split(
+        X_scaled, y_encoded, test_size=0.1, random_state=0, stratify=y_encoded)
+    (path, _, _), path_time, _ = measure(train_regularization_path, X_train, y_train, X_val, y_val,
+                                         Cs, epsilon, 0, classifier)
+    independent_time = 0.0
+    independent_epochs = 0
+    for C in Cs:
+        model, elapsed, _ = measure(train_regularization_path, X_train, y_train, X_val, y_val,
+                                    [C], epsilon, 0, classifier)
+        independent_time += elapsed
+        independent_epochs += model[0][0]['n_iter']
+    print(f'{"C":>8} {"epochs":>7} {"objective":>10} {"accuracy":>9} {"precision":>10} {"recall":>7} '
+          f'{"nonzero w":>10} {"at bound":>9} {"fit s":>7}')
+    for point in path:
+        print(f'{point["C"]:>8.4f} {point["n_iter"]:>7} {point["objective"]:>10.3f} {point["accuracy"]:>9.3f} '
+              f'{point["precision"]:>10.3f} {point["recall"]:>7.3f} {point["nonzero"]:>10} '
+              f'{point["at_bound"]:>9} {point["fit_time"]:>7.3f}')
+    print(f'warm-started path: {path_time:.3f} s, {sum(point["n_iter"] for point in path)} epochs')
+    print(f'independent fits:  {independent_time:.3f} s, {independent_epochs} epochs')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmarks of the training pipeline.')
+    parser.add_argument('benchmark', choices=['preprocess', 'selection', 'parallel', 'path'])
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='parallel: the largest number of workers (default: all cores)')
+    parser.add_argument('--replicate', type=int, default=1,
+                        help='parallel: train on this many copies of the rows')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    X, y, feature_names, _, _ = load_data(
+        config['apksResultJsonPath'], config['vocabularyPath'], config['featureCachePath'],
+        n_benign=config['sampleBenign'], n_malicious=config['sampleMalicious'],
+        malicious_ratio=config['maliciousRatio'])
+    if args.benchmark == 'preprocess':
+        benchmark_preprocessing(X, y)
+    elif args.benchmark == 'selection':
+        benchmark_feature_selection(X, y)
+    elif args.benchmark == 'parallel':
+        benchmark_parallel_training(X, y, max_jobs=args.jobs, replicate=args.replicate)
+    elif args.benchmark == 'path':
+        benchmark_regularization_path(X, y)
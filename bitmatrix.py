@@ -0,0 +1,178 @@
+import numpy as np
+from scipy import sparse
+
+# number of set bits of every byte value, for numpy versions without bitwise_count
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount(values):
+    """
+    This function counts the set bits of every byte of an uint8 array.
+
+    Inputs:
+        values (numpy.ndarray): The uint8 array.
+
+    Returns:
+        counts (numpy.ndarray): The number of set bits of every byte.
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return _POPCOUNT_TABLE[values]
+
+
+class BitMatrix:
+    """
+    A binary feature matrix stored with one bit per feature per app (8 features per byte),
+    i.e. 64 times smaller than the same matrix in float64.
+
+    Inputs:
+        bits (numpy.ndarray): The packed rows, uint8 array of shape (n_rows, ceil(n_features / 8)).
+        n_features (int): The number of features (columns).
+    """
+
+    def __init__(self, bits, n_features):
+        self.bits = bits
+        self.n_features = n_features
+
+    @property
+    def shape(self):
+        return self.bits.shape[0], self.n_features
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    @classmethod
+    def from_dense(cls, X):
+        X = np.asarray(X)
+        return cls(np.packbits(X != 0, axis=1), X.shape[1])
+
+    @classmethod
+    def from_csr(cls, X):
+        """
+        This function packs a sparse matrix (every non-zero entry is a set bit).
+
+        Inputs:
+            X (scipy.sparse matrix): The feature matrix.
+
+        Returns:
+            matrix (BitMatrix): The packed matrix.
+        """
+        X = sparse.csr_matrix(X)
+        n_rows, n_features = X.shape
+        bits = np.zeros((n_rows, (n_features + 7) // 8), dtype=np.uint8)
+        rows = np.repeat(np.arange(n_rows), np.diff(X.indptr))
+        nonzero = X.data != 0
+        rows, columns = rows[nonzero], X.indices[nonzero]
+        np.bitwise_or.at(bits, (rows, columns >> 3),
+                         (0x80 >> (columns & 7)).astype(np.uint8))
+        return cls(bits, n_features)
+
+    def to_dense(self, dtype=np.float64):
+        return np.unpackbits(self.bits, axis=1, count=self.n_features).astype(dtype)
+
+    def to_csr(self, dtype=np.float64, chunk_size=4096):
+        """
+        This function converts the matrix to the sparse format sklearn expects, unpacking a chunk of rows at a time.
+
+        Inputs:
+            dtype (numpy.dtype): The dtype of the values.
+            chunk_size (int): The number of rows unpacked at once.
+
+        Returns:
+            X (scipy.sparse.csr_matrix): The feature matrix.
+        """
+        chunks = [sparse.csr_matrix(
+            np.unpackbits(self.bits[start:start + chunk_size], axis=1, count=self.n_features),
+            dtype=dtype) for start in range(0, self.bits.shape[0], chunk_size)]
+        if not chunks:
+            return sparse.csr_matrix((0, self.n_features), dtype=dtype)
+        return sparse.vstack(chunks, format='csr')
+
+    def __getitem__(self, rows):
+        """
+        This function selects rows (an index array, a boolean mask or a slice).
+        """
+        return BitMatrix(self.bits[rows], self.n_features)
+
+    def feature_counts(self):
+        """
+        This function counts the apps having every feature.
+
+        Returns:
+            counts (numpy.ndarray): The number of set bits of every column.
+        """
+        counts = np.empty((8, self.bits.shape[1]), dtype=np.int64)
+        for bit in range(8):
+            counts[7 - bit] = ((self.bits >> bit) & 1).sum(axis=0)
+        return counts.T.reshape(-1)[:self.n_features]
+
+    def row_counts(self):
+        return popcount(self.bits).sum(axis=1, dtype=np.int64)
+
+    def dot(self, weights, chunk_size=256):
+        """
+        This function computes the linear scores X @ weights without unpacking the bits:
+        for every byte position a table of the 256 possible partial sums is precomputed,
+        and the score of a row is the sum of the table entries selected by its bytes.
+
+        Inputs:
+            weights (numpy.ndarray): The weight vector, of length n_features.
+            chunk_size (int): The number of rows scored at once.
+
+        Returns:
+            scores (numpy.ndarray): The score of every row.
+        """
+        n_bytes = self.bits.shape[1]
+        padded = np.zeros(n_bytes * 8, dtype=np.float64)
+        padded[:self.n_features] = weights
+        # table[j, b] = sum of the weights of byte position j whose bit is set in b
+        byte_bits = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1)
+        table = padded.reshape(n_bytes, 8) @ byte_bits.T.astype(np.float64)
+        positions = np.arange(n_bytes)
+        scores = np.empty(self.bits.shape[0], dtype=np.float64)
+        for start in range(0, self.bits.shape[0], chunk_size):
+            block = self.bits[start:start + chunk_size]
+            scores[start:start + len(block)] = table[positions, block].sum(axis=1)
+        return scores
+
+    def _pairwise(self, other, max_bytes, op):
+        other = self if other is None else other
+        result = np.empty((self.bits.shape[0], other.bits.shape[0]), dtype=np.int64)
+        # bound the size of the (chunk, other rows, bytes) intermediate array
+        chunk_size = max(1, max_bytes // max(1, other.bits.shape[0] * self.bits.shape[1]))
+        for start in range(0, self.bits.shape[0], chunk_size):
+            block = self.bits[start:start + chunk_size, None, :]
+            result[start:start + len(block)] = popcount(op(block, other.bits[None, :, :])).sum(
+                axis=2, dtype=np.int64)
+        return result
+
+    def hamming(self, other=None, max_bytes=1 << 26):
+        """
+        This function computes the Hamming distance (number of differing features) between every pair of rows.
+
+        Inputs:
+            other (BitMatrix): The rows to compare to, self if None.
+            max_bytes (int): The memory budget of the intermediate arrays.
+
+        Returns:
+            distances (numpy.ndarray): Matrix of shape (self rows, other rows).
+        """
+        return self._pairwise(other, max_bytes, np.bitwise_xor)
+
+    def jaccard(self, other=None, max_bytes=1 << 26):
+        """
+        This function computes the Jaccard similarity (shared features / features of either row) between every pair of rows.
+
+        Inputs:
+            other (BitMatrix): The rows to compare to, self if None.
+            max_bytes (int): The memory budget of the intermediate arrays.
+
+        Returns:
+            similarities (numpy.ndarray): Matrix of shape (self rows, other rows).
+        """
+        other_counts = (self if other is None else other).row_counts()
+        intersection = self._pairwise(other, max_bytes, np.bitwise_and)
+        union = self.row_counts()[:, None] + other_counts[None, :] - intersection
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(union > 0, intersection / union, 1.0)
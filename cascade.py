@@ -0,0 +1,204 @@
+import argparse
+import os
+import sys
+import numpy as np
+from setting import config
+from model_artifact import save_model_artifact, load_model_artifact
+from evaluation import confusion_at, metrics_from_counts
+from feature_selection import family_columns
+
+# the classifier of the manifest stage: the bounded weights of the SecSVM keep a few added manifest
+# entries (cheap for an attacker) from moving a malicious app far below the uncertainty band
+MANIFEST_CLASSIFIER = 'secsvm'
+
+
+def cascade_scores(manifest_scores, full_scores, band):
+    """
+    This function combines the scores of the two stages: the apps whose manifest score falls in the
+    uncertainty band [low, high] get the score of the full model, the others keep their manifest score.
+
+    Inputs:
+        manifest_scores (numpy.ndarray): The decision values of the manifest model.
+        full_scores (numpy.ndarray): The decision values of the full model.
+        band (tuple): The (low, high) uncertainty band of the manifest scores.
+
+    Returns:
+        scores (numpy.ndarray): The decision values of the cascade.
+        escalated (numpy.ndarray): Whether every app went through the dex analysis.
+    """
+    low, high = band
+    escalated = (manifest_scores >= low) & (manifest_scores <= high)
+    return np.where(escalated, full_scores, manifest_scores), escalated
+
+
+def _metrics(y, scores):
+    metrics = metrics_from_counts(**confusion_at(y, scores))
+    return float(metrics['accuracy']), float(metrics['precision']), float(metrics['recall'])
+
+
+def evaluate_cascade(manifest_scores, full_scores, y, bands, dex_cost=30.0):
+    """
+    This function reports, for every uncertainty band, the share of apps sent to the dex analysis,
+    the throughput gain over analysing every app fully, and the accuracy, precision and recall of
+    the cascade (with the full model and the manifest model alone as the two extremes).
+    The extraction cost of an app is 1 for the manifest stages and 1 + dex_cost with the dex analysis.
+
+    Inputs:
+        manifest_scores (numpy.ndarray): The decision values of the manifest model on the test apps.
+        full_scores (numpy.ndarray): The decision values of the full model on the test apps.
+        y (numpy.ndarray): The labels of the test apps (0/1).
+        bands (list): The (low, high) bands to evaluate.
+        dex_cost (float): The cost of the dex analysis relative to the manifest stages.
+
+    Returns:
+        rows (list): One dict per setting: name, band, escalated, throughput_gain, accuracy, precision, recall.
+    """
+    y = np.asarray(y)
+    rows = [{'name': 'full model', 'band': None, 'escalated': 1.0, 'throughput_gain': 1.0}]
+    rows[0]['accuracy'], rows[0]['precision'], rows[0]['recall'] = _metrics(y, full_scores)
+    rows.append({'name': 'manifest only', 'band': None, 'escalated': 0.0, 'throughput_gain': 1.0 + dex_cost})
+    rows[1]['accuracy'], rows[1]['precision'], rows[1]['recall'] = _metrics(y, manifest_scores)
+    for band in bands:
+        scores, escalated = cascade_scores(manifest_scores, full_scores, band)
+        rate = float(escalated.mean()) if len(escalated) else 0.0
+        row = {'name': f'cascade [{band[0]:g}, {band[1]:g}]', 'band': band, 'escalated': rate,
+               'throughput_gain': (1.0 + dex_cost) / (1.0 + rate * dex_cost)}
+        row['accuracy'], row['precision'], row['recall'] = _metrics(y, scores)
+        rows.append(row)
+    return rows
+
+
+def print_cascade_report(rows):
+    print(f'{"setting":<24} {"to dex":>7} {"speedup":>8} {"accuracy":>9} {"precision":>10} {"recall":>7}')
+    for row in rows:
+        print(f'{row["name"]:<24} {row["escalated"]:>7.1%} {row["throughput_gain"]:>7.1f}x '
+              f'{row["accuracy"]:>9.3f} {row["precision"]:>10.3f} {row["recall"]:>7.3f}')
+
+
+def save_cascade(directory, manifest_model, manifest_columns, full_model, full_columns, feature_names,
+                 scale, band, classes=(0, 1), metadata=None):
+    """
+    This function saves the two stages of the cascade as model artifacts (manifest/ and full/),
+    the uncertainty band being kept in the metadata of the manifest stage.
+
+    Inputs:
+        directory (str): The folder of the cascade.
+        manifest_model: The trained manifest model (coef_ and intercept_).
+        manifest_columns (numpy.ndarray): The columns the manifest model was trained on.
+        full_model: The trained full model.
+        full_columns (numpy.ndarray): The columns the full model was trained on.
+        feature_names (list): The name of every column.
+        scale (numpy.ndarray): The scale of every column.
+        band (tuple): The (low, high) uncertainty band.
+        classes (tuple): The labels of the negative and positive decisions.
+        metadata (dict): The training metadata.
+    """
+    for name, model, columns, extra in (('manifest', manifest_model, manifest_columns, {'band': list(band)}),
+                                        ('full', full_model, full_columns, {})):
+        save_model_artifact(os.path.join(directory, name), model.coef_, model.intercept_[0],
+                            [feature_names[i] for i in columns], columns=columns, scale=scale[columns],
+                            classes=classes, metadata=dict(metadata or {}, stage=name, **extra))
+
+
+class CascadeScanner:
+    """
+    Scans apks with the saved cascade: the manifest stages of the extractor run first, and the dex
+    analysis only runs for the apps whose manifest score falls in the uncertainty band (through the
+    needsDex callback of staticAnalyzer.analyze). Like model_artifact, scoring only needs numpy.
+
+    Inputs:
+        directory (str): The folder of the cascade (see save_cascade).
+        band (tuple): The (low, high) uncertainty band, None for the band saved with the cascade.
+    """
+
+    def __init__(self, directory, band=None):
+        self.manifest = load_model_artifact(os.path.join(directory, 'manifest'))
+        self.full = load_model_artifact(os.path.join(directory, 'full'))
+        self.band = tuple(self.manifest.metadata['band'] if band is None else band)
+        self.scanned = 0
+        self.escalated = 0
+        sys.path.insert(0, config['featureExtractorPath'])
+        from extractionPlan import ExtractionPlan
+        # only the features of the two stages are extracted
+        self.plan = ExtractionPlan(self.manifest.used_features() + self.full.used_features())
+
+    def needs_dex(self, report):
+        """
+        This function decides from the manifest report whether the dex analysis is needed.
+        """
+        import staticAnalyzer
+        score = self.manifest.score(staticAnalyzer.report_to_feature_vector(report, label=0))
+        return self.band[0] <= score <= self.band[1]
+
+    def scan(self, apk_path, working_dir):
+        """
+        This function scans an apk.
+
+        Inputs:
+            apk_path (str): The filepath of the apk.
+            working_dir (str): The folder of the temporary extraction files.
+
+        Returns:
+            result (dict): The sha256, score, verdict and whether the dex analysis ran.
+        """
+        import staticAnalyzer
+        cwd = os.getcwd()
+        # the extractor resolves its tools (baksmali, API lists) relative to its folder
+        os.chdir(config['featureExtractorPath'])
+        try:
+            report = staticAnalyzer.analyze(os.path.join(cwd, apk_path), working_dir, self.needs_dex,
+                                            self.plan)
+        finally:
+            os.chdir(cwd)
+        vector = staticAnalyzer.report_to_feature_vector(report, label=0)
+        dex = report['dex_analyzed']
+        model = self.full if dex else self.manifest
+        score = model.score(vector)
+        self.scanned += 1
+        self.escalated += int(dex)
+        return {'sha256': report['sha256'], 'score': score, 'verdict': int(model.verdicts([score])[0]),
+                'dex_analyzed': dex}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Train the manifest-only SecSVM first stage and report the cascade trade-off on data.json.')
+    parser.add_argument('--band', type=float, nargs=2, default=None, metavar=('LOW', 'HIGH'),
+                        help='the uncertainty band saved with the cascade (default: cascadeBand of setting.py)')
+    parser.add_argument('--dex-cost', type=float, default=None,
+                        help='the cost of the dex analysis relative to the manifest stages')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    from sklearn.model_selection import train_test_split
+    from utils import load_data
+    from classification_utils import preprocess_data
+    from classification import train_model
+
+    args = parse_args()
+    band = tuple(args.band or config['cascadeBand'])
+    dex_cost = args.dex_cost or config['cascadeDexCost']
+    X, y, feature_names, _, _ = load_data(
+        config['apksResultJsonPath'], config['vocabularyPath'], config['featureCachePath'],
+        n_benign=config['sampleBenign'], n_malicious=config['sampleMalicious'],
+        malicious_ratio=config['maliciousRatio'], storage=config['featureStorage'])
+    X_scaled, y_encoded, scaler, le = preprocess_data(X, y, config['scaling'])
+    X_train, X_test, y_train, y_test = train_test_split(
+        X_scaled, y_encoded, test_size=0.1, random_state=0, stratify=y_encoded)
+    # the manifest families of featureExtractor/extractionPlan.py, the others need the dex analysis
+    manifest_columns = family_columns(feature_names)
+    full_columns = np.arange(X_scaled.shape[1])
+    manifest_model = train_model(X_train[:, manifest_columns], y_train, C=0.021, epsilon=1e-3,
+                                 random_state_val=0, classifier=MANIFEST_CLASSIFIER)
+    full_model = train_model(X_train, y_train, C=0.021, epsilon=1e-3, random_state_val=0,
+                             classifier=config['classifier'])
+    print(f'{len(manifest_columns)} manifest features of {len(feature_names)}')
+    rows = evaluate_cascade(manifest_model.decision_function(X_test[:, manifest_columns]),
+                            full_model.decision_function(X_test), y_test,
+                            sorted({band, (-0.5, 0.5), (-1.0, 1.0), (-1.5, 1.5), (-2.0, 2.0)}), dex_cost)
+    print_cascade_report(rows)
+    save_cascade(config['cascadePath'], manifest_model, manifest_columns, full_model, full_columns,
+                 feature_names, scaler.scale_, band, le.classes_,
+                 {'classifier': config['classifier'], 'manifest_classifier': MANIFEST_CLASSIFIER})
+    print(f'cascade saved at {config["cascadePath"]} with the band [{band[0]:g}, {band[1]:g}]')
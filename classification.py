@@ -1,68 +1,278 @@
-from sklearn.metrics import accuracy_score, precision_score, recall_score
+from sklearn.linear_model import SGDClassifier
+from sklearn.preprocessing import StandardScaler
 from sklearn.svm import LinearSVC
+import time
+import numpy as np
+from scipy import sparse
+from feature_store import split_mask
+from classification_utils import SecSVM
+from parallel_training import ParallelSecSVM
+from ensemble import BaggedLinearSVM
+from evaluation import confusion_at, metrics_from_counts, evaluate_scores, TARGET_FPRS
+from model_artifact import top_contributions
 from plt import plotting
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
 
-def train_model(X_train, y_train, C, epsilon, random_state_val):
+def train_model(X_train, y_train, C, epsilon, random_state_val, classifier='linearsvc', **params):
     """
         This function trains a Sec-SVM classifier model on the input training data.
 
     Inputs:
-        X_train (numpy.ndarray): The feature values for the training data.
+        X_train (numpy.ndarray or scipy.sparse.csr_matrix): The feature values for the training data.
         y_train (numpy.ndarray): The labels for the training data.
         C (float): The regularization parameter.
         epsilon (float): A small constant used to determine when to stop the training.
+        classifier (str): 'linearsvc' for sklearn's LinearSVC, 'secsvm' for the bounded-weights SecSVM,
+                          'parallel_secsvm' for the SecSVM trained on several processes, 'bagged' for
+                          an ensemble of linear SVMs averaged into one (see ensemble.BaggedLinearSVM).
+        **params: Extra parameters of the classifier (e.g. lb and ub for SecSVM, n_jobs and mode for ParallelSecSVM,
+                  n_estimators, base and max_features for the bagged ensemble).
 
     Returns:
-        model (sklearn.svm.LinearSVC): The trained Sec-SVM model.
+        model (sklearn.svm.LinearSVC, classification_utils.SecSVM or ensemble.BaggedLinearSVM): The trained model.
     """
 
     # Initialize the model
-    model = LinearSVC(C=C, random_state=random_state_val, tol=epsilon)
+    if classifier == 'secsvm':
+        model = SecSVM(C=C, tol=epsilon, random_state=random_state_val, **params)
+    elif classifier == 'parallel_secsvm':
+        model = ParallelSecSVM(C=C, tol=epsilon, random_state=random_state_val, **params)
+    elif classifier == 'bagged':
+        model = BaggedLinearSVM(C=C, tol=epsilon, random_state=random_state_val, **params)
+    elif classifier == 'linearsvc':
+        model = LinearSVC(C=C, random_state=random_state_val, tol=epsilon, **params)
+    else:
+        raise ValueError(f'unknown classifier: {classifier}')
     model.fit(X_train, y_train)
     return model
 
 
-def evaluate_model(model, X_test, y_test):
+def train_regularization_path(X_train, y_train, X_val, y_val, Cs, epsilon, random_state_val,
+                              classifier='secsvm', **params):
     """
-    This function evaluates a model on the test data.
+        This function trains the model for a series of C values, sorted from the strongest to the
+        weakest regularization, starting every fit from the solution of the previous one (warm start),
+        and evaluates every point of the path on a validation set. The training matrix is converted
+        and the labels are encoded only once for the whole path.
+        liblinear (LinearSVC) cannot warm start, so classifier='linearsvc' fits the same hinge-loss
+        SVM with the SecSVM solver and unbounded weights.
+
+    Inputs:
+        X_train (scipy.sparse.csr_matrix or numpy.ndarray): The feature values for the training data.
+        y_train (numpy.ndarray): The labels for the training data.
+        X_val (scipy.sparse.csr_matrix or numpy.ndarray): The feature values for the validation data.
+        y_val (numpy.ndarray): The labels for the validation data.
+        Cs (list): The values of the regularization parameter.
+        epsilon (float): A small constant used to determine when to stop every fit.
+        random_state_val (int): The seed of the mini-batch order.
+        classifier (str): 'secsvm', 'parallel_secsvm' or 'linearsvc' (see above).
+        **params: Extra parameters of the classifier.
+
+    Returns:
+        path (list): One dict per C (in increasing order): C, n_iter, objective, accuracy, precision,
+                     recall, nonzero (the number of non-zero weights), at_bound (the number of weights
+                     at lb or ub) and fit_time.
+        coefs (numpy.ndarray): The weights of every point of the path (one row per C).
+        intercepts (numpy.ndarray): The bias of every point of the path.
+    """
+    if classifier == 'linearsvc':
+        classifier = 'secsvm'
+        params = dict({'lb': -np.inf, 'ub': np.inf}, **params)
+    if classifier == 'secsvm':
+        model = SecSVM(tol=epsilon, random_state=random_state_val, warm_start=True, **params)
+    elif classifier == 'parallel_secsvm':
+        model = ParallelSecSVM(tol=epsilon, random_state=random_state_val, warm_start=True, **params)
+    else:
+        raise ValueError(f'unknown classifier: {classifier}')
+    if sparse.issparse(X_train):
+        X_train = sparse.csr_matrix(X_train)
+        X_train.sort_indices()
+    y_train = np.asarray(y_train)
+
+    path = []
+    coefs = []
+    intercepts = []
+    for C in sorted(Cs):
+        model.set_params(C=C)
+        start = time.perf_counter()
+        model.fit(X_train, y_train)
+        fit_time = time.perf_counter() - start
+        accuracy, precision, recall = evaluate_model(model, X_val, y_val)
+        w = model.coef_.ravel()
+        path.append({'C': C, 'n_iter': model.n_iter_, 'objective': model.objective_[-1],
+                     'accuracy': accuracy, 'precision': precision, 'recall': recall,
+                     'nonzero': int(np.count_nonzero(w)),
+                     'at_bound': int(np.sum((w <= model.lb) | (w >= model.ub))),
+                     'fit_time': fit_time})
+        coefs.append(w.copy())
+        intercepts.append(model.intercept_[0])
+    return path, np.array(coefs), np.array(intercepts)
+
+
+def train_model_out_of_core(store, C, epsilon, random_state_val, test_size=0.1,
+                            batch_size=1024, epochs=5):
+    """
+        This function trains a linear SVM (hinge loss) on a chunked feature store, streaming
+        mini-batches from disk, so the peak memory depends on the chunk and batch sizes but not
+        on the size of the corpus. The scaling statistics are computed in a first streaming pass,
+        and the train/test split is drawn per chunk (see feature_store.split_mask).
+
+    Inputs:
+        store (feature_store.FeatureStore): The feature store.
+        C (float): The regularization parameter (same meaning as in LinearSVC).
+        epsilon (float): The stopping tolerance: the training stops after a pass that lowers the objective
+                         (mean hinge loss of the mini-batches before their update, plus the penalty) by less.
+        random_state_val (int): The seed of the split and of the mini-batch order.
+        test_size (float): The fraction of rows kept for the evaluation.
+        batch_size (int): The number of rows of a mini-batch.
+        epochs (int): The number of passes over the training rows.
+
+    Returns:
+        model (sklearn.linear_model.SGDClassifier): The trained model.
+        scaler (sklearn.preprocessing.StandardScaler): The fitted scaler (without centering).
+    """
+    scaler = StandardScaler(with_mean=False)
+    n_train = 0
+    for chunk_id, X, y in store.iter_chunks():
+        train_rows = ~split_mask(chunk_id, X.shape[0], test_size, random_state_val)
+        if train_rows.any():
+            scaler.partial_fit(X[train_rows])
+            n_train += int(train_rows.sum())
+
+    # partial_fit ignores tol, the stopping test is done here once per pass
+    model = SGDClassifier(loss='hinge', alpha=1.0 / (C * max(n_train, 1)), tol=None,
+                          random_state=random_state_val)
+    rng = np.random.default_rng(random_state_val)
+    best_objective = np.inf
+    for epoch in range(epochs):
+        hinge = 0.0
+        for chunk_id in rng.permutation(len(store.chunks)):
+            X, y = store.load_chunk(chunk_id)
+            train_rows = np.flatnonzero(~split_mask(chunk_id, X.shape[0], test_size, random_state_val))
+            rng.shuffle(train_rows)
+            for start in range(0, len(train_rows), batch_size):
+                rows = train_rows[start:start + batch_size]
+                X_batch = scaler.transform(X[rows])
+                # the loss of the batch before the model learns from it (1 per row for the initial zero model)
+                if hasattr(model, 'coef_'):
+                    margins = (2 * np.asarray(y[rows]) - 1) * model.decision_function(X_batch)
+                    hinge += float(np.maximum(0.0, 1.0 - margins).sum())
+                else:
+                    hinge += float(len(rows))
+                model.partial_fit(X_batch, y[rows], classes=[0, 1])
+        objective = hinge / max(n_train, 1) + 0.5 * model.alpha * float(np.dot(model.coef_.ravel(),
+                                                                                 model.coef_.ravel()))
+        if objective > best_objective - epsilon:
+            break
+        best_objective = min(best_objective, objective)
+    return model, scaler
+
+
+def evaluate_model_out_of_core(model, scaler, store, random_state_val, test_size=0.1):
+    """
+    This function evaluates a model on the test rows of a chunked feature store, one chunk at a time.
+
+    Inputs:
+        model (sklearn linear model): The trained model.
+        scaler (sklearn.preprocessing.StandardScaler): The fitted scaler.
+        store (feature_store.FeatureStore): The feature store.
+        random_state_val (int): The seed the split was drawn with.
+        test_size (float): The fraction of test rows the split was drawn with.
+
+    Returns:
+        accuracy (float): The accuracy score of the model.
+        precision (float): The precision score of the model.
+        recall (float): The recall score of the model.
+    """
+    counts = {'tp': 0, 'fp': 0, 'tn': 0, 'fn': 0}
+    for chunk_id, X, y in store.iter_chunks():
+        test_rows = split_mask(chunk_id, X.shape[0], test_size, random_state_val)
+        if not test_rows.any():
+            continue
+        chunk_counts = confusion_at(y[test_rows], model.decision_function(scaler.transform(X[test_rows])))
+        for name in counts:
+            counts[name] += chunk_counts[name]
+    metrics = metrics_from_counts(**counts)
+    return float(metrics['accuracy']), float(metrics['precision']), float(metrics['recall'])
+
+
+def evaluate_model(model, X_test, y_test, threshold=0.0):
+    """
+    This function evaluates a model on the test data, from a single pass of decision_function.
 
     Inputs:
         model (sklearn.svm.LinearSVC): The trained model.
         X_test (numpy.ndarray): The feature values for the test data.
         y_test (numpy.ndarray): The labels for the test data.
+        threshold (float): The decision value above which an app is malicious (0 as in predict).
 
     Returns:
         accuracy (float): The accuracy score of the model.
         precision (float): The precision score of the model.
         recall (float): The recall score of the model.
     """
-    # Predict the labels on the test data using the model
-    # y_pred = model.predict(X_test)
-    threshold = 0.5
-    y_pred = model.predict(X_test)
-    # y_pred[y_pred >= threshold] = 1
-    # y_pred[y_pred < threshold] = 0
-    # Compute the accuracy, precision, and recall scores
-    accuracy = accuracy_score(y_test, y_pred)
-    precision = precision_score(y_test, y_pred)
-    recall = recall_score(y_test, y_pred)
-    # plotting(y_pred[:100], y_test[:100])
+    metrics = metrics_from_counts(**confusion_at(y_test, model.decision_function(X_test), threshold))
+    return float(metrics['accuracy']), float(metrics['precision']), float(metrics['recall'])
+
+
+def evaluate_model_curves(model, X_test, y_test, threshold=0.0, target_fprs=TARGET_FPRS):
+    """
+    This function evaluates a model at every threshold at once: the decision values are computed once,
+    and the ROC and precision-recall curves, their areas and the operating points of the target false
+    positive rates come from one sort of them (see evaluation.evaluate_scores).
+
+    Inputs:
+        model (sklearn.svm.LinearSVC): The trained model.
+        X_test (numpy.ndarray): The feature values for the test data.
+        y_test (numpy.ndarray): The labels for the test data.
+        threshold (float): The decision threshold of the confusion matrix.
+        target_fprs (tuple): The target false positive rates.
 
-    return accuracy, precision, recall
+    Returns:
+        report (dict): The evaluation report.
+    """
+    return evaluate_scores(y_test, model.decision_function(X_test), threshold, target_fprs)
 
 
-def classify_apk(model, apk_features):
+def classify_apk(model, apk_features, scaler=None):
     """
         This function makes a prediction for a new APK by using the trained model to classify the APK based on its features.
 
     Inputs:
         model (sklearn.svm.LinearSVC): The trained model.
-        apk_features (numpy.ndarray): The feature values for the new APK.
+        apk_features (numpy.ndarray or scipy.sparse.csr_matrix): The (unscaled) feature values for the new APK.
+        scaler (sklearn transformer): The scaler fitted at training time (see classification_utils.load_preprocessor).
 
     Returns:
         label (int): The predicted label for the new APK.
     """
+    if scaler is not None:
+        apk_features = scaler.transform(apk_features)
     return model.predict(apk_features)
+
+
+def explain_predictions(model, X, feature_names, scaler=None, top=5):
+    """
+    This function explains the decisions of a linear model on several apks: the features with the
+    largest contributions (weight times scaled value) to every decision value, from one sparse
+    elementwise product of the rows with the weights.
+
+    Inputs:
+        model (sklearn.svm.LinearSVC): The trained model.
+        X (numpy.ndarray or scipy.sparse.csr_matrix): The (unscaled) feature values of the apks.
+        feature_names (list): The name of every column of X.
+        scaler (sklearn transformer): The scaler fitted at training time.
+        top (int): The number of features per explanation.
+
+    Returns:
+        explanations (list): For every apk, the (feature name, contribution) pairs, the largest first.
+    """
+    if scaler is not None:
+        X = scaler.transform(X)
+    contributions = sparse.csr_matrix(X).multiply(model.coef_.ravel()).tocsr()
+    contributions.eliminate_zeros()
+    rows = np.repeat(np.arange(contributions.shape[0]), np.diff(contributions.indptr))
+    return top_contributions(rows, contributions.indices, contributions.data, contributions.shape[0], top,
+                             np.array(feature_names, dtype=object))
@@ -1,43 +1,103 @@
-from sklearn.preprocessing import StandardScaler, LabelEncoder
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.preprocessing import StandardScaler, MaxAbsScaler, LabelEncoder
+from scipy.sparse import issparse
 import numpy as np
+import os
+import pickle
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
 
-def preprocess_data(X, y):
+def build_scaler(scaling='standard'):
+    """
+        This function creates the feature scaler. Both choices keep a sparse matrix sparse.
+
+    Inputs:
+        scaling (str): 'standard' to divide every feature by its standard deviation (without centering),
+                       'maxabs' to divide every feature by its maximum absolute value (the identity on binary features).
+
+    Returns:
+        scaler (sklearn transformer): The unfitted scaler.
+    """
+    if scaling == 'standard':
+        return StandardScaler(with_mean=False)
+    if scaling == 'maxabs':
+        return MaxAbsScaler()
+    raise ValueError(f'unknown scaling: {scaling}')
+
+
+def preprocess_data(X, y, scaling='standard'):
     """"
         This function preprocesses the input data by scaling the feature values and encoding the labels as integers.
+        The scaling never centers the data, so a sparse matrix stays sparse.
 
     Inputs:
-        X (pandas.DataFrame or numpy.ndarray): The feature values to be processed.
+        X (scipy.sparse.csr_matrix or numpy.ndarray): The feature values to be processed.
         y (pandas.Series or numpy.ndarray): The labels to be processed.
+        scaling (str): The scaling method (see build_scaler).
 
     Returns:
-        X_scaled (numpy.ndarray): The scaled feature values.
+        X_scaled (scipy.sparse.csr_matrix or numpy.ndarray): The scaled feature values.
         y_encoded (numpy.ndarray): The encoded labels.
+        scaler (sklearn transformer): The fitted scaler, to apply the same scaling when scoring.
+        le (sklearn.preprocessing.LabelEncoder): The fitted label encoder.
 
     """
-    # Scale the feature values using a StandardScaler
-    scaler = StandardScaler()
+    scaler = build_scaler(scaling)
     X_scaled = scaler.fit_transform(X)
 
     # Encode the labels as integers
     le = LabelEncoder()
     y_encoded = le.fit_transform(y)
 
-    return X_scaled, y_encoded
+    return X_scaled, y_encoded, scaler, le
 
 
-def compute_subgradients(v, X, y, C, sample_size):
+def save_preprocessor(path, scaler, le):
+    """
+    This function persists the fitted scaler and label encoder, so scoring reuses the training preprocessing.
+
+    Inputs:
+        path (str): The filepath of the pickle file.
+        scaler (sklearn transformer): The fitted scaler.
+        le (sklearn.preprocessing.LabelEncoder): The fitted label encoder.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, 'wb') as f:
+        pickle.dump({'scaler': scaler, 'label_encoder': le}, f)
+
+
+def load_preprocessor(path):
+    """
+    This function loads the scaler and label encoder saved by save_preprocessor.
+
+    Inputs:
+        path (str): The filepath of the pickle file.
+
+    Returns:
+        scaler (sklearn transformer): The fitted scaler.
+        le (sklearn.preprocessing.LabelEncoder): The fitted label encoder.
+    """
+    with open(path, 'rb') as f:
+        preprocessor = pickle.load(f)
+    return preprocessor['scaler'], preprocessor['label_encoder']
+
+
+def compute_subgradients(v, X, y, C, sample_size, rng=None, sample_indices=None):
     """
         This function computes the subgradients of the objective function for a given set of model parameters.
+        The hinge-loss term is estimated on a sample of the rows and rescaled to the whole training set.
 
     Inputs:
         v (tuple): A tuple containing the weights and bias term of the model.
-        X (numpy.ndarray): The feature values of the training data.
-        y (numpy.ndarray): The labels of the training data.
+        X (numpy.ndarray or scipy.sparse.csr_matrix): The feature values of the training data.
+        y (numpy.ndarray): The labels of the training data (-1/+1).
         C (float): The regularization parameter.
         sample_size (int): The size of the sample subset used to approximate the subgradients.
+        rng (numpy.random.Generator): The generator drawing the sample (drawn with replacement, in O(sample_size)).
+        sample_indices (numpy.ndarray): The rows of the sample, instead of drawing them (e.g. a mini-batch).
 
     Returns:
         subgrad_w (numpy.ndarray): The subgradient of the objective function with respect to the weights.
@@ -45,51 +105,135 @@ def compute_subgradients(v, X, y, C, sample_size):
     """
 
     w, b = v
-    n = len(X)
-    # if sample_size > n:
-    #     sample_size = n
-    # # n = len(X)
-    sample_size = min(n, sample_size)
-    margin = y * (np.dot(X, w) + b)
-    hinge_loss = np.maximum(0, 1 - margin)
-    hinge_loss[hinge_loss == 0] = 1
-    sample_indices = np.random.choice(n, sample_size, replace=False)
+    n = X.shape[0]
+    if sample_indices is None:
+        rng = np.random.default_rng() if rng is None else rng
+        sample_indices = rng.integers(0, n, size=min(n, sample_size))
     X_sample = X[sample_indices]
     y_sample = y[sample_indices]
-    margin_sample = y_sample * (np.dot(X_sample, w) + b)
-    hinge_loss_sample = np.maximum(0, 1 - margin_sample)
-    subgrad_w = w - C * \
-        np.sum(X_sample * y_sample[:, np.newaxis] *
-               hinge_loss_sample[:, np.newaxis], axis=0)
-    subgrad_b = - C * np.sum(y_sample * hinge_loss_sample)
+    margin_sample = y_sample * (X_sample @ w + b)
+    # samples inside the margin contribute -y * x to the hinge-loss subgradient
+    coefficients = np.where(margin_sample < 1, y_sample, 0).astype(np.float64)
+    scale = C * n / len(sample_indices)
+    subgrad_w = w - scale * (X_sample.T @ coefficients)
+    subgrad_b = - scale * np.sum(coefficients)
     return subgrad_w, subgrad_b
 
 
-def compute_objective_function(v, X, y, C, sample_size):
+def compute_objective_function(v, X, y, C, sample_size=None, rng=None):
     """
-    This function computes the objective function value for a given set of model parameters.
+    This function computes the objective function value for a given set of model parameters:
+    0.5 * ||w||^2 + C * sum of the hinge losses (the LinearSVC objective).
 
     Inputs:
         v (tuple): A tuple containing the weights and bias term of the model.
-        X (numpy.ndarray): The feature values of the training data.
-        y (numpy.ndarray): The labels of the training data.
+        X (numpy.ndarray or scipy.sparse.csr_matrix): The feature values of the training data.
+        y (numpy.ndarray): The labels of the training data (-1/+1).
         C (float): The regularization parameter.
-        sample_size (int): The size of the sample subset used to approximate the objective function value.
+        sample_size (int): The size of the sample subset used to approximate the objective function value, None to use every row.
+        rng (numpy.random.Generator): The generator drawing the sample.
 
     Returns:
         obj_value (float): The value of the objective function.
     """
     w, b = v
-    n = len(X)
-    # if sample_size > n:
-    #     sample_size = n
-    # # n = len(X)
-    sample_size = min(n, sample_size)
-    margin = y * (np.dot(X, w) + b)
+    n = X.shape[0]
+    if sample_size is not None and sample_size < n:
+        rng = np.random.default_rng() if rng is None else rng
+        sample_indices = rng.integers(0, n, size=sample_size)
+        X, y = X[sample_indices], y[sample_indices]
+    margin = y * (X @ w + b)
     hinge_loss = np.maximum(0, 1 - margin)
-    hinge_loss[hinge_loss == 0] = 1
-    sample_indices = np.random.choice(n, sample_size, replace=False)
-    X_sample = X[sample_indices]
-    y_sample = y[sample_indices]
-    obj_value = 0.5 * np.linalg.norm(w) ** 2 + C * np.mean(hinge_loss)
+    obj_value = 0.5 * np.dot(w, w) + C * n * np.mean(hinge_loss)
     return obj_value
+
+
+class SecSVM(BaseEstimator, ClassifierMixin):
+    """
+        Sec-SVM: a linear SVM whose weights are bounded to [lb, ub], so that no single feature can
+        dominate the decision and an attacker has to change many features to evade it.
+        It is trained by projected mini-batch subgradient descent on the LinearSVC objective
+        (compute_subgradients), and works on dense or sparse matrices.
+
+    Inputs:
+        C (float): The regularization parameter.
+        lb (float): The lower bound of the weights.
+        ub (float): The upper bound of the weights.
+        batch_size (int): The number of rows of a mini-batch.
+        max_epochs (int): The maximum number of passes over the training rows.
+        tol (float): Training stops when the relative decrease of the objective over an epoch is below tol.
+        learning_rate (float): The initial step size.
+        random_state (int): The seed of the mini-batch order.
+        warm_start (bool): Whether fit starts from the weights (and the step size) of the previous fit,
+                           e.g. to fit a series of C values (see classification.train_regularization_path).
+    """
+
+    def __init__(self, C=1.0, lb=-1.0, ub=1.0, batch_size=32, max_epochs=100, tol=1e-4,
+                 learning_rate=1.0, random_state=None, warm_start=False):
+        self.C = C
+        self.lb = lb
+        self.ub = ub
+        self.batch_size = batch_size
+        self.max_epochs = max_epochs
+        self.tol = tol
+        self.learning_rate = learning_rate
+        self.random_state = random_state
+        self.warm_start = warm_start
+
+    def _signed_labels(self, y):
+        self.classes_ = np.unique(y)
+        if len(self.classes_) != 2:
+            raise ValueError('SecSVM is a binary classifier')
+        return np.where(y == self.classes_[1], 1.0, -1.0)
+
+    def _fit_signed(self, X, y_signed, w, b, t=0):
+        n = X.shape[0]
+        rng = np.random.default_rng(self.random_state)
+        # the steps follow the objective divided by C * n (mean hinge loss + lam / 2 * ||w||^2)
+        lam = 1.0 / (self.C * n)
+        objective = compute_objective_function((w, b), X, y_signed, self.C)
+        self.objective_ = [objective]
+        self.n_iter_ = 0
+        for epoch in range(self.max_epochs):
+            order = rng.permutation(n)
+            for start in range(0, n, self.batch_size):
+                subgrad_w, subgrad_b = compute_subgradients(
+                    (w, b), X, y_signed, self.C, self.batch_size,
+                    sample_indices=order[start:start + self.batch_size])
+                eta = self.learning_rate / (1.0 + self.learning_rate * lam * t)
+                w = np.clip(w - eta * lam * subgrad_w, self.lb, self.ub)
+                b = b - eta * lam * subgrad_b
+                t += 1
+            self.n_iter_ = epoch + 1
+            previous, objective = objective, compute_objective_function((w, b), X, y_signed, self.C)
+            self.objective_.append(objective)
+            if abs(previous - objective) <= self.tol * max(abs(previous), 1.0):
+                break
+        self.t_ = t
+        self.coef_ = w.reshape(1, -1)
+        self.intercept_ = np.array([b])
+        return self
+
+    def fit(self, X, y):
+        """
+        This function trains the model.
+
+        Inputs:
+            X (numpy.ndarray or scipy.sparse.csr_matrix): The feature values of the training data.
+            y (numpy.ndarray): The labels of the training data.
+
+        Returns:
+            self (SecSVM): The trained model.
+        """
+        if issparse(X):
+            X = X.tocsr()
+        y_signed = self._signed_labels(np.asarray(y))
+        if self.warm_start and getattr(self, 'coef_', None) is not None and self.coef_.shape[1] == X.shape[1]:
+            return self._fit_signed(X, y_signed, self.coef_.ravel().copy(), float(self.intercept_[0]), self.t_)
+        return self._fit_signed(X, y_signed, np.zeros(X.shape[1]), 0.0)
+
+    def decision_function(self, X):
+        return np.asarray(X @ self.coef_.ravel()).ravel() + self.intercept_[0]
+
+    def predict(self, X):
+        return self.classes_[(self.decision_function(X) > 0).astype(int)]
@@ -0,0 +1,127 @@
+import os
+from multiprocessing import Pool
+import numpy as np
+from sklearn.model_selection import StratifiedKFold
+from classification import train_model, evaluate_model
+from classification_utils import build_scaler
+from feature_selection import select_features
+from shared_data import share_csr, attach_csr, release_blocks
+import warnings
+warnings.simplefilter(action='ignore', category=FutureWarning)
+
+METRICS = ('accuracy', 'precision', 'recall')
+
+# the shared dataset of the worker processes: (X, y, folds, blocks)
+_dataset = None
+
+
+def stratified_folds(y, n_splits=5, random_state=0):
+    """
+    This function assigns every row to a test fold, keeping the proportion of every label in every fold.
+
+    Inputs:
+        y (numpy.ndarray): The labels.
+        n_splits (int): The number of folds.
+        random_state (int): The seed of the shuffling.
+
+    Returns:
+        folds (numpy.ndarray): The test fold of every row (fold k trains on the rows where folds != k).
+    """
+    y = np.asarray(y)
+    folds = np.empty(len(y), dtype=np.int8)
+    splitter = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+    for fold, (_, test_rows) in enumerate(splitter.split(np.zeros(len(y)), y)):
+        folds[test_rows] = fold
+    return folds
+
+
+def _init_worker(handle):
+    global _dataset
+    X, arrays, blocks = attach_csr(handle)
+    _dataset = (X, arrays['labels'], arrays['folds'], blocks)
+
+
+def _run_fold(task):
+    fold, C, epsilon, random_state_val, classifier, scaling, selection, params = task
+    X, y, folds, _ = _dataset
+    train_rows = np.flatnonzero(folds != fold)
+    test_rows = np.flatnonzero(folds == fold)
+    X_train, X_test = X[train_rows], X[test_rows]
+    # the preprocessing is fitted on the training rows of the fold only, as in the final training
+    if scaling is not None:
+        scaler = build_scaler(scaling).fit(X_train)
+        X_train, X_test = scaler.transform(X_train), scaler.transform(X_test)
+    if selection is not None:
+        columns = select_features(X_train, y[train_rows], **selection)
+        X_train, X_test = X_train[:, columns], X_test[:, columns]
+    # a fold runs in a pool worker, where ParallelSecSVM and BaggedLinearSVM train without processes of their own
+    model = train_model(X_train, y[train_rows], C=C, epsilon=epsilon,
+                        random_state_val=random_state_val, classifier=classifier, **params)
+    accuracy, precision, recall = evaluate_model(model, X_test, y[test_rows])
+    return {'fold': fold, 'n_train': len(train_rows), 'n_test': len(test_rows), 'n_features': X_train.shape[1],
+            'accuracy': accuracy, 'precision': precision, 'recall': recall}
+
+
+def cross_validate(X, y, C, epsilon, random_state_val, classifier='linearsvc', n_splits=5,
+                   folds=None, n_jobs=None, scaling=None, selection=None, classifier_params=None):
+    """
+    This function evaluates the model by stratified k-fold cross-validation. The fold of every row
+    is computed once, and the folds are trained in parallel by worker processes that attach to the
+    matrix in shared memory instead of receiving a copy. The scaling and the feature selection are
+    fitted in every fold on its training rows, so the test rows of a fold never influence them.
+
+    Inputs:
+        X (scipy.sparse.csr_matrix): The feature matrix (unscaled when scaling is given).
+        y (numpy.ndarray): The encoded labels.
+        C (float): The regularization parameter.
+        epsilon (float): A small constant used to determine when to stop the training.
+        random_state_val (int): The seed of the folds and of the classifier.
+        classifier (str): The classifier (see classification.train_model).
+        n_splits (int): The number of folds.
+        folds (numpy.ndarray): The test fold of every row (see stratified_folds), to reuse the same folds
+                               when comparing settings.
+        n_jobs (int): The number of worker processes (default: one per fold, at most the number of cores).
+        scaling (str): The scaling fitted in every fold (see classification_utils.build_scaler), None if X is
+                       already scaled.
+        selection (dict): The parameters of feature_selection.select_features applied in every fold
+                          (e.g. {'method': 'chi2', 'k': 2000, 'min_df': 2}), None to keep every feature.
+        classifier_params (dict): Extra parameters of the classifier (see classification.train_model).
+
+    Returns:
+        results (list): The metrics of every fold, as dicts.
+        summary (dict): The mean and the variance of every metric over the folds.
+    """
+    if folds is None:
+        folds = stratified_folds(y, n_splits, random_state_val)
+    n_splits = int(folds.max()) + 1
+    handle, blocks = share_csr(X, np.asarray(y), folds=folds)
+    try:
+        with Pool(n_jobs or min(n_splits, os.cpu_count()), initializer=_init_worker,
+                  initargs=(handle,)) as pool:
+            tasks = [(fold, C, epsilon, random_state_val, classifier, scaling, selection, classifier_params or {})
+                     for fold in range(n_splits)]
+            results = pool.map(_run_fold, tasks, chunksize=1)
+    finally:
+        release_blocks(blocks, unlink=True)
+    summary = {}
+    for metric in METRICS:
+        values = np.array([result[metric] for result in results])
+        summary[metric] = {'mean': float(values.mean()), 'var': float(values.var(ddof=1)) if len(values) > 1 else 0.0}
+    return results, summary
+
+
+def print_cross_validation(results, summary):
+    """
+    This function prints the metrics of every fold and their mean, variance and standard deviation.
+
+    Inputs:
+        results (list): The metrics of every fold returned by cross_validate.
+        summary (dict): The summary returned by cross_validate.
+    """
+    print(f'{"fold":>5} {"train":>7} {"test":>6} {"features":>9} {"accuracy":>9} {"precision":>10} {"recall":>7}')
+    for result in results:
+        print(f'{result["fold"]:>5} {result["n_train"]:>7} {result["n_test"]:>6} {result["n_features"]:>9} '
+              f'{result["accuracy"]:>9.3f} {result["precision"]:>10.3f} {result["recall"]:>7.3f}')
+    for metric in METRICS:
+        mean, var = summary[metric]['mean'], summary[metric]['var']
+        print(f'{metric}: {mean:.3f} (variance {var:.5f}, std {np.sqrt(var):.3f})')
@@ -0,0 +1,167 @@
+import multiprocessing
+import os
+from multiprocessing import Pool
+import numpy as np
+from sklearn.base import BaseEstimator, ClassifierMixin
+from shared_data import share_csr, attach_csr, release_blocks
+import warnings
+warnings.simplefilter(action='ignore', category=FutureWarning)
+
+# the base classifiers a member can be, the parallel ones cannot run in the worker processes
+BASE_CLASSIFIERS = ('linearsvc', 'secsvm')
+# the shared dataset of the worker processes: (X, y, blocks)
+_dataset = None
+
+
+def _init_worker(handle):
+    global _dataset
+    X, arrays, blocks = attach_csr(handle)
+    _dataset = (X, arrays['labels'], blocks)
+
+
+def draw_member(y, seed, bootstrap=True, max_samples=1.0, max_features=1.0, n_features=None):
+    """
+    This function draws the training rows and columns of an ensemble member. The rows are drawn
+    within every class, so that every member sees both labels in the same proportion.
+
+    Inputs:
+        y (numpy.ndarray): The labels.
+        seed (numpy.random.SeedSequence): The seed of the member.
+        bootstrap (bool): Whether the rows are drawn with replacement.
+        max_samples (float): The fraction of the rows of every class drawn.
+        max_features (float): The fraction of the columns drawn (without replacement).
+        n_features (int): The number of columns.
+
+    Returns:
+        rows (numpy.ndarray): The training rows of the member.
+        columns (numpy.ndarray): The sorted columns of the member.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for label in np.unique(y):
+        members = np.flatnonzero(y == label)
+        size = max(1, int(round(max_samples * len(members))))
+        rows.append(rng.choice(members, size, replace=bootstrap or size > len(members)))
+    rows = np.sort(np.concatenate(rows))
+    n_columns = max(1, int(round(max_features * n_features)))
+    columns = np.arange(n_features) if n_columns >= n_features else \
+        np.sort(rng.choice(n_features, n_columns, replace=False))
+    return rows, columns
+
+
+def _fit_member(task, dataset=None):
+    # classification imports this module for train_model, so it is imported here
+    from classification import train_model
+    seed, sampling, C, tol, base, params = task
+    X, y, _ = dataset or _dataset
+    rows, columns = draw_member(y, seed, n_features=X.shape[1], **sampling)
+    X_member = X[rows] if len(columns) == X.shape[1] else X[rows][:, columns]
+    # the solver of every member gets its own seed, derived from the seed of the member
+    model = train_model(X_member, y[rows], C=C, epsilon=tol,
+                        random_state_val=int(seed.generate_state(1)[0]), classifier=base, **params)
+    return columns, model.coef_.ravel(), float(model.intercept_[0])
+
+
+class BaggedLinearSVM(BaseEstimator, ClassifierMixin):
+    """
+    A bagged ensemble of linear SVMs: the members are trained on stratified bootstrap samples of the
+    rows (and optionally random subsets of the features) by worker processes attached to the matrix
+    in shared memory. Since the members are linear, the ensemble collapses into the average of their
+    weights (a feature a member did not see has a zero weight in it), and scoring costs as much as a
+    single model. With keep_members, the weights of the members are kept to estimate the variance
+    of the decision values.
+
+    Inputs:
+        C (float): The regularization parameter of the members.
+        tol (float): The stopping tolerance of the members.
+        random_state (int): The seed of the samples and of the members.
+        n_estimators (int): The number of members.
+        base (str): The classifier of the members, one of BASE_CLASSIFIERS (see classification.train_model).
+        bootstrap (bool): Whether the rows are drawn with replacement.
+        max_samples (float): The fraction of the rows of every class a member trains on.
+        max_features (float): The fraction of the features a member trains on.
+        keep_members (bool): Whether to keep the weights of every member.
+        n_jobs (int): The number of worker processes (default: one per member, at most the number of cores).
+                      In a daemonic process (e.g. a worker of a multiprocessing pool), which cannot start
+                      processes, the members are trained one after the other in the process itself.
+        base_params (dict): Extra parameters of the members (e.g. lb and ub for SecSVM).
+    """
+
+    def __init__(self, C=1.0, tol=1e-4, random_state=None, n_estimators=10, base='linearsvc', bootstrap=True,
+                 max_samples=1.0, max_features=1.0, keep_members=False, n_jobs=None, base_params=None):
+        self.C = C
+        self.tol = tol
+        self.random_state = random_state
+        self.n_estimators = n_estimators
+        self.base = base
+        self.bootstrap = bootstrap
+        self.max_samples = max_samples
+        self.max_features = max_features
+        self.keep_members = keep_members
+        self.n_jobs = n_jobs
+        self.base_params = base_params
+
+    def fit(self, X, y):
+        """
+        This function trains the members in parallel and averages them.
+
+        Inputs:
+            X (numpy.ndarray or scipy.sparse.csr_matrix): The feature values of the training data.
+            y (numpy.ndarray): The labels of the training data.
+
+        Returns:
+            self (BaggedLinearSVM): The trained ensemble.
+        """
+        y = np.asarray(y)
+        self.classes_ = np.unique(y)
+        if len(self.classes_) != 2:
+            raise ValueError('BaggedLinearSVM is a binary classifier')
+        if self.base not in BASE_CLASSIFIERS:
+            raise ValueError(f'unknown base classifier: {self.base} (expected one of {", ".join(BASE_CLASSIFIERS)})')
+        n_features = X.shape[1]
+        seeds = np.random.SeedSequence(self.random_state).spawn(self.n_estimators)
+        sampling = {'bootstrap': self.bootstrap, 'max_samples': self.max_samples,
+                    'max_features': self.max_features}
+        tasks = [(seed, sampling, self.C, self.tol, self.base, self.base_params or {}) for seed in seeds]
+        if multiprocessing.current_process().daemon:
+            members = [_fit_member(task, (X, y, None)) for task in tasks]
+        else:
+            handle, blocks = share_csr(X, y)
+            try:
+                with Pool(self.n_jobs or min(self.n_estimators, os.cpu_count()), initializer=_init_worker,
+                          initargs=(handle,)) as pool:
+                    members = pool.map(_fit_member, tasks, chunksize=1)
+            finally:
+                release_blocks(blocks, unlink=True)
+        coefs = np.zeros((self.n_estimators, n_features))
+        intercepts = np.empty(self.n_estimators)
+        for k, (columns, coef, intercept) in enumerate(members):
+            coefs[k, columns] = coef
+            intercepts[k] = intercept
+        self.coef_ = coefs.mean(axis=0).reshape(1, -1)
+        self.intercept_ = np.array([intercepts.mean()])
+        self.members_coef_ = coefs if self.keep_members else None
+        self.members_intercept_ = intercepts if self.keep_members else None
+        return self
+
+    def decision_function(self, X):
+        return np.asarray(X @ self.coef_.ravel()).ravel() + self.intercept_[0]
+
+    def predict(self, X):
+        return self.classes_[(self.decision_function(X) > 0).astype(int)]
+
+    def decision_variance(self, X):
+        """
+        This function estimates the variance of the decision values over the members
+        (the ensemble must be trained with keep_members).
+
+        Inputs:
+            X (numpy.ndarray or scipy.sparse.csr_matrix): The feature values.
+
+        Returns:
+            variance (numpy.ndarray): The variance of the decision value of every row.
+        """
+        if self.members_coef_ is None:
+            raise ValueError('the members are only kept when training with keep_members=True')
+        scores = np.asarray(X @ self.members_coef_.T) + self.members_intercept_
+        return scores.var(axis=1, ddof=1) if self.n_estimators > 1 else np.zeros(X.shape[0])
@@ -0,0 +1,156 @@
+import numpy as np
+
+# the false positive rates the operating points are reported at
+TARGET_FPRS = (0.0001, 0.001, 0.01, 0.05)
+
+
+def confusion_at(y, scores, threshold=0.0):
+    """
+    This function computes the confusion matrix of decision values at a threshold
+    (a decision value above the threshold is malicious, as in predict for a threshold of 0).
+
+    Inputs:
+        y (numpy.ndarray): The labels (1 for malicious).
+        scores (numpy.ndarray): The decision values.
+        threshold (float): The decision threshold.
+
+    Returns:
+        counts (dict): tp, fp, tn and fn.
+    """
+    y = np.asarray(y) == 1
+    predicted = np.asarray(scores) > threshold
+    tp = int(np.count_nonzero(predicted & y))
+    fp = int(np.count_nonzero(predicted & ~y))
+    return {'tp': tp, 'fp': fp, 'tn': int(len(y) - np.count_nonzero(y)) - fp,
+            'fn': int(np.count_nonzero(y)) - tp}
+
+
+def metrics_from_counts(tp, fp, tn, fn):
+    """
+    This function derives the accuracy, precision, recall and false positive rate of a confusion matrix
+    (arrays of counts give arrays of metrics).
+    """
+    tp, fp, tn, fn = (np.asarray(count, dtype=np.float64) for count in (tp, fp, tn, fn))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        accuracy = np.nan_to_num((tp + tn) / (tp + fp + tn + fn))
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+        recall = np.where(tp + fn > 0, tp / (tp + fn), 0.0)
+        fpr = np.where(fp + tn > 0, fp / (fp + tn), 0.0)
+    return {'accuracy': accuracy, 'precision': precision, 'recall': recall, 'fpr': fpr}
+
+
+def threshold_sweep(y, scores):
+    """
+    This function computes the confusion matrix at every distinct threshold with a single sort of the
+    decision values: the apps are ranked by decreasing score, and the true and false positives of the
+    threshold just below a score are cumulative sums over the ranking.
+
+    Inputs:
+        y (numpy.ndarray): The labels (1 for malicious).
+        scores (numpy.ndarray): The decision values.
+
+    Returns:
+        sweep (dict): The thresholds (decreasing, a decision value above the threshold is malicious as in
+                      confusion_at; the first one is +inf, nothing malicious, and every other one lies
+                      between a distinct score and the next lower one) and the tp, fp, tn, fn,
+                      accuracy, precision, recall (tpr) and fpr at every threshold.
+    """
+    y = np.asarray(y) == 1
+    scores = np.asarray(scores, dtype=np.float64)
+    if len(scores) == 0:
+        raise ValueError('cannot sweep the thresholds of an empty set of decision values')
+    order = np.argsort(-scores, kind='mergesort')
+    scores, y = scores[order], y[order]
+    # the last app of every run of equal scores
+    last = np.r_[np.flatnonzero(np.diff(scores)), len(scores) - 1]
+    tp = np.r_[0, np.cumsum(y)[last]]
+    fp = np.r_[0, last + 1 - tp[1:]]
+    positives, negatives = int(y.sum()), int(len(y) - y.sum())
+    # the threshold of a distinct score is the middle of the gap to the next lower score (that score
+    # itself when the gap is too small to split), so that score > threshold selects the apps above it
+    distinct = scores[last]
+    lower = np.r_[distinct[1:], np.nextafter(distinct[-1], -np.inf)]
+    middle = distinct / 2 + lower / 2
+    thresholds = np.where(middle < distinct, middle, lower)
+    sweep = {'thresholds': np.r_[np.inf, thresholds], 'tp': tp, 'fp': fp,
+             'tn': negatives - fp, 'fn': positives - tp}
+    sweep.update(metrics_from_counts(sweep['tp'], sweep['fp'], sweep['tn'], sweep['fn']))
+    return sweep
+
+
+def roc_auc(sweep):
+    """
+    This function computes the area under the ROC curve of a threshold sweep (trapezoidal rule).
+    The area is undefined (nan) when the labels hold a single class.
+    """
+    if sweep['tp'][-1] == 0 or sweep['fp'][-1] == 0:
+        return float('nan')
+    fpr, tpr = sweep['fpr'], sweep['recall']
+    return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+
+
+def average_precision(sweep):
+    """
+    This function computes the area under the precision-recall curve of a threshold sweep, as the
+    precision averaged over the recall steps. It is undefined (nan) without malicious apps.
+    """
+    if sweep['tp'][-1] == 0:
+        return float('nan')
+    return float(np.sum(np.diff(sweep['recall']) * sweep['precision'][1:]))
+
+
+def operating_points(sweep, target_fprs=TARGET_FPRS):
+    """
+    This function finds, for every target false positive rate, the threshold with the highest recall
+    whose false positive rate does not exceed the target.
+
+    Inputs:
+        sweep (dict): The threshold sweep.
+        target_fprs (tuple): The target false positive rates.
+
+    Returns:
+        points (list): One dict per target: target_fpr, threshold, fpr, recall, precision, tp and fp.
+    """
+    points = []
+    for target in target_fprs:
+        # the fpr grows along the sweep, the last threshold within the target has the highest recall
+        k = int(np.searchsorted(sweep['fpr'], target, side='right')) - 1
+        points.append({'target_fpr': target, 'threshold': float(sweep['thresholds'][k]),
+                       'fpr': float(sweep['fpr'][k]), 'recall': float(sweep['recall'][k]),
+                       'precision': float(sweep['precision'][k]),
+                       'tp': int(sweep['tp'][k]), 'fp': int(sweep['fp'][k])})
+    return points
+
+
+def evaluate_scores(y, scores, threshold=0.0, target_fprs=TARGET_FPRS):
+    """
+    This function evaluates decision values at once: the metrics at the decision threshold, the ROC and
+    precision-recall curves with their areas, and the operating points of the target false positive rates.
+
+    Inputs:
+        y (numpy.ndarray): The labels (1 for malicious).
+        scores (numpy.ndarray): The decision values.
+        threshold (float): The decision threshold of the metrics.
+        target_fprs (tuple): The target false positive rates.
+
+    Returns:
+        report (dict): The confusion matrix and metrics at the threshold, roc_auc, average_precision,
+                       the operating points and the sweep itself (the curves).
+    """
+    counts = confusion_at(y, scores, threshold)
+    report = dict(counts, **{name: float(value) for name, value in metrics_from_counts(**counts).items()})
+    sweep = threshold_sweep(y, scores)
+    report.update({'threshold': threshold, 'roc_auc': roc_auc(sweep),
+                   'average_precision': average_precision(sweep),
+                   'operating_points': operating_points(sweep, target_fprs), 'sweep': sweep})
+    return report
+
+
+def print_evaluation(report):
+    print(f'ROC AUC: {report["roc_auc"]:.4f}   average precision: {report["average_precision"]:.4f}')
+    print(f'confusion matrix at {report["threshold"]:g}: tp={report["tp"]} fp={report["fp"]} '
+          f'tn={report["tn"]} fn={report["fn"]}')
+    print(f'{"target FPR":>10} {"threshold":>10} {"FPR":>8} {"recall":>7} {"precision":>10}')
+    for point in report['operating_points']:
+        print(f'{point["target_fpr"]:>10g} {point["threshold"]:>10.4f} {point["fpr"]:>8.4f} '
+              f'{point["recall"]:>7.3f} {point["precision"]:>10.3f}')
@@ -0,0 +1,74 @@
+# the feature families of report_to_feature_vector, by the report key they are read from
+FAMILIES = ('app_permissions', 'intents', 'activities', 's_and_r', 'providers', 'features',
+            'api_calls', 'api_permissions', 'interesting_calls', 'urls')
+# the families found in the smali code, they need the apk to be unpacked and decompiled
+DEXFAMILIES = ('api_calls', 'api_permissions', 'interesting_calls', 'urls')
+# the families read from the manifest (and aapt), cheap to extract
+MANIFESTFAMILIES = tuple(family for family in FAMILIES if family not in DEXFAMILIES)
+
+
+def featureName(family, value):
+    # the name report_to_feature_vector gives to a finding
+    return '{}::{}'.format(family, value.strip()).replace('.', '_')
+
+
+class ExtractionPlan:
+    """
+    The features a model actually uses, so that staticAnalyzer.analyze only looks for them:
+    the stages of unused families are skipped, and the API calls and suspicious calls the
+    smali files are scanned for are restricted to the ones giving a used feature.
+
+    A plan built from names it cannot map to a family (e.g. the buckets of a hashed model)
+    extracts everything.
+
+    Inputs:
+        featureNames (iterable): The names of the features with a non-zero weight.
+    """
+
+    def __init__(self, featureNames):
+        self.features = set()
+        self.families = set()
+        self.complete = False
+        for name in featureNames:
+            family = name.split('::', 1)[0]
+            if family not in FAMILIES:
+                self.complete = True
+                continue
+            self.features.add(name)
+            self.families.add(family)
+
+    def uses(self, family):
+        """
+        This function tells whether some feature of a family is used.
+        """
+        return self.complete or family in self.families
+
+    def usesFeature(self, family, value):
+        """
+        This function tells whether the feature of a finding is used.
+        """
+        return self.complete or featureName(family, value) in self.features
+
+    def usesPrefix(self, family, prefix):
+        """
+        This function tells whether a feature starting with a prefix is used
+        (the findings built at analysis time, such as the Cipher algorithms).
+        """
+        if self.complete:
+            return True
+        start = featureName(family, prefix)
+        return any(name.startswith(start) for name in self.features)
+
+    def needsDex(self):
+        """
+        This function tells whether the apk has to be unpacked and decompiled.
+        """
+        return any(self.uses(family) for family in DEXFAMILIES)
+
+    def stats(self):
+        if self.complete:
+            return {'complete': True}
+        counts = {family: 0 for family in FAMILIES}
+        for name in self.features:
+            counts[name.split('::', 1)[0]] += 1
+        return {'complete': False, 'features': len(self.features), 'families': counts}
@@ -0,0 +1,81 @@
+import hashlib
+from array import array
+
+
+class FeatureHasher:
+    """
+    A hashing-trick vectorizer for the feature reports of report_to_feature_vector.
+
+    Every feature name is hashed into one of `dim` buckets, so the size of the vectors
+    (and of any model trained on them) is fixed whatever the number of distinct URLs,
+    activities or providers in the corpus. With signed hashing the value of a feature
+    is +1 or -1 depending on another bit of the hash, so colliding features tend to
+    cancel out instead of adding up.
+
+    Collisions are tracked in bounded memory: the hash of the first name that used
+    each bucket is kept, and a bucket is flagged as collided when a name with a
+    different hash lands in it.
+
+    Inputs:
+        dim (int): The number of buckets (the length of the vectors).
+        signed (bool): Whether to use signed hashing.
+    """
+
+    def __init__(self, dim=2 ** 18, signed=True):
+        self.dim = dim
+        self.signed = signed
+        self.tokens = 0
+        self._owners = array('Q', bytes(8 * dim))
+        self._collided = bytearray(dim)
+        self._bucketsUsed = 0
+        self._bucketsCollided = 0
+
+    def _hash(self, name):
+        digest = int.from_bytes(hashlib.blake2b(
+            name.encode('utf-8'), digest_size=8).digest(), 'little')
+        return digest or 1
+
+    def transform(self, names):
+        """
+        This function hashes the feature names of one report into a sparse vector.
+
+        Inputs:
+            names (iterable): The feature names of the report.
+
+        Returns:
+            indices (list): The sorted indices of the non-zero entries.
+            values (list): The values of the non-zero entries.
+        """
+        vector = {}
+        owners = self._owners
+        for name in names:
+            digest = self._hash(name)
+            index = digest % self.dim
+            owner = owners[index]
+            if owner == 0:
+                owners[index] = digest
+                self._bucketsUsed += 1
+            elif owner != digest and not self._collided[index]:
+                self._collided[index] = 1
+                self._bucketsCollided += 1
+            value = -1 if self.signed and digest >> 63 else 1
+            vector[index] = vector.get(index, 0) + value
+            self.tokens += 1
+        indices = sorted(i for i in vector if vector[i] != 0)
+        return indices, [vector[i] for i in indices]
+
+    def stats(self):
+        """
+        This function returns the collision statistics of the names hashed so far.
+
+        Returns:
+            stats (dict): The number of hashed names, of used and of collided buckets, and the collision rate (collided / used buckets).
+        """
+        return {
+            'dim': self.dim,
+            'tokens': self.tokens,
+            'buckets_used': self._bucketsUsed,
+            'buckets_collided': self._bucketsCollided,
+            'collision_rate': (self._bucketsCollided / self._bucketsUsed
+                               if self._bucketsUsed else 0.0),
+        }
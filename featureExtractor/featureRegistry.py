@@ -0,0 +1,107 @@
+import fcntl
+import os
+
+
+class FeatureRegistry:
+    """
+    A persistent vocabulary mapping every feature name to a stable integer ID.
+
+    The vocabulary is an append-only text file holding one feature name per line,
+    the ID of a feature being its line number. Several extraction processes can
+    share the same file: new names are appended while holding an exclusive lock,
+    after reading the names the other processes appended in the meantime, so an
+    ID is never given twice and never changes once given.
+
+    Inputs:
+        path (str): The path of the vocabulary file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.ids = {}
+        self.names = []
+        self._offset = 0
+        self.refresh()
+
+    def __len__(self):
+        return len(self.names)
+
+    def refresh(self):
+        """
+        This function reads the names appended to the vocabulary file since the last call.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        # only consume complete lines, a writer may be in the middle of a line
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            return
+        for name in data[:end].decode('utf-8').split('\n')[:-1]:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+        self._offset += end
+
+    def _register(self, names):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                missing = []
+                for name in names:
+                    if name not in self.ids and name not in missing:
+                        missing.append(name)
+                if missing:
+                    f.write(''.join(name + '\n' for name in missing).encode('utf-8'))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self.refresh()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def getIds(self, names, grow=True):
+        """
+        This function maps feature names to their IDs.
+
+        Inputs:
+            names (iterable): The feature names.
+            grow (bool): Whether unknown names are added to the vocabulary. If False, they are skipped.
+
+        Returns:
+            ids (list): The sorted IDs of the names.
+        """
+        names = [normalizeName(name) for name in names]
+        if grow:
+            missing = [name for name in names if name not in self.ids]
+            if missing:
+                self._register(missing)
+        ids = self.ids
+        return sorted(set(ids[name] for name in names if name in ids))
+
+    def getNames(self, ids):
+        if ids and max(ids) >= len(self.names):
+            self.refresh()
+        return [self.names[i] for i in ids]
+
+
+def normalizeName(name):
+    # a name is stored on a single line of the vocabulary file
+    return name.replace('\r', ' ').replace('\n', ' ')
+
+
+def loadVocabulary(path):
+    """
+    This function loads the feature names of a vocabulary file, in ID order.
+
+    Inputs:
+        path (str): The path of the vocabulary file.
+
+    Returns:
+        names (list): The feature names, the ID of a name being its index.
+    """
+    return FeatureRegistry(path).names
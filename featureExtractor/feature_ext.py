@@ -61,5 +61,8 @@ def extractDataFromApkFiles():
                     print(e)
                     continue
 
+    if staticAnalyzer.hasher is not None:
+        print('Feature hashing: {}'.format(staticAnalyzer.hasher.stats()))
+
 
 extractDataFromApkFiles()
@@ -0,0 +1,116 @@
+import os
+import ujson as json
+
+# name of the folder (inside the result folder) holding one raw report per apk
+RAWFOLDER = "raw"
+
+
+def getRawStorePath(workingDir):
+    return os.path.join(workingDir, 'result', RAWFOLDER)
+
+
+def _decode(value):
+    if isinstance(value, bytes):
+        return value.decode('ascii', 'replace')
+    return value
+
+
+def _unique(values):
+    seen = set()
+    result = []
+    for value in values:
+        key = tuple(value) if isinstance(value, list) else value
+        if key in seen:
+            continue
+        seen.add(key)
+        result.append(value)
+    return result
+
+
+def compactReport(report, label):
+    """
+    This function converts a raw analysis report into a JSON friendly record.
+    Duplicated findings (e.g. the same api call found in many smali files) are
+    dropped, and the names of the fields that held bytes values are recorded so
+    that loadRawReport can restore them exactly as staticAnalyzer produced them.
+
+    Inputs:
+        report (dict): The report built by staticAnalyzer.createOutput.
+        label (int): The label of the apk (0 benign, 1 malicious).
+
+    Returns:
+        record (dict): The compact record.
+    """
+    record = {'label': label}
+    bytesFields = []
+    for key, value in report.items():
+        if isinstance(value, list):
+            if any(isinstance(v, bytes) for v in value):
+                bytesFields.append(key)
+            value = _unique(
+                [[_decode(v) for v in item] if isinstance(item, list)
+                 else _decode(item) for item in value])
+        elif isinstance(value, bytes):
+            bytesFields.append(key)
+            value = _decode(value)
+        record[key] = value
+    record['bytes_fields'] = bytesFields
+    return record
+
+
+def saveRawReport(workingDir, report, label):
+    """
+    This function persists the raw findings of a single apk (manifest entries,
+    api call hits, URLs, dangerous calls, file list...) in the raw store, so the
+    feature vectors can be rebuilt later without running aapt and baksmali again.
+
+    Inputs:
+        workingDir (str): The folder holding the result folder.
+        report (dict): The report built by staticAnalyzer.createOutput.
+        label (int): The label of the apk.
+
+    Returns:
+        path (str): The path of the stored record.
+    """
+    storePath = getRawStorePath(workingDir)
+    if not os.path.exists(storePath):
+        os.makedirs(storePath)
+    record = compactReport(report, label)
+    path = os.path.join(storePath, '{}.json'.format(record['sha256']))
+    # write to a temporary file first so a crash never leaves a broken record
+    tmpPath = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmpPath, 'w') as f:
+        f.write(json.dumps(record))
+    os.replace(tmpPath, path)
+    return path
+
+
+def loadRawReport(path):
+    """
+    This function loads a record of the raw store.
+
+    Inputs:
+        path (str): The path of the stored record.
+
+    Returns:
+        report (dict): The report, in the same form createOutput built it.
+        label (int): The label of the apk.
+    """
+    with open(path, 'r') as f:
+        record = json.load(f)
+    label = record.pop('label')
+    bytesFields = record.pop('bytes_fields', [])
+    for key in bytesFields:
+        value = record[key]
+        if isinstance(value, list):
+            record[key] = [v.encode('ascii', 'replace') for v in value]
+        else:
+            record[key] = value.encode('ascii', 'replace')
+    return record, label
+
+
+def listRawReports(storePath):
+    if not os.path.exists(storePath):
+        return []
+    return sorted(os.path.join(storePath, f) for f in os.listdir(storePath)
+                  if f.endswith('.json'))
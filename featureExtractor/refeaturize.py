@@ -0,0 +1,59 @@
+import argparse
+import os
+from multiprocessing import Pool
+from pathlib import Path
+import ujson as json
+
+import rawStore
+import staticAnalyzer
+
+
+def featurizeRawReport(path):
+    report, label = rawStore.loadRawReport(path)
+    return staticAnalyzer.report_to_feature_vector(report, label)
+
+
+def refeaturize(workingDir, processes=None, chunkSize=64):
+    """
+    This function rebuilds result/data.json from the raw store alone, running the
+    current report_to_feature_vector on every stored report. No apk is touched,
+    so changing the feature set only costs a pass over the raw store.
+
+    Inputs:
+        workingDir (str): The folder holding the result folder.
+        processes (int): The number of worker processes (default: all cores).
+        chunkSize (int): The number of reports handed to a worker at once.
+
+    Returns:
+        count (int): The number of feature vectors written.
+    """
+    paths = rawStore.listRawReports(rawStore.getRawStorePath(workingDir))
+    outpath = os.path.join(workingDir, 'result', 'data.json')
+
+    # the vectors are encoded in the parent process, so feature IDs are given
+    # in raw store order and the result does not depend on the scheduling
+    with Pool(processes) as pool:
+        vectors = [staticAnalyzer.encodeFeatureVector(workingDir, vector)
+                   for vector in pool.imap(featurizeRawReport, paths,
+                                           chunksize=chunkSize)]
+
+    tmpPath = outpath + '.tmp'
+    with open(tmpPath, 'w') as jsonFile:
+        jsonFile.write(json.dumps(vectors))
+    os.replace(tmpPath, outpath)
+    return len(vectors)
+
+
+if __name__ == '__main__':
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(
+        description='Rebuild the feature vectors from the raw store.')
+    parser.add_argument('--working-dir',
+                        default='{}/data/apks'.format(Path(dir_path).parent))
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    count = refeaturize(args.working_dir, args.processes)
+    print('Rebuilt {} feature vectors'.format(count))
+    if staticAnalyzer.hasher is not None:
+        print('Feature hashing: {}'.format(staticAnalyzer.hasher.stats()))
@@ -40,3 +40,11 @@ EMPTYICON = "empty.png"
 APICALLS = "APIcalls.txt"
 BACKSMALI = "baksmali-2.0.3.jar"  # location of the baksmali.jar file
 ADSLIBS = "ads.csv"
+# how feature vectors are written to result/data.json:
+# "names" -> {feature name: 1} dicts, "ids" -> sorted lists of vocabulary IDs,
+# "hashed" -> sparse vectors of HASHDIM buckets (hashing trick)
+# a data.json must hold a single format: change it only for a new result folder
+FEATUREFORMAT = "names"
+VOCABULARY = "vocabulary.txt"  # vocabulary file name inside the result folder
+HASHDIM = 2 ** 18
+HASHSIGNED = True
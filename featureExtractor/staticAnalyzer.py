@@ -41,6 +41,9 @@ import ssdeep
 import random as rnd
 
 import settings
+import rawStore
+from featureRegistry import FeatureRegistry
+from featureHasher import FeatureHasher
 import warnings
 
 # ignore DeprecationWarning when run file
@@ -53,6 +56,8 @@ l2 = [x for x in range(127, 160)]
 CC = l1+l2
 sha = None
 labelApp = 0
+registries = {}
+hasher = None
 
 #########################################################################################
 #                                    Functions                                          #
@@ -121,10 +126,25 @@ def hash(fileSystemPosition):
         return ssdeepValue
 
 
-# get permissions by used API
-def checkAPIpermissions(smaliLocation):
+# the API calls to look for, split in [call, permission line]: all of APIcalls.txt without
+# a plan, otherwise the calls giving a used api_calls or api_permissions feature
+def compileAPICalls(plan=None):
     with open(settings.APICALLS) as f:
-        apiCallList = f.readlines()
+        apiCallList = [apiCall.split("|") for apiCall in f.readlines()]
+    if plan is None:
+        return apiCallList
+    compiled = []
+    for apiCall in apiCallList:
+        permission = apiCall[1].split("\n")[0] if len(apiCall) > 1 else ""
+        if (apiCall[0].strip() != "" and plan.usesFeature('api_calls', apiCall[0])) or (
+                permission.strip() != "" and plan.usesFeature('api_permissions', permission)):
+            compiled.append(apiCall)
+    return compiled
+
+
+# get permissions by used API
+def checkAPIpermissions(smaliLocation, plan=None):
+    apiCallList = compileAPICalls(plan)
     apiPermissions = []
     apiCalls = []
     # create file-list of directory
@@ -139,7 +159,6 @@ def checkAPIpermissions(smaliLocation):
             # file = re.compile('[%s]' % re.escape(CC)).sub('', file)
             smaliFile = open(file).read()
             for apiCall in apiCallList:
-                apiCall = apiCall.split("|")
                 if smaliFile.find(apiCall[0]) != -1:
                     try:
                         permission = apiCall[1].split("\n")[0]
@@ -487,26 +506,102 @@ def getServicesReceivers(logFile, sampleFile):
     return servicesANDreceiver
 
 
+# the suspicious calls parseSmaliCalls looks for: the string searched in the smali code,
+# the finding it gives and whether the log keeps the line ending
+SMALICALLS = [
+    ("Ljava/net/HttpURLconnection;->setRequestMethod(Ljava/lang/String;)",
+     "HTTP GET/POST (Ljava/net/HttpURLconnection;->setRequestMethod(Ljava/lang/String;))", False),
+    ("Ljava/net/HttpURLconnection", "HttpURLconnection (Ljava/net/HttpURLconnection)", False),
+    ("getExternalStorageDirectory", "Read/Write External Storage", False),
+    ("getSimCountryIso", "getSimCountryIso", False),
+    ("execHttpRequest", "execHttpRequest", False),
+    ("Lorg/apache/http/client/methods/HttpPost",
+     "HttpPost (Lorg/apache/http/client/methods/HttpPost)", False),
+    ("Landroid/telephony/SmsMessage;->getMessageBody",
+     "readSMS (Landroid/telephony/SmsMessage;->getMessageBody)", False),
+    ("sendTextMessage", "sendSMS", False),
+    ("getSubscriberId", "getSubscriberId", False),
+    ("getDeviceId", "getDeviceId", False),
+    ("getPackageInfo", "getPackageInfo", False),
+    ("getSystemService", "getSystemService", False),
+    ("getWifiState", "getWifiState", False),
+    ("system/bin/su", "system/bin/su", False),
+    ("setWifiEnabled", "setWifiEnabled", False),
+    ("setWifiDisabled", "setWifiDisabled", False),
+    ("getCellLocation", "getCellLocation", False),
+    ("getNetworkCountryIso", "getNetworkCountryIso", False),
+    ("SystemClock.uptimeMillis", "SystemClock.uptimeMillis", False),
+    ("getCellSignalStrength", "getCellSignalStrength", False),
+    ("Landroid/os/Build;->BRAND:Ljava/lang/String",
+     "Access Device Info (Landroid/os/Build;->BRAND:Ljava/lang/String)", False),
+    ("Landroid/os/Build;->DEVICE:Ljava/lang/String",
+     "Access Device Info (Landroid/os/Build;->DEVICE:Ljava/lang/String)", False),
+    ("Landroid/os/Build;->MODEL:Ljava/lang/String",
+     "Access Device Info (Landroid/os/Build;->MODEL:Ljava/lang/String)", False),
+    ("Landroid/os/Build;->PRODUCT:Ljava/lang/String",
+     "Access Device Info (Landroid/os/Build;->PRODUCT:Ljava/lang/String)", False),
+    ("Landroid/os/Build;->FINGERPRINT:Ljava/lang/String",
+     "Access Device Info (Landroid/os/Build;->FINGERPRINT:Ljava/lang/String)", False),
+    ("adb_enabled", "Check if adb is enabled", False),
+    # used by exploits and bad programers
+    ("Ljava/io/IOException;->printStackTrace", "printStackTrace", False),
+    ("Ljava/lang/Runtime;->exec", "Execution of external commands (Ljava/lang/Runtime;->exec)", True),
+    ("Ljava/lang/System;->loadLibrary",
+     "Loading of external Libraries (Ljava/lang/System;->loadLibrary)", True),
+    ("Ljava/lang/System;->load", "Loading of external Libraries (Ljava/lang/System;->load)", True),
+    ("Ldalvik/system/DexClassLoader;",
+     "Loading of external Libraries (Ldalvik/system/DexClassLoader;)", True),
+    ("Ldalvik/system/SecureClassLoader;",
+     "Loading of external Libraries (Ldalvik/system/SecureClassLoader;)", True),
+    ("Ldalvik/system/PathClassLoader;",
+     "Loading of external Libraries (Ldalvik/system/PathClassLoader;)", True),
+    ("Ldalvik/system/BaseDexClassLoader;",
+     "Loading of external Libraries (Ldalvik/system/BaseDexClassLoader;)", True),
+    ("Ldalvik/system/URLClassLoader;",
+     "Loading of external Libraries (Ldalvik/system/URLClassLoader;)", True),
+    ("android/os/Exec", "Execution of native code (android/os/Exec)", True),
+    ("Base64", "Obfuscation(Base64)", True),
+]
+
+
+# the feature value report_to_feature_vector keeps for a suspicious call, None if it has none
+def interestingCallFeature(call):
+    if 'HttpPost' in call:
+        return call.split(' ')[0]
+    if ('(' in call and ';' in call) or call.strip() == '' or 'Check if adb is enabled' in call:
+        return None
+    return call
+
+
+# the suspicious calls to look for (all of them without a plan) and whether to look for
+# the Cipher algorithms
+def compileSmaliCalls(plan=None):
+    if plan is None:
+        return SMALICALLS, True
+    calls = [call for call in SMALICALLS
+             if interestingCallFeature(call[1]) is not None
+             and plan.usesFeature('interesting_calls', interestingCallFeature(call[1]))]
+    return calls, plan.usesPrefix('interesting_calls', 'Cipher(')
+
+
 # parsing smali-output for suspicious content
-def parseSmaliCalls(logFile, smaliLocation):
+def parseSmaliCalls(logFile, smaliLocation, plan=None):
     log(logFile, 0, "potentially suspicious api-calls", 0)
     dangerousCalls = []
+    smaliCalls, cipher = compileSmaliCalls(plan)
     # create file-list of directory
     fileList = []
     for dirname, dirnames, filenames in os.walk(smaliLocation):
         for filename in filenames:
             fileList.append(os.path.join(dirname, filename))
-    # parse every file in file-list
+    # parse every file in file-list: a call is only searched line by line (for the log)
+    # in the files holding it
     for file in fileList:
         try:
-            # print(f)
-            # f = re.compile('[%s]' % re.escape(CC)).sub('', f)
-            # print(f)
             smaliFile = open(file).readlines()
-            i = 0
-            for line in smaliFile:
-                try:
-                    i += 1
+            smaliText = ''.join(smaliFile)
+            if cipher and "Cipher" in smaliText:
+                for i, line in enumerate(smaliFile, 1):
                     if "Cipher" in line:
                         try:
                             prevLine = \
@@ -514,295 +609,25 @@ def parseSmaliCalls(logFile, smaliLocation):
                                     0].split('"')[1]
                             log(logFile, file + ":" + str(i), line.split("\n")[0],
                                 1)
-                            if "Cipher(" + prevLine + ")" in dangerousCalls:
-                                continue
-                            else:
+                            if "Cipher(" + prevLine + ")" not in dangerousCalls:
                                 dangerousCalls.append(
                                     "Cipher(" + prevLine + ")")
                         except:
                             continue
-                    # only for logging !
+            # only for logging !
+            if plan is None and "crypto" in smaliText:
+                for i, line in enumerate(smaliFile, 1):
                     if "crypto" in line:
-                        try:
-                            line = line.split("\n")[0]
-                            log(logFile, file + ":" + str(i), line, 1)
-                        except:
-                            continue
-                    if "Ljava/net/HttpURLconnection;->setRequestMethod(Ljava/lang/String;)" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "HTTP GET/POST (Ljava/net/HttpURLconnection;->setRequestMethod(Ljava/lang/String;))" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append(
-                                "HTTP GET/POST (Ljava/net/HttpURLconnection;->setRequestMethod(Ljava/lang/String;))")
-                    if "Ljava/net/HttpURLconnection" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "HttpURLconnection (Ljava/net/HttpURLconnection)" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append(
-                                "HttpURLconnection (Ljava/net/HttpURLconnection)")
-                    if "getExternalStorageDirectory" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "Read/Write External Storage" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append(
-                                "Read/Write External Storage")
-                    if "getSimCountryIso" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "getSimCountryIso" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append("getSimCountryIso")
-                    if "execHttpRequest" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "execHttpRequest" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append("execHttpRequest")
-                    if "Lorg/apache/http/client/methods/HttpPost" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "HttpPost (Lorg/apache/http/client/methods/HttpPost)" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append(
-                                "HttpPost (Lorg/apache/http/client/methods/HttpPost)")
-                    if "Landroid/telephony/SmsMessage;->getMessageBody" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "readSMS (Landroid/telephony/SmsMessage;->getMessageBody)" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append(
-                                "readSMS (Landroid/telephony/SmsMessage;->getMessageBody)")
-                    if "sendTextMessage" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "sendSMS" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append("sendSMS")
-                    if "getSubscriberId" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "getSubscriberId" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append("getSubscriberId")
-                    if "getDeviceId" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "getDeviceId" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append("getDeviceId")
-                    if "getPackageInfo" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "getPackageInfo" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append("getPackageInfo")
-                    if "getSystemService" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "getSystemService" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append("getSystemService")
-                    if "getWifiState" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "getWifiState" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append("getWifiState")
-                    if "system/bin/su" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "system/bin/su" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append("system/bin/su")
-                    if "setWifiEnabled" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "setWifiEnabled" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append("setWifiEnabled")
-                    if "setWifiDisabled" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "setWifiDisabled" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append("setWifiDisabled")
-                    if "getCellLocation" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "getCellLocation" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append("getCellLocation")
-                    if "getNetworkCountryIso" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "getNetworkCountryIso" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append("getNetworkCountryIso")
-                    if "SystemClock.uptimeMillis" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "SystemClock.uptimeMillis" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append("SystemClock.uptimeMillis")
-                    if "getCellSignalStrength" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "getCellSignalStrength" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append("getCellSignalStrength")
-                    if "Landroid/os/Build;->BRAND:Ljava/lang/String" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "Access Device Info (Landroid/os/Build;->BRAND:Ljava/lang/String)" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append(
-                                "Access Device Info (Landroid/os/Build;->BRAND:Ljava/lang/String)")
-                    if "Landroid/os/Build;->DEVICE:Ljava/lang/String" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "Access Device Info (Landroid/os/Build;->DEVICE:Ljava/lang/String)" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append(
-                                "Access Device Info (Landroid/os/Build;->DEVICE:Ljava/lang/String)")
-                    if "Landroid/os/Build;->MODEL:Ljava/lang/String" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "Access Device Info (Landroid/os/Build;->MODEL:Ljava/lang/String)" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append(
-                                "Access Device Info (Landroid/os/Build;->MODEL:Ljava/lang/String)")
-                    if "Landroid/os/Build;->PRODUCT:Ljava/lang/String" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "Access Device Info (Landroid/os/Build;->PRODUCT:Ljava/lang/String)" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append(
-                                "Access Device Info (Landroid/os/Build;->PRODUCT:Ljava/lang/String)")
-                    if "Landroid/os/Build;->FINGERPRINT:Ljava/lang/String" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "Access Device Info (Landroid/os/Build;->FINGERPRINT:Ljava/lang/String)" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append(
-                                "Access Device Info (Landroid/os/Build;->FINGERPRINT:Ljava/lang/String)")
-                    if "adb_enabled" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "Check if adb is enabled" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append("Check if adb is enabled")
-                    # used by exploits and bad programers
-                    if "Ljava/io/IOException;->printStackTrace" in line:
-                        log(logFile, file + ":" + str(i),
-                            line.split("\n")[0], 1)
-                        if "printStackTrace" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append("printStackTrace")
-                    if "Ljava/lang/Runtime;->exec" in line:
-                        log(logFile, file + ":" + str(i), line, 1)
-                        if "Execution of external commands (Ljava/lang/Runtime;->exec)" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append(
-                                "Execution of external commands (Ljava/lang/Runtime;->exec)")
-                    if "Ljava/lang/System;->loadLibrary" in line:
-                        log(logFile, file + ":" + str(i), line, 1)
-                        if "Loading of external Libraries (Ljava/lang/System;->loadLibrary)" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append(
-                                "Loading of external Libraries (Ljava/lang/System;->loadLibrary)")
-                    if "Ljava/lang/System;->load" in line:
-                        log(logFile, file + ":" + str(i), line, 1)
-                        if "Loading of external Libraries (Ljava/lang/System;->load)" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append(
-                                "Loading of external Libraries (Ljava/lang/System;->load)")
-                    if "Ldalvik/system/DexClassLoader;" in line:
-                        log(logFile, file + ":" + str(i), line, 1)
-                        if "Loading of external Libraries (Ldalvik/system/DexClassLoader;)" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append(
-                                "Loading of external Libraries (Ldalvik/system/DexClassLoader;)")
-                    if "Ldalvik/system/SecureClassLoader;" in line:
-                        log(logFile, file + ":" + str(i), line, 1)
-                        if "Loading of external Libraries (Ldalvik/system/SecureClassLoader;)" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append(
-                                "Loading of external Libraries (Ldalvik/system/SecureClassLoader;)")
-                    if "Ldalvik/system/PathClassLoader;" in line:
-                        log(logFile, file + ":" + str(i), line, 1)
-                        if "Loading of external Libraries (Ldalvik/system/PathClassLoader;)" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append(
-                                "Loading of external Libraries (Ldalvik/system/PathClassLoader;)")
-                    if "Ldalvik/system/BaseDexClassLoader;" in line:
-                        log(logFile, file + ":" + str(i), line, 1)
-                        if "Loading of external Libraries (Ldalvik/system/BaseDexClassLoader;)" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append(
-                                "Loading of external Libraries (Ldalvik/system/BaseDexClassLoader;)")
-                    if "Ldalvik/system/URLClassLoader;" in line:
-                        log(logFile, file + ":" + str(i), line, 1)
-                        if "Loading of external Libraries (Ldalvik/system/URLClassLoader;)" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append(
-                                "Loading of external Libraries (Ldalvik/system/URLClassLoader;)")
-                    if "android/os/Exec" in line:
-                        log(logFile, file + ":" + str(i), line, 1)
-                        if "Execution of native code (android/os/Exec)" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append(
-                                "Execution of native code (android/os/Exec)")
-                    if "Base64" in line:
-                        log(logFile, file + ":" + str(i), line, 1)
-                        if "Obfuscation(Base64)" in dangerousCalls:
-                            continue
-                        else:
-                            dangerousCalls.append("Obfuscation(Base64)")
-                    else:
-                        continue
-                except Exception as e:
-                    print(e)
-                    print(line)
+                        log(logFile, file + ":" + str(i), line.split("\n")[0], 1)
+            for pattern, call, lineEnding in smaliCalls:
+                if pattern not in smaliText:
                     continue
+                for i, line in enumerate(smaliFile, 1):
+                    if pattern in line:
+                        log(logFile, file + ":" + str(i),
+                            line if lineEnding else line.split("\n")[0], 1)
+                if call not in dangerousCalls:
+                    dangerousCalls.append(call)
         except Exception as e:
             exception_type, exception_object, exception_traceback = sys.exc_info()
             filename = exception_traceback.tb_frame.f_code.co_filename
@@ -831,6 +656,9 @@ def parseSmaliURL(logFile, smaliLocation):
             i = 0
             smaliFile = open(file).readlines()
             for line in smaliFile:
+                # every finding of a line needs an URL on it
+                if "http" not in line:
+                    continue
                 try:
                     urlPattern = re.search(
                         'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+',
@@ -896,6 +724,18 @@ def createOutput(workingDir, appNet, appProviders, appPermissions, appFeatures,
                  appIntents, servicesANDreceiver, detectedAds,
                  dangerousCalls, appUrls, appInfos, apiPermissions, apiCalls,
                  appFiles, appActivities, ssdeepValue, src):
+    output = makeReport(appNet, appProviders, appPermissions, appFeatures,
+                        appIntents, servicesANDreceiver, detectedAds,
+                        dangerousCalls, appUrls, appInfos, apiPermissions,
+                        apiCalls, appFiles, appActivities, ssdeepValue)
+    return saveOutput(workingDir, output, src)
+
+
+# gather the findings of every analysis stage in the report dict
+def makeReport(appNet, appProviders, appPermissions, appFeatures,
+               appIntents, servicesANDreceiver, detectedAds,
+               dangerousCalls, appUrls, appInfos, apiPermissions, apiCalls,
+               appFiles, appActivities, ssdeepValue):
     output = dict()
     output['md5'] = appInfos[1]
     output['sha256'] = appInfos[0]
@@ -917,6 +757,11 @@ def createOutput(workingDir, appNet, appProviders, appPermissions, appFeatures,
     output['providers'] = appProviders
     output['included_files'] = appFiles
     output['detected_ad_networks'] = detectedAds
+    return output
+
+
+# save the report in the raw store and its feature vector in result/data.json
+def saveOutput(workingDir, output, src):
     # save the JSON dict to a file for later use
     if not os.path.exists(workingDir):
         os.mkdir(workingDir)
@@ -941,7 +786,11 @@ def createOutput(workingDir, appNet, appProviders, appPermissions, appFeatures,
     # jsonFile.close()
     # return output
 
-    output = report_to_feature_vector(output)
+    # keep the raw findings so the feature vectors can be rebuilt later
+    # without analysing the apk again (see refeaturize.py)
+    rawStore.saveRawReport(workingDir, output, labelApp)
+
+    output = encodeFeatureVector(workingDir, report_to_feature_vector(output))
     outpath = os.path.join(workingDir, 'result/data.json')
     print(
         "Saving results at result/data.json file...".format(src=src))
@@ -960,9 +809,11 @@ def createOutput(workingDir, appNet, appProviders, appPermissions, appFeatures,
     return output
 
 
-def report_to_feature_vector(report):
+def report_to_feature_vector(report, label=None):
     # output = {'label': labelApp}
-    output = {'sha256': report['sha256'], 'label': labelApp}
+    if label is None:
+        label = labelApp
+    output = {'sha256': report['sha256'], 'label': label}
 
     def key_fmt(k, val):
         return '{}::{}'.format(k, val.strip()).replace('.', '_')
@@ -981,18 +832,9 @@ def report_to_feature_vector(report):
 
             elif k == 'interesting_calls':
                 for val in values:
-                    if 'HttpPost' in val:
-                        line = key_fmt(k, val.split(' ')[0])
-                        output[line] = 1
-                    elif '(' in val and ';' in val:
-                        pass
-                    elif val.strip() == '':
-                        pass
-                    elif 'Check if adb is enabled' in val:
-                        pass
-                    else:
-                        line = key_fmt(k, val)
-                        output[line] = 1
+                    feature = interestingCallFeature(val)
+                    if feature is not None:
+                        output[key_fmt(k, feature)] = 1
 
             else:
                 for val in values:
@@ -1003,41 +845,73 @@ def report_to_feature_vector(report):
     return output
 
 
-#########################################################################################
-#                                  MAIN PROGRAMM                                        #
-#########################################################################################
-def run(sampleFile, workingDir, src, label):
-    # print('sampleFile', sampleFile)
-    global labelApp
-    labelApp = label
+# get the feature vocabulary shared by every analysis writing to workingDir
+def getFeatureRegistry(workingDir):
+    path = os.path.join(workingDir, 'result', settings.VOCABULARY)
+    if path not in registries:
+        registries[path] = FeatureRegistry(path)
+    return registries[path]
+
+
+# get the hashing vectorizer used when settings.FEATUREFORMAT is "hashed"
+def getFeatureHasher():
+    global hasher
+    if hasher is None:
+        hasher = FeatureHasher(settings.HASHDIM, settings.HASHSIGNED)
+    return hasher
+
+
+# store the feature vector in the format selected by settings.FEATUREFORMAT
+def encodeFeatureVector(workingDir, vector):
+    if settings.FEATUREFORMAT == 'ids':
+        names = [k for k in vector if k not in ('sha256', 'label')]
+        return {'sha256': vector['sha256'], 'label': vector['label'],
+                'feature_ids': getFeatureRegistry(workingDir).getIds(names)}
+    if settings.FEATUREFORMAT == 'hashed':
+        names = [k for k in vector if k not in ('sha256', 'label')]
+        indices, values = getFeatureHasher().transform(names)
+        return {'sha256': vector['sha256'], 'label': vector['label'],
+                'hash_dim': settings.HASHDIM, 'hashed_indices': indices,
+                'hashed_values': values}
+    return vector
+
+
+# run every analysis stage on an apk and return its report, without saving anything:
+# workingDir only holds the log and the temporary unpack and smali folders.
+# needsDex, when given, is called with the report of the cheap manifest stages and the
+# costly dex stages (unpacking, baksmali and smali scanning) only run if it returns True.
+# plan, an extractionPlan.ExtractionPlan, restricts the analysis to the features a model
+# uses: the other stages are skipped, so the report only holds the findings of these features
+def analyze(sampleFile, workingDir, needsDex=None, plan=None):
+    workingDir = workingDir if workingDir.endswith(
+        '/') else workingDir + '/'
+
+    def uses(family):
+        return plan is None or plan.uses(family)
+
+    # function calls
+    logFile = createLogFile(workingDir)
     try:
-        # print(sampleFile)
-        workingDir = workingDir if workingDir.endswith(
-            '/') else workingDir + '/'
-        # function calls
-        logFile = createLogFile(workingDir)
-        # print "unpacking sample..."
-        unpackLocation = unpackSample(workingDir, sampleFile)
         # print "get Network data..."
-        appNet = getNet(sampleFile)
+        appNet = getNet(sampleFile) if plan is None else []
         # print "get sample info..."
         appInfos = getSampleInfo(logFile, sampleFile)
         # print "get providers..."
-        appProviders = getProviders(logFile, sampleFile)
+        appProviders = getProviders(logFile, sampleFile) if uses('providers') else []
         # # print "get permissions..."
-        appPermissions = getPermissions(logFile, sampleFile)
+        appPermissions = getPermissions(logFile, sampleFile) if uses('app_permissions') else []
         # print "get activities...",sampleFile
-        appActivities = getActivities(sampleFile)
+        appActivities = getActivities(sampleFile) if uses('activities') else []
         # print "get features..."
-        appFeatures = getFeatures(logFile, sampleFile)
+        appFeatures = getFeatures(logFile, sampleFile) if uses('features') else []
         # print "get intents..."
-        appIntents = getIntents(logFile, sampleFile)
+        appIntents = getIntents(logFile, sampleFile) if uses('intents') else []
         # print "list files..."
-        appFiles = getFilesInsideApk(sampleFile)
+        appFiles = getFilesInsideApk(sampleFile) if plan is None else []
         # print "get services and receivers..."
-        servicesANDreceiver = getServicesReceivers(logFile, sampleFile)
+        servicesANDreceiver = getServicesReceivers(logFile, sampleFile) if uses('s_and_r') else []
         # print "crate ssdeep hash..."
-        ssdeepValue = hash(sampleFile)
+        ssdeepValue = hash(sampleFile) if plan is None else "(None)"
 
         dangerousCalls = []
         appUrls = []
@@ -1045,32 +919,70 @@ def run(sampleFile, workingDir, src, label):
         apiCalls = []
         detectedAds = []
 
+        # no feature of the model is found in the smali code
+        skipDex = plan is not None and not plan.needsDex()
+        if needsDex is not None or skipDex:
+            manifestReport = makeReport(appNet, appProviders, appPermissions, appFeatures,
+                                        appIntents, servicesANDreceiver, detectedAds,
+                                        dangerousCalls, appUrls, appInfos, apiPermissions,
+                                        apiCalls, appFiles, appActivities, ssdeepValue)
+            if skipDex or not needsDex(manifestReport):
+                manifestReport['dex_analyzed'] = False
+                return manifestReport
+
+        # print "unpacking sample..."
+        unpackLocation = unpackSample(workingDir, sampleFile)
         dex_files = glob.glob(unpackLocation + '/*.dex')
 
         for dex in dex_files:
             # print "decompiling sample..."
             smaliLocation = dex2X(workingDir, dex)
-            # print "search for dangerous calls..."
-            dangerousCalls.extend(parseSmaliCalls(logFile, smaliLocation))
-            # print "get URLs and IPs..."
-            appUrls.extend(parseSmaliURL(logFile, smaliLocation))
-            # print "check API permissions..."
-            perms, calls = checkAPIpermissions(smaliLocation)
-            apiPermissions.extend(perms)
-            apiCalls.extend(calls)
-            # print "check for ad networks..."
-            detectedAds.extend(detect(smaliLocation))
-            # print "create json report..."
+            if uses('interesting_calls'):
+                # print "search for dangerous calls..."
+                dangerousCalls.extend(parseSmaliCalls(logFile, smaliLocation, plan))
+            if uses('urls'):
+                # print "get URLs and IPs..."
+                appUrls.extend(parseSmaliURL(logFile, smaliLocation))
+            if uses('api_calls') or uses('api_permissions'):
+                # print "check API permissions..."
+                perms, calls = checkAPIpermissions(smaliLocation, plan)
+                apiPermissions.extend(perms)
+                apiCalls.extend(calls)
+            if plan is None:
+                # print "check for ad networks..."
+                detectedAds.extend(detect(smaliLocation))
             shutil.rmtree(smaliLocation)
-            shutil.rmtree(unpackLocation)
-        createOutput(workingDir, appNet, appProviders, appPermissions, appFeatures,
-                     appIntents, servicesANDreceiver, detectedAds,
-                     dangerousCalls, appUrls, appInfos, apiPermissions,
-                     apiCalls, appFiles, appActivities, ssdeepValue, src)
-        # # print "copy icon file..."
-        # copyIcon(sampleFile, unpackLocation, workingDir)
+        # the unpacked files are needed until the last dex file is decompiled
+        shutil.rmtree(unpackLocation)
+        # print "create json report..."
+        report = makeReport(appNet, appProviders, appPermissions, appFeatures,
+                            appIntents, servicesANDreceiver, detectedAds,
+                            dangerousCalls, appUrls, appInfos, apiPermissions,
+                            apiCalls, appFiles, appActivities, ssdeepValue)
+        if needsDex is not None or plan is not None:
+            report['dex_analyzed'] = True
+        return report
+    finally:
         # programm and log footer
         # print "close log-file..."
         closeLogFile(logFile)
+
+
+#########################################################################################
+#                                  MAIN PROGRAMM                                        #
+#########################################################################################
+def run(sampleFile, workingDir, src, label):
+    # print('sampleFile', sampleFile)
+    global labelApp
+    labelApp = label
+    try:
+        # print(sampleFile)
+        workingDir = workingDir if workingDir.endswith(
+            '/') else workingDir + '/'
+        # the reports saved in data.json always hold every feature (the dex analysis is never skipped)
+        report = analyze(sampleFile, workingDir)
+        saveOutput(workingDir, report, src)
+        # # print "copy icon file..."
+        # copyIcon(sampleFile, unpackLocation, workingDir)
     except Exception as e:
         print(e)
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from scipy import sparse
+from bitmatrix import BitMatrix
+
+# bump when the layout of the cache or the way the matrix is built changes
+CACHE_VERSION = 1
+
+
+def file_hash(filename, chunk_size=1 << 20):
+    """
+    This function computes the sha256 of a file, reading it by chunks.
+
+    Inputs:
+        filename (str): The filepath of the file.
+        chunk_size (int): The number of bytes read at once.
+
+    Returns:
+        digest (str): The hex sha256 of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _remembered_hash(cache_dir, filename):
+    # hashing a big data.json on every run is avoided when its size and
+    # modification time did not change since the hash was last computed
+    stat = os.stat(filename)
+    index_path = os.path.join(cache_dir, 'sources.json')
+    sources = {}
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as f:
+            sources = json.load(f)
+    path = os.path.realpath(filename)
+    source = sources.get(path)
+    if source is not None and source['size'] == stat.st_size and source['mtime_ns'] == stat.st_mtime_ns:
+        return source['sha256']
+    digest = file_hash(filename)
+    sources[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump(sources, f)
+    os.replace(index_path + '.tmp', index_path)
+    return digest
+
+
+def cache_key(cache_dir, filenames):
+    """
+    This function computes the cache key of a set of source files: the hash of their contents
+    together with the cache version. Missing files (e.g. no vocabulary) are skipped.
+
+    Inputs:
+        cache_dir (str): The cache folder.
+        filenames (list): The filepaths of the source files.
+
+    Returns:
+        key (str): The cache key.
+    """
+    digest = hashlib.sha256(f'v{CACHE_VERSION}'.encode())
+    for filename in filenames:
+        if filename is not None and os.path.exists(filename):
+            digest.update(_remembered_hash(cache_dir, filename).encode())
+    return digest.hexdigest()[:32]
+
+
+def save_csr(directory, X, y=None):
+    """
+    This function writes a CSR matrix (and optionally its labels) as .npy arrays,
+    so that it can be reloaded with memory mapping.
+
+    Inputs:
+        directory (str): The folder to write to.
+        X (scipy.sparse.csr_matrix): The feature matrix.
+        y (numpy.ndarray): The labels.
+    """
+    os.makedirs(directory, exist_ok=True)
+    X = sparse.csr_matrix(X)
+    X.sort_indices()
+    np.save(os.path.join(directory, 'data.npy'), X.data)
+    np.save(os.path.join(directory, 'indices.npy'), X.indices)
+    np.save(os.path.join(directory, 'indptr.npy'), X.indptr)
+    if y is not None:
+        np.save(os.path.join(directory, 'labels.npy'), np.asarray(y))
+    with open(os.path.join(directory, 'shape.json'), 'w') as f:
+        json.dump(list(X.shape), f)
+
+
+def load_csr(directory, mmap_mode='r'):
+    """
+    This function loads a CSR matrix written by save_csr. With memory mapping, the arrays are
+    paged in from disk on demand, and shared between the processes loading the same files.
+
+    Inputs:
+        directory (str): The folder to read from.
+        mmap_mode (str): The numpy memory mapping mode, None to read the arrays in memory.
+
+    Returns:
+        X (scipy.sparse.csr_matrix): The feature matrix.
+        y (numpy.ndarray): The labels, None if they were not saved.
+    """
+    with open(os.path.join(directory, 'shape.json'), 'r') as f:
+        shape = tuple(json.load(f))
+    data = np.load(os.path.join(directory, 'data.npy'), mmap_mode=mmap_mode)
+    indices = np.load(os.path.join(directory, 'indices.npy'), mmap_mode=mmap_mode)
+    indptr = np.load(os.path.join(directory, 'indptr.npy'), mmap_mode=mmap_mode)
+    X = sparse.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+    X.has_sorted_indices = True
+    y = None
+    labels_path = os.path.join(directory, 'labels.npy')
+    if os.path.exists(labels_path):
+        y = np.load(labels_path, mmap_mode=mmap_mode)
+    return X, y
+
+
+def load_cache(cache_dir, key, mmap_mode='r', storage='csr'):
+    """
+    This function loads the processed feature matrix cached under a key.
+
+    Inputs:
+        cache_dir (str): The cache folder.
+        key (str): The cache key (see cache_key).
+        mmap_mode (str): The numpy memory mapping mode.
+        storage (str): The storage the entry must have been saved with (see save_cache).
+
+    Returns:
+        cached (tuple): (X, y, feature_names, sha256), None if nothing is cached under this key
+                        with this storage. X is a bitmatrix.BitMatrix when the matrix is stored bit-packed.
+    """
+    directory = os.path.join(cache_dir, key)
+    if not os.path.exists(os.path.join(directory, 'meta.json')):
+        return None
+    with open(os.path.join(directory, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    if meta.get('version') != CACHE_VERSION or meta.get('storage', 'csr') != storage:
+        return None
+    if meta.get('packed'):
+        X = BitMatrix(np.load(os.path.join(directory, 'bits.npy'), mmap_mode=mmap_mode), meta['shape'][1])
+        y = np.load(os.path.join(directory, 'labels.npy'), mmap_mode=mmap_mode)
+    else:
+        X, y = load_csr(directory, mmap_mode)
+    with open(os.path.join(directory, 'feature_names.json'), 'r') as f:
+        feature_names = json.load(f)
+    with open(os.path.join(directory, 'sha256.json'), 'r') as f:
+        sha256 = json.load(f)
+    return X, y, feature_names, sha256
+
+
+def save_cache(cache_dir, key, X, y, feature_names, sha256, storage='csr'):
+    """
+    This function caches a processed feature matrix under a key, and removes the entries
+    cached under other keys (they belong to older versions of the source files).
+    With storage='bits', a binary matrix is stored bit-packed (one bit per app and feature, see
+    bitmatrix.BitMatrix), which is smaller than CSR once more than about 1% of the entries are set;
+    a matrix with other values than 0 and 1 is stored as CSR anyway.
+
+    Inputs:
+        cache_dir (str): The cache folder.
+        key (str): The cache key (see cache_key).
+        X (scipy.sparse.csr_matrix): The feature matrix.
+        y (numpy.ndarray): The labels.
+        feature_names (list): The name of every column of X.
+        sha256 (list): The sha256 of every row of X.
+        storage (str): 'csr' or 'bits'.
+    """
+    if storage not in ('csr', 'bits'):
+        raise ValueError(f'unknown feature storage: {storage}')
+    directory = os.path.join(cache_dir, key)
+    tmp_directory = f'{directory}.{os.getpid()}.tmp'
+    X = sparse.csr_matrix(X)
+    packed = storage == 'bits' and bool(np.all(X.data == 1))
+    if packed:
+        os.makedirs(tmp_directory, exist_ok=True)
+        np.save(os.path.join(tmp_directory, 'bits.npy'), BitMatrix.from_csr(X).bits)
+        np.save(os.path.join(tmp_directory, 'labels.npy'), np.asarray(y))
+    else:
+        save_csr(tmp_directory, X, y)
+    with open(os.path.join(tmp_directory, 'feature_names.json'), 'w') as f:
+        json.dump(feature_names, f)
+    with open(os.path.join(tmp_directory, 'sha256.json'), 'w') as f:
+        json.dump(sha256, f)
+    # meta.json is written last: an entry without it is incomplete
+    with open(os.path.join(tmp_directory, 'meta.json'), 'w') as f:
+        json.dump({'version': CACHE_VERSION, 'shape': list(X.shape), 'nnz': int(X.nnz),
+                   'storage': storage, 'packed': packed}, f)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_directory, directory)
+
+    for entry in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, entry)
+        if entry != key and not entry.endswith('.tmp') and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
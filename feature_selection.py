@@ -0,0 +1,158 @@
+import os
+import numpy as np
+from scipy import sparse
+from sklearn.feature_selection import chi2
+from sklearn.svm import LinearSVC
+from featureExtractor.extractionPlan import MANIFESTFAMILIES
+import warnings
+warnings.simplefilter(action='ignore', category=FutureWarning)
+
+
+def document_frequency(X):
+    """
+    This function counts the apps having every feature (non-zero entries per column).
+
+    Inputs:
+        X (scipy.sparse.csr_matrix): The feature matrix.
+
+    Returns:
+        df (numpy.ndarray): The number of apps having every feature.
+    """
+    X = sparse.csr_matrix(X)
+    return np.bincount(X.indices[X.data != 0], minlength=X.shape[1])
+
+
+def mutual_information_scores(X, y):
+    """
+    This function computes the mutual information between every (binary) feature and the label,
+    from the 2x2 contingency counts of all features at once.
+
+    Inputs:
+        X (scipy.sparse.csr_matrix): The feature matrix.
+        y (numpy.ndarray): The labels (0/1).
+
+    Returns:
+        scores (numpy.ndarray): The mutual information of every feature, in nats.
+    """
+    X = sparse.csr_matrix(X)
+    y = np.asarray(y)
+    n = float(len(y))
+    n_pos = float(np.sum(y == 1))
+    present = document_frequency(X).astype(np.float64)
+    present_pos = document_frequency(X[y == 1]).astype(np.float64)
+    # joint counts of (feature present/absent, label 1/0)
+    joint = np.stack([present_pos, present - present_pos,
+                      n_pos - present_pos, (n - n_pos) - (present - present_pos)])
+    feature_marginal = np.stack([present, present, n - present, n - present])
+    label_marginal = np.array([n_pos, n - n_pos, n_pos, n - n_pos])[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = joint / n * np.log(joint * n / (feature_marginal * label_marginal))
+    return np.nansum(np.where(joint > 0, terms, 0.0), axis=0)
+
+
+def l1_selection(X, y, C=0.1, random_state_val=0):
+    """
+    This function selects the features with a non-zero weight in an L1-regularized linear SVM.
+
+    Inputs:
+        X (scipy.sparse.csr_matrix): The (scaled) feature matrix.
+        y (numpy.ndarray): The labels.
+        C (float): The regularization parameter (smaller keeps fewer features).
+        random_state_val (int): The seed of the solver.
+
+    Returns:
+        columns (numpy.ndarray): The sorted indices of the selected features.
+    """
+    model = LinearSVC(penalty='l1', dual=False, C=C, random_state=random_state_val)
+    model.fit(X, y)
+    return np.flatnonzero(model.coef_.ravel() != 0)
+
+
+def select_features(X, y, method='chi2', k=2000, min_df=2, max_df=1.0, C=0.1):
+    """
+    This function selects the columns to train on. Features present in fewer than min_df apps
+    (e.g. most single-app URLs and activities) or in more than max_df of the apps are dropped first,
+    then the remaining ones are ranked.
+
+    Inputs:
+        X (scipy.sparse.csr_matrix): The feature matrix.
+        y (numpy.ndarray): The labels.
+        method (str): 'chi2' or 'mutual_info' to keep the k best ranked features,
+                      'l1' to keep the features of an L1-regularized model, None for the frequency filter only.
+        k (int): The number of features to keep with a ranking method.
+        min_df (int): The minimum number of apps having a feature.
+        max_df (float): The maximum fraction of apps having a feature.
+        C (float): The regularization parameter of the 'l1' method.
+
+    Returns:
+        columns (numpy.ndarray): The sorted indices of the selected features.
+    """
+    X = sparse.csr_matrix(X)
+    df = document_frequency(X)
+    columns = np.flatnonzero((df >= min_df) & (df <= max_df * X.shape[0]))
+    if method is None or len(columns) == 0:
+        return columns
+    X_candidates = X[:, columns]
+    if method == 'l1':
+        return columns[l1_selection(X_candidates, y, C)]
+    if method == 'chi2':
+        scores = np.nan_to_num(chi2(X_candidates, y)[0])
+    elif method == 'mutual_info':
+        scores = mutual_information_scores(X_candidates, y)
+    else:
+        raise ValueError(f'unknown feature selection method: {method}')
+    if k < len(columns):
+        best = np.argpartition(-scores, k - 1)[:k]
+        columns = columns[np.sort(best)]
+    return columns
+
+
+def feature_family(name):
+    return name.split('::', 1)[0]
+
+
+def family_columns(feature_names, families=MANIFESTFAMILIES):
+    """
+    This function finds the columns of the features of some families.
+
+    Inputs:
+        feature_names (list): The name of every column.
+        families (tuple): The feature families (see featureExtractor/extractionPlan.py).
+
+    Returns:
+        columns (numpy.ndarray): The sorted indices of the columns of these families.
+    """
+    families = set(families)
+    return np.array([i for i, name in enumerate(feature_names) if feature_family(name) in families],
+                    dtype=np.int64)
+
+
+def save_selected_features(path, feature_names, columns):
+    """
+    This function persists the selected vocabulary (one feature name per line, in column order).
+
+    Inputs:
+        path (str): The filepath of the file.
+        feature_names (list): The name of every column of the full matrix.
+        columns (numpy.ndarray): The selected column indices.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, 'w', encoding='utf-8') as f:
+        for column in columns:
+            f.write(feature_names[column] + '\n')
+
+
+def load_selected_features(path):
+    """
+    This function loads the selected vocabulary saved by save_selected_features.
+
+    Inputs:
+        path (str): The filepath of the file.
+
+    Returns:
+        feature_names (list): The selected feature names, in column order.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read().split('\n')[:-1]
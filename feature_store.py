@@ -0,0 +1,147 @@
+from itertools import islice
+import json
+import os
+import shutil
+import numpy as np
+from scipy import sparse
+import feature_cache
+from utils import RecordEncoder, iter_records, load_vocabulary
+
+STORE_VERSION = 1
+
+
+def build_feature_store(filename, store_dir, vocabulary_filename=None, chunk_rows=10000):
+    """
+    This function streams the records of the JSON file into an on-disk store of CSR chunks
+    of chunk_rows apps each. Only one chunk is held in memory at a time.
+
+    Inputs:
+        filename (str): The filepath of the JSON file.
+        store_dir (str): The folder of the store.
+        vocabulary_filename (str): The filepath of the feature vocabulary.
+        chunk_rows (int): The number of apps per chunk.
+
+    Returns:
+        store (FeatureStore): The store.
+    """
+    vocabulary = None
+    if vocabulary_filename is not None and os.path.exists(vocabulary_filename):
+        vocabulary = load_vocabulary(vocabulary_filename)
+    encoder = RecordEncoder(vocabulary)
+
+    tmp_dir = f'{store_dir}.{os.getpid()}.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    chunks = []
+    records = iter_records(filename)
+    while True:
+        X, y, _ = encoder.encode(islice(records, chunk_rows))
+        if X.shape[0] == 0:
+            break
+        name = f'chunk_{len(chunks):05d}'
+        feature_cache.save_csr(os.path.join(tmp_dir, name), X, y)
+        chunks.append({'name': name, 'rows': X.shape[0]})
+
+    with open(os.path.join(tmp_dir, 'feature_names.json'), 'w') as f:
+        json.dump(encoder.get_feature_names(), f)
+    # the manifest is written last: a store without it is incomplete
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump({'version': STORE_VERSION,
+                   'source_key': feature_cache.cache_key(tmp_dir, [filename, vocabulary_filename]),
+                   'n_rows': sum(chunk['rows'] for chunk in chunks),
+                   'n_features': encoder.n_features,
+                   'chunks': chunks}, f)
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(tmp_dir, store_dir)
+    return FeatureStore(store_dir)
+
+
+def open_feature_store(filename, store_dir, vocabulary_filename=None, chunk_rows=10000):
+    """
+    This function opens the store of the JSON file, and (re)builds it when it is missing or
+    was built from another version of the JSON file or vocabulary.
+
+    Inputs:
+        filename (str): The filepath of the JSON file.
+        store_dir (str): The folder of the store.
+        vocabulary_filename (str): The filepath of the feature vocabulary.
+        chunk_rows (int): The number of apps per chunk.
+
+    Returns:
+        store (FeatureStore): The store.
+    """
+    manifest_path = os.path.join(store_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        key = feature_cache.cache_key(store_dir, [filename, vocabulary_filename])
+        if manifest.get('version') == STORE_VERSION and manifest.get('source_key') == key:
+            return FeatureStore(store_dir)
+    return build_feature_store(filename, store_dir, vocabulary_filename, chunk_rows)
+
+
+def split_mask(chunk_id, n_rows, test_size, random_state):
+    """
+    This function draws the train/test assignment of the rows of a chunk. It only depends on
+    the chunk and the seed, so every pass over the store sees the same split without keeping
+    an index of the whole corpus in memory.
+
+    Inputs:
+        chunk_id (int): The number of the chunk.
+        n_rows (int): The number of rows of the chunk.
+        test_size (float): The fraction of test rows.
+        random_state (int): The seed of the split.
+
+    Returns:
+        test_mask (numpy.ndarray): True for the test rows.
+    """
+    rng = np.random.default_rng([random_state, chunk_id])
+    return rng.random(n_rows) < test_size
+
+
+class FeatureStore:
+    """
+    A chunked, memory-mapped feature matrix written by build_feature_store.
+
+    Inputs:
+        store_dir (str): The folder of the store.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'manifest.json'), 'r') as f:
+            self.manifest = json.load(f)
+        self.n_rows = self.manifest['n_rows']
+        self.n_features = self.manifest['n_features']
+        self.chunks = self.manifest['chunks']
+
+    @property
+    def shape(self):
+        return self.n_rows, self.n_features
+
+    def get_feature_names(self):
+        with open(os.path.join(self.store_dir, 'feature_names.json'), 'r') as f:
+            return json.load(f)
+
+    def load_chunk(self, chunk_id, mmap_mode='r'):
+        """
+        This function loads a chunk, widened to the number of features of the whole store.
+
+        Inputs:
+            chunk_id (int): The number of the chunk.
+            mmap_mode (str): The numpy memory mapping mode.
+
+        Returns:
+            X (scipy.sparse.csr_matrix): The rows of the chunk.
+            y (numpy.ndarray): Their labels.
+        """
+        X, y = feature_cache.load_csr(
+            os.path.join(self.store_dir, self.chunks[chunk_id]['name']), mmap_mode)
+        X = sparse.csr_matrix((X.data, X.indices, X.indptr),
+                              shape=(X.shape[0], self.n_features), copy=False)
+        return X, y
+
+    def iter_chunks(self, mmap_mode='r'):
+        for chunk_id in range(len(self.chunks)):
+            X, y = self.load_chunk(chunk_id, mmap_mode)
+            yield chunk_id, X, y
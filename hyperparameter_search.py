@@ -0,0 +1,224 @@
+import csv
+import itertools
+import os
+import tempfile
+import time
+from multiprocessing import Pool
+import numpy as np
+from sklearn.model_selection import train_test_split
+from feature_cache import save_csr, load_csr
+from classification import train_model, evaluate_model
+import warnings
+warnings.simplefilter(action='ignore', category=FutureWarning)
+
+# a list is a set of choices, a tuple (scale, low, high) a range sampled uniformly ('linear')
+# or log-uniformly ('log'); in a grid search a range is replaced by grid_size evenly spaced points
+SEARCH_SPACE = {
+    'C': ('log', 1e-3, 10.0),
+    'epsilon': ('log', 1e-6, 1e-1),
+    'test_size': [0.1],
+    'random_state': [0],
+}
+# the values of the parameters missing from a search space
+DEFAULT_PARAMS = {'C': 0.021, 'epsilon': 1e-3, 'test_size': 0.1, 'random_state': 0}
+METRICS = ('accuracy', 'precision', 'recall', 'f1', 'sum')
+
+# the dataset of the worker processes, memory mapped from the files written by the parent
+_dataset = None
+
+
+def _init_worker(data_dir):
+    global _dataset
+    _dataset = load_csr(data_dir, mmap_mode='r')
+
+
+def _value(distribution, rng):
+    if isinstance(distribution, list):
+        return distribution[rng.integers(len(distribution))]
+    scale, low, high = distribution
+    if scale == 'log':
+        return float(np.exp(rng.uniform(np.log(low), np.log(high))))
+    return float(rng.uniform(low, high))
+
+
+def _points(distribution, grid_size):
+    if isinstance(distribution, list):
+        return distribution
+    scale, low, high = distribution
+    if scale == 'log':
+        return [float(value) for value in np.geomspace(low, high, grid_size)]
+    return [float(value) for value in np.linspace(low, high, grid_size)]
+
+
+def sample_configurations(space=None, method='random', n_trials=100, grid_size=5, seed=0):
+    """
+    This function lists the configurations to try.
+
+    Inputs:
+        space (dict): The distribution of every parameter (see SEARCH_SPACE).
+        method (str): 'random' to draw n_trials configurations, 'grid' for every combination of the grid.
+        n_trials (int): The number of configurations of a random search.
+        grid_size (int): The number of grid points of a range in a grid search.
+        seed (int): The seed of the random search.
+
+    Returns:
+        configurations (list): The configurations, as dicts of parameter values.
+    """
+    space = SEARCH_SPACE if space is None else space
+    names = list(space)
+    if method == 'grid':
+        grid = itertools.product(*[_points(space[name], grid_size) for name in names])
+        return [dict(DEFAULT_PARAMS, **dict(zip(names, values))) for values in grid]
+    if method == 'random':
+        rng = np.random.default_rng(seed)
+        return [dict(DEFAULT_PARAMS, **{name: _value(space[name], rng) for name in names})
+                for _ in range(n_trials)]
+    raise ValueError(f'unknown search method: {method}')
+
+
+def _subsample(rows, y, fraction, seed):
+    # the same fraction of every label, so small budgets keep the malicious apps
+    if fraction >= 1.0:
+        return rows
+    rng = np.random.default_rng(seed)
+    kept = []
+    for label in np.unique(y[rows]):
+        label_rows = rows[y[rows] == label]
+        size = max(1, int(round(fraction * len(label_rows))))
+        kept.append(rng.choice(label_rows, size=size, replace=False))
+    return np.sort(np.concatenate(kept))
+
+
+def _score(accuracy, precision, recall, metric):
+    if metric == 'sum':
+        return accuracy + precision + recall
+    if metric == 'f1':
+        return 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'accuracy': accuracy, 'precision': precision, 'recall': recall}[metric]
+
+
+def _run_trial(task):
+    trial_id, params, budget, classifier, metric, keep_model, classifier_params = task
+    X, y = _dataset
+    rows = np.arange(X.shape[0])
+    # the validation split of the trial, the test rows are not part of the dataset of the search
+    train_rows, validation_rows = train_test_split(rows, test_size=params['test_size'], shuffle=True,
+                                                   random_state=params['random_state'], stratify=y)
+    train_rows = _subsample(np.sort(train_rows), y, budget, params['random_state'])
+    validation_rows = np.sort(validation_rows)
+    start = time.perf_counter()
+    # a trial runs in a pool worker, where ParallelSecSVM and BaggedLinearSVM train without processes of their own
+    model = train_model(X[train_rows], y[train_rows], C=params['C'], epsilon=params['epsilon'],
+                        random_state_val=params['random_state'], classifier=classifier, **classifier_params)
+    fit_time = time.perf_counter() - start
+    accuracy, precision, recall = evaluate_model(model, X[validation_rows], y[validation_rows])
+    result = dict(trial=trial_id, budget=budget, n_train=len(train_rows), **params,
+                  accuracy=accuracy, precision=precision, recall=recall,
+                  score=_score(accuracy, precision, recall, metric), fit_time=fit_time)
+    return result, model if keep_model else None
+
+
+def search_hyperparameters(X, y, space=None, method='random', n_trials=100, grid_size=5,
+                           classifier='linearsvc', metric='sum', halving=True, min_budget=0.1,
+                           eta=3, n_jobs=None, seed=0, work_dir=None, classifier_params=None):
+    """
+    This function searches the parameters of the model (C, epsilon, test_size, random_state) on a
+    preprocessed dataset. The dataset is written once as memory-mapped arrays that every worker
+    of a process pool maps instead of receiving a copy, and the trials run in parallel.
+    Every trial is scored on a validation split of the given rows (drawn with the test_size and
+    random_state of its configuration): the rows of the final test set must not be given to the
+    search, or the test metrics would be the ones the search optimized.
+    With successive halving, all configurations are first trained on a small fraction of the
+    training rows (1/eta^k, at least min_budget), and only the best 1/eta of them go on to the next
+    budget (eta times larger), until the survivors are trained on all the training rows.
+
+    Inputs:
+        X (scipy.sparse.csr_matrix): The preprocessed feature matrix of the training rows.
+        y (numpy.ndarray): The encoded labels of the training rows.
+        space (dict): The distribution of every parameter (see SEARCH_SPACE).
+        method (str): 'random' or 'grid'.
+        n_trials (int): The number of configurations of a random search.
+        grid_size (int): The number of grid points of a range in a grid search.
+        classifier (str): The classifier (see classification.train_model).
+        metric (str): The score the configurations are ranked by (see METRICS); 'sum' is
+                      accuracy + precision + recall.
+        halving (bool): Whether to eliminate configurations early with successive halving.
+        min_budget (float): The smallest fraction of the training rows of the first round.
+        eta (int): The elimination factor of successive halving.
+        n_jobs (int): The number of worker processes (default: all cores).
+        seed (int): The seed of the random search.
+        work_dir (str): The folder of the memory-mapped dataset (default: the temporary folder).
+        classifier_params (dict): Extra parameters of the classifier (see classification.train_model).
+
+    Returns:
+        best (dict): The parameters of the best configuration.
+        model: The best model, trained on all the training rows of its split.
+        results (list): Every trial, as a dict (the results table).
+    """
+    if metric not in METRICS:
+        raise ValueError(f'unknown metric: {metric}')
+    configurations = sample_configurations(space, method, n_trials, grid_size, seed)
+    budgets = [1.0]
+    if halving:
+        while budgets[0] / eta >= min_budget:
+            budgets.insert(0, budgets[0] / eta)
+
+    if work_dir is not None:
+        os.makedirs(work_dir, exist_ok=True)
+    results = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as data_dir:
+        save_csr(data_dir, X, np.asarray(y))
+        with Pool(n_jobs, initializer=_init_worker, initargs=(data_dir,)) as pool:
+            active = list(enumerate(configurations))
+            for rung, budget in enumerate(budgets):
+                last = rung == len(budgets) - 1
+                tasks = [(trial_id, params, budget, classifier, metric, last, classifier_params or {})
+                         for trial_id, params in active]
+                outcomes = pool.map(_run_trial, tasks, chunksize=1)
+                for result, _ in outcomes:
+                    result['rung'] = rung
+                    results.append(result)
+                if last:
+                    break
+                ranked = sorted(range(len(active)), key=lambda i: -outcomes[i][0]['score'])
+                active = [active[i] for i in ranked[:max(1, len(active) // eta)]]
+
+    best_index = max(range(len(outcomes)), key=lambda i: outcomes[i][0]['score'])
+    return dict(active[best_index][1]), outcomes[best_index][1], results
+
+
+def save_results(path, results):
+    """
+    This function writes the results table of a search as a CSV file.
+
+    Inputs:
+        path (str): The filepath of the CSV file.
+        results (list): The trials returned by search_hyperparameters.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    columns = list(dict.fromkeys(column for result in results for column in result))
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def print_results(results, top=10):
+    """
+    This function prints the best trials trained on all the training rows.
+
+    Inputs:
+        results (list): The trials returned by search_hyperparameters.
+        top (int): The number of trials to print.
+    """
+    final = [result for result in results if result['budget'] >= 1.0]
+    final.sort(key=lambda result: -result['score'])
+    print(f'{len(results)} trials, {len(final)} trained on all the training rows')
+    print(f'{"trial":>5} {"C":>10} {"epsilon":>10} {"test_size":>9} {"accuracy":>9} '
+          f'{"precision":>10} {"recall":>7} {"score":>7} {"fit s":>7}')
+    for result in final[:top]:
+        print(f'{result["trial"]:>5} {result["C"]:>10.4g} {result["epsilon"]:>10.3g} '
+              f'{result["test_size"]:>9.3f} {result["accuracy"]:>9.3f} {result["precision"]:>10.3f} '
+              f'{result["recall"]:>7.3f} {result["score"]:>7.3f} {result["fit_time"]:>7.3f}')
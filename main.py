@@ -1,113 +1,197 @@
+import argparse
+import numpy as np
 from sklearn.model_selection import train_test_split
 from setting import config
-from utils import get_random_number, load_data, count_apps
-from classification_utils import preprocess_data
-from classification import train_model, evaluate_model
+from utils import load_data
+from classification_utils import preprocess_data, save_preprocessor
+from feature_selection import select_features, save_selected_features
+from classification import train_model, evaluate_model_curves, \
+    train_model_out_of_core, evaluate_model_out_of_core
+from evaluation import print_evaluation
+from robustness import evaluate_robustness, print_robustness, BUDGETS
+from feature_store import open_feature_store
+from cross_validation import cross_validate, print_cross_validation
+from model_artifact import save_model_artifact
+from hyperparameter_search import search_hyperparameters, save_results, print_results
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
-# need to
-global c_val, epsilon_val, test_size_val, random_state_val
-global c_val_max, epsilon_val_max, random_state_val_max
-global accuracy_max, precision_max, recall_max
-global num_benign_apps, num_malicious_apps
 
 
-def initialization(malicious_count, benign_count):
-    test_size_val = 0.1  # Static 0.1
-    c_val = 0.021  # 1.0
-    epsilon_val = 1e-3
-
-    random_state_val = 0
-    c_val_max = 0
-    epsilon_val_max = 0
-    test_size_val_max = 0
-    random_state_val_max = random_state_val
-
-    accuracy_max = 0
-    precision_max = 0
-    recall_max = 0
-    return test_size_val, c_val, epsilon_val, random_state_val,\
-        c_val_max, epsilon_val_max, test_size_val_max,\
-        random_state_val_max, accuracy_max, precision_max, recall_max
-
-
-def main():
+def main(search=None, n_trials=100, cv=None):
     """"
      This is the main function that executes the entire process of loading the data, preprocessing it, 
-     training a model, and evaluating its performance. It also allows for the classification of a new APK.
+     training a model, and evaluating its performance. With search, the parameters (C, epsilon,
+     test_size and the split seed) are first searched in parallel (see hyperparameter_search).
 
     Inputs:
-        None.
+        search (str): None to train with the default parameters, 'random' or 'grid' to search them.
+        n_trials (int): The number of configurations of a random search.
+        cv (int): The number of folds to evaluate the model by cross-validation instead of a single split.
     Returns:
         None.
     """
 
     path = config['apksResultJsonPath']
 
-    # Load data
-    df, malicious_count, benign_count = load_data(
-        path)
-
-    df = df.rename(columns={'label': 'class'})
+    # Load data as a sparse feature matrix and labels
+    X, y, feature_names, malicious_count, benign_count = load_data(
+        path, config['vocabularyPath'], config['featureCachePath'],
+        n_benign=config['sampleBenign'], n_malicious=config['sampleMalicious'],
+        malicious_ratio=config['maliciousRatio'], storage=config['featureStorage'])
 
-    # Split data into features and labels
-    X = df.drop(columns=['class'])
-    y = df['class']
+    # Preprocess data (kept sparse) and save the fitted preprocessing for scoring
+    X_scaled, y_encoded, scaler, le = preprocess_data(X, y, config['scaling'])
+    save_preprocessor(config['preprocessorPath'], scaler, le)
 
-    test_size_val, c_val, epsilon_val, random_state_val,\
-        c_val_max, epsilon_val_max, test_size_val_max,\
-        random_state_val_max, accuracy_max, precision_max, recall_max = initialization(
-            malicious_count, benign_count)
+    extra = {}
+    if config['classifier'] == 'parallel_secsvm':
+        extra = {'n_jobs': config['trainJobs'], 'mode': config['trainMode']}
+    elif config['classifier'] == 'bagged':
+        extra = {'n_estimators': config['ensembleEstimators'], 'base': config['ensembleBase'],
+                 'max_features': config['ensembleMaxFeatures'], 'keep_members': config['ensembleKeepMembers'],
+                 'n_jobs': config['trainJobs']}
 
-    # Preprocess data
-    X_scaled, y_encoded = preprocess_data(X, y)
+    params = {'C': 0.021, 'epsilon': 1e-3, 'test_size': 0.1, 'random_state': 0}
 
-    # Optimization for results
-    # for x in range(1, 100):
-
-    #     # Random c and epsilon and test_size
-    #     test_size_val = get_random_number(0, 1, isInt=False)  # Static 0.1
-    #     c_val = get_random_number(1, 100)
-    #     epsilon_val = get_random_number(0, 1, isInt=False)
-
-    # Split data into training and test sets
+    # Split data into training and test sets (before the search, so that the test rows stay out of it)
     X_train, X_test, y_train, y_test = train_test_split(
-        X_scaled, y_encoded, test_size=test_size_val, shuffle=True)
+        X_scaled, y_encoded, test_size=params['test_size'], shuffle=True,
+        random_state=params['random_state'], stratify=y_encoded)
+
+    if search is not None:
+        # the trials are ranked on validation splits of the training rows, only C and epsilon are kept
+        best, _, results = search_hyperparameters(
+            X_train, y_train, method=search, n_trials=n_trials,
+            classifier=config['classifier'], metric=config['searchMetric'],
+            halving=config['searchHalving'], n_jobs=config['searchJobs'],
+            work_dir=config['featureCachePath'], classifier_params=extra)
+        params.update(C=best['C'], epsilon=best['epsilon'])
+        save_results(config['searchResultsPath'], results)
+        print_results(results)
+        print()
+
+    # Evaluate the model on every fold instead of a single split
+    if cv is not None:
+        # every fold fits the scaling and the feature selection on its own training rows
+        selection = None
+        if config['featureSelection'] is not None:
+            selection = {'method': config['featureSelection'], 'k': config['selectK'],
+                         'min_df': config['selectMinDf']}
+        results, summary = cross_validate(X, y_encoded, C=params['C'], epsilon=params['epsilon'],
+                                          random_state_val=params['random_state'],
+                                          classifier=config['classifier'], n_splits=cv,
+                                          scaling=config['scaling'], selection=selection,
+                                          classifier_params=extra)
+        print_cross_validation(results, summary)
+        return
+
+    # Select the features to train on (on the training set only) and save the selected vocabulary
+    columns = np.arange(X_scaled.shape[1])
+    if config['featureSelection'] is not None:
+        columns = select_features(X_train, y_train, config['featureSelection'],
+                                  k=config['selectK'], min_df=config['selectMinDf'])
+        X_train, X_test = X_train[:, columns], X_test[:, columns]
+        save_selected_features(config['selectedFeaturesPath'], feature_names, columns)
+        print(f'selected features = {len(columns)} of {len(feature_names)}')
 
     # Train model
-    model = train_model(X_train, y_train, C=c_val,
-                        epsilon=epsilon_val, random_state_val=random_state_val)
-
-    # Evaluate model
-    accuracy, precision, recall = evaluate_model(model, X_test, y_test)
-    if (accuracy + precision + recall > accuracy_max + precision_max + recall_max):
-        c_val_max = c_val
-        accuracy_max = accuracy
-        precision_max = precision
-        recall_max = recall
-        epsilon_val_max = epsilon_val
-        test_size_val_max = test_size_val
-        print(f'c_val_max: {c_val_max:.3f}')
-        print(f'epsilon_val_max: {epsilon_val_max:.10f}')
-        print(f'test_size_val_max: {test_size_val_max:.3f}')
-        print(f'accuracy_max: {accuracy_max:.3f}')
-        print(f'precision_max: {precision_max:.3f}')
-        print(f'recall_max: {recall_max:.3f}')
-        print(f'Evaluate new model data and searching for a better results...')
-        print()
+    model = train_model(X_train, y_train, C=params['C'],
+                        epsilon=params['epsilon'], random_state_val=params['random_state'],
+                        classifier=config['classifier'], **extra)
+
+    # Evaluate model (the metrics at the decision threshold, the curves and the FPR operating points)
+    report = evaluate_model_curves(model, X_test, y_test)
+    accuracy, precision, recall = report['accuracy'], report['precision'], report['recall']
 
     print(f' ******************************** Results ********************************')
     print(f'Results:')
-    print(f'c_val_max: {c_val_max:.3f}')
-    print(f'epsilon_val_max: {epsilon_val_max:.10f}')
-    print(f'test_size_val_max: {test_size_val_max:.3f}')
-    print(f'accuracy_max: {accuracy_max:.3f}')
-    print(f'precision_max: {precision_max:.3f}')
-    print(f'recall_max: {recall_max:.3f}')
+    print(f'c_val: {params["C"]:.3f}')
+    print(f'epsilon_val: {params["epsilon"]:.10f}')
+    print(f'test_size_val: {params["test_size"]:.3f}')
     print(f'Accuracy: {accuracy:.3f}')
     print(f'Precision: {precision:.3f}')
     print(f'Recall: {recall:.3f}')
+    print_evaluation(report)
+
+    # Simulate feature-addition evasion on the malicious test apps
+    names = [feature_names[i] for i in columns]
+    budgets = BUDGETS
+    if config['robustnessGate'] is not None:
+        budget, min_detection = int(config['robustnessGate'][0]), config['robustnessGate'][1]
+        if budget < 0:
+            raise ValueError(f'the budget of robustnessGate must be a number of added features, got {budget}')
+        # the budget of the gate is always evaluated, even when it is not one of the reported budgets
+        budgets = sorted(set(BUDGETS) | {budget})
+    robustness = evaluate_robustness(model.coef_, model.intercept_[0], X_test, y_test, names,
+                                     scale=scaler.scale_[columns], budgets=budgets)
+    print_robustness(robustness)
+    if config['robustnessGate'] is not None:
+        detection = robustness['detection_rate'][robustness['budgets'].index(budget)]
+        if detection < min_detection:
+            print(f'detection rate {detection:.1%} with {budget} added features is below '
+                  f'{min_detection:.1%}, the model is not saved')
+            return
+
+    # Save the model with its vocabulary and preprocessing, for model_artifact.load_model_artifact
+    save_model_artifact(
+        config['artifactPath'], model.coef_, model.intercept_[0], names,
+        columns=columns, scale=scaler.scale_[columns], classes=le.classes_,
+        metadata={'classifier': config['classifier'], 'scaling': config['scaling'],
+                  'feature_selection': config['featureSelection'], 'params': params,
+                  'n_train': X_train.shape[0], 'n_test': X_test.shape[0],
+                  'metrics': {'accuracy': accuracy, 'precision': precision, 'recall': recall,
+                              'roc_auc': report['roc_auc'], 'average_precision': report['average_precision']},
+                  'operating_points': report['operating_points'],
+                  'robustness': robustness},
+        members=None if getattr(model, 'members_coef_', None) is None else (model.members_coef_, model.members_intercept_))
+    print(f'model saved at {config["artifactPath"]}')
+
+
+def main_out_of_core():
+    """
+     This function trains and evaluates the model out of core: data.json is converted once into a
+     chunked feature store on disk, and training streams mini-batches from it, so the whole matrix
+     never has to fit in memory.
+
+    Inputs:
+        None.
+    Returns:
+        None.
+    """
+    test_size_val, c_val, epsilon_val, random_state_val = 0.1, 0.021, 1e-3, 0
+
+    store = open_feature_store(config['apksResultJsonPath'], config['featureStorePath'],
+                               config['vocabularyPath'])
+    print(f'feature store: {store.n_rows} apps, {store.n_features} features, '
+          f'{len(store.chunks)} chunks')
+
+    model, scaler = train_model_out_of_core(store, C=c_val, epsilon=epsilon_val,
+                                            random_state_val=random_state_val,
+                                            test_size=test_size_val)
+    accuracy, precision, recall = evaluate_model_out_of_core(
+        model, scaler, store, random_state_val, test_size=test_size_val)
+    print(f'Accuracy: {accuracy:.3f}')
+    print(f'Precision: {precision:.3f}')
+    print(f'Recall: {recall:.3f}')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Train and evaluate the Android malware detector.')
+    parser.add_argument('--out-of-core', action='store_true',
+                        help='train from a chunked on-disk feature store with bounded memory')
+    parser.add_argument('--search', choices=['random', 'grid'], default=None,
+                        help='search C, epsilon, test_size and the split seed before training')
+    parser.add_argument('--trials', type=int, default=100,
+                        help='the number of configurations of a random search')
+    parser.add_argument('--cv', type=int, default=None,
+                        help='evaluate by stratified k-fold cross-validation with this many folds')
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
-    main()
+    args = parse_args()
+    if args.out_of_core:
+        main_out_of_core()
+    else:
+        main(args.search, args.trials, args.cv)
@@ -0,0 +1,306 @@
+# The persisted model artifact and its scoring path. This module only depends on numpy, so that
+# loading a model and scoring apps imports neither sklearn, scipy, pandas nor matplotlib.
+# An artifact is a folder holding model.npz (the weights, the intercept, the scale of every feature,
+# folded into the weights when loading, and the column of every feature in the matrix built from
+# data.json: its vocabulary ID, or its bucket for hashed features), vocabulary.txt (the feature
+# names in weight order) and metadata.json (the versions, the training parameters and metrics).
+import itertools
+import json
+import os
+import shutil
+import time
+import numpy as np
+
+# bump when the layout of the artifact changes
+ARTIFACT_VERSION = 1
+
+
+def save_model_artifact(directory, coef, intercept, feature_names, columns=None, scale=None,
+                        classes=(0, 1), metadata=None, members=None):
+    """
+    This function writes a model artifact, replacing the previous one at once.
+
+    Inputs:
+        directory (str): The folder of the artifact.
+        coef (numpy.ndarray): The weights of the linear model, one per feature.
+        intercept (float): The intercept of the linear model.
+        feature_names (list): The name of every feature, in weight order.
+        columns (numpy.ndarray): The column of every feature in the matrix built from data.json
+                                 (default: the features are all the columns, in order).
+        scale (numpy.ndarray): The scale the features are divided by before the model (default: none).
+        classes (tuple): The labels of the negative and positive decisions.
+        metadata (dict): The training parameters, metrics and anything worth keeping with the model.
+        members (tuple): The weights (one row per member) and intercepts of the members of an averaged
+                         ensemble, to estimate the variance of the scores (default: none).
+
+    Returns:
+        metadata (dict): The metadata written (with the versions added).
+    """
+    coef = np.asarray(coef, dtype=np.float64).ravel()
+    n_features = len(coef)
+    columns = np.arange(n_features) if columns is None else np.asarray(columns, dtype=np.int64)
+    scale = np.ones(n_features) if scale is None else np.asarray(scale, dtype=np.float64)
+    if not len(feature_names) == len(columns) == len(scale) == n_features:
+        raise ValueError('the weights, feature names, columns and scale must have the same length')
+    metadata = dict(metadata or {})
+    metadata.update({'artifact_version': ARTIFACT_VERSION,
+                     'model_version': time.strftime('%Y%m%dT%H%M%SZ', time.gmtime()),
+                     'created': time.time(),
+                     'n_features': n_features,
+                     'classes': [int(label) for label in classes]})
+
+    tmp_dir = directory.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    arrays = {}
+    if members is not None:
+        arrays = {'members_coef': np.asarray(members[0], dtype=np.float64),
+                  'members_intercept': np.asarray(members[1], dtype=np.float64)}
+        metadata['n_members'] = len(arrays['members_intercept'])
+    np.savez(os.path.join(tmp_dir, 'model.npz'), coef=coef, intercept=np.array([float(intercept)]),
+             scale=scale, columns=columns, **arrays)
+    with open(os.path.join(tmp_dir, 'vocabulary.txt'), 'w', encoding='utf-8') as f:
+        for name in feature_names:
+            f.write(name + '\n')
+    with open(os.path.join(tmp_dir, 'metadata.json'), 'w') as f:
+        json.dump(metadata, f, indent=2)
+    old_dir = directory.rstrip('/') + '.old'
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(directory):
+        os.rename(directory, old_dir)
+    os.rename(tmp_dir, directory)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return metadata
+
+
+def top_contributions(rows, indices, contributions, n_rows, top=5, names=None):
+    """
+    This function selects the largest contributions (in absolute value) of every row of a sparse
+    matrix given as COO entries, with one (lexicographic) sort of all the entries. The zero
+    contributions (e.g. of features with a zero weight) are left out, so a row may get fewer than
+    top pairs.
+
+    Inputs:
+        rows (numpy.ndarray): The row of every entry.
+        indices (numpy.ndarray): The feature of every entry.
+        contributions (numpy.ndarray): The contribution to the score of every entry.
+        n_rows (int): The number of rows.
+        top (int): The number of contributions kept per row.
+        names (numpy.ndarray): The name of every feature, to return names instead of indices.
+
+    Returns:
+        explanations (list): For every row, the (feature, contribution) pairs, the largest first.
+    """
+    nonzero = contributions != 0
+    rows, indices, contributions = rows[nonzero], indices[nonzero], contributions[nonzero]
+    # the entries sorted by row, then by decreasing magnitude within the row (ties keep their order)
+    order = np.lexsort((-np.abs(contributions), rows))
+    counts = np.bincount(rows, minlength=n_rows)
+    # the rank of every entry within its row
+    rank = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    kept = order[rank < top]
+    features = indices[kept] if names is None else names[indices[kept]]
+    pairs = list(zip(features.tolist(), contributions[kept].tolist()))
+    bounds = np.r_[0, np.cumsum(np.minimum(counts, top))].tolist()
+    return [pairs[bounds[i]:bounds[i + 1]] for i in range(n_rows)]
+
+
+class ScoringModel:
+    """
+    A linear model loaded from an artifact, scoring feature records with numpy only. The scaling is
+    folded into the weights, so a score is a sum of weights plus the intercept.
+
+    Inputs:
+        directory (str): The folder of the artifact.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'metadata.json'), 'r') as f:
+            self.metadata = json.load(f)
+        if self.metadata.get('artifact_version') != ARTIFACT_VERSION:
+            raise ValueError(f'unsupported model artifact version: {self.metadata.get("artifact_version")}')
+        with np.load(os.path.join(directory, 'model.npz')) as arrays:
+            self.weights = arrays['coef'] / arrays['scale']
+            self.intercept = float(arrays['intercept'][0])
+            self.columns = arrays['columns']
+            self.members_weights = arrays['members_coef'] / arrays['scale'] if 'members_coef' in arrays else None
+            self.members_intercept = arrays['members_intercept'] if 'members_coef' in arrays else None
+        self.classes = np.array(self.metadata['classes'])
+        self._feature_names = None
+        self._name_array = None
+        self._names = None
+        self._by_column = None
+
+    @property
+    def feature_names(self):
+        # read on first use only, the scoring of feature IDs does not need the names
+        if self._feature_names is None:
+            with open(os.path.join(self.directory, 'vocabulary.txt'), 'r', encoding='utf-8') as f:
+                self._feature_names = f.read().split('\n')[:-1]
+        return self._feature_names
+
+    def _column_lookup(self):
+        # the weight of every column of data.json (vocabulary ID or bucket), -1 when the model ignores it
+        if self._by_column is None:
+            size = int(self.columns.max()) + 1 if len(self.columns) else 0
+            self._by_column = np.full(size, -1, dtype=np.int64)
+            self._by_column[self.columns] = np.arange(len(self.columns))
+        return self._by_column
+
+    def encode_records(self, records):
+        """
+        This function maps feature records of data.json to a sparse matrix over the weights, given as
+        the weight index and value of every feature and the row of every feature (COO entries, row
+        after row). Features unknown to the model are dropped.
+
+        Inputs:
+            records (list): Records holding feature IDs, hashed indices and values, or {feature name: value} entries.
+
+        Returns:
+            indices (numpy.ndarray): The weight index of every entry.
+            values (numpy.ndarray): The value of every entry.
+            rows (numpy.ndarray): The row of every entry.
+        """
+        columns = []
+        values = []
+        lengths = []
+        names = None
+        for record in records:
+            if 'feature_ids' in record:
+                ids = record['feature_ids']
+                columns.extend(ids)
+                values.extend(itertools.repeat(1.0, len(ids)))
+                lengths.append(len(ids))
+            elif 'hashed_indices' in record:
+                columns.extend(record['hashed_indices'])
+                values.extend(record['hashed_values'])
+                lengths.append(len(record['hashed_indices']))
+            else:
+                if names is None:
+                    names = self._name_columns()
+                count = 0
+                for name, value in record.items():
+                    column = names.get(name)
+                    if column is not None:
+                        columns.append(column)
+                        values.append(value)
+                        count += 1
+                lengths.append(count)
+        lookup = self._column_lookup()
+        columns = np.array(columns, dtype=np.int64)
+        values = np.array(values, dtype=np.float64)
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        inside = (columns >= 0) & (columns < len(lookup))
+        indices = np.full(len(columns), -1, dtype=np.int64)
+        indices[inside] = lookup[columns[inside]]
+        known = indices >= 0
+        return indices[known], values[known], rows[known]
+
+    def _name_columns(self):
+        # the data.json column of every feature name (sha256 and label are not features)
+        if self._names is None:
+            self._names = dict(zip(self.feature_names, self.columns.tolist()))
+            self._names.pop('sha256', None)
+            self._names.pop('label', None)
+        return self._names
+
+    def used_features(self, tolerance=0.0):
+        """
+        This function lists the features the model actually uses, to restrict the feature extraction
+        to them. Dropping the features whose weight is at most tolerance (in absolute value) changes
+        the score of an app by at most the sum of their weights.
+
+        Inputs:
+            tolerance (float): The largest weight considered negligible.
+
+        Returns:
+            names (list): The names of the features whose weight is larger than tolerance.
+        """
+        used = np.flatnonzero(np.abs(self.weights) > tolerance)
+        names = self.feature_names
+        return [names[i] for i in used]
+
+    def score_records(self, records):
+        """
+        This function computes the decision values of several records at once, with a single sparse
+        matrix-vector product over the weights.
+
+        Inputs:
+            records (list): The feature records.
+
+        Returns:
+            scores (numpy.ndarray): The decision value of every record (positive means malicious).
+        """
+        indices, values, rows = self.encode_records(records)
+        return np.bincount(rows, weights=self.weights[indices] * values,
+                           minlength=len(records)) + self.intercept
+
+    def explain_records(self, records, top=5):
+        """
+        This function computes the decision values of several records and explains them: the features
+        with the largest contributions (weight times value) to every score.
+
+        Inputs:
+            records (list): The feature records.
+            top (int): The number of features per explanation.
+
+        Returns:
+            scores (numpy.ndarray): The decision value of every record.
+            explanations (list): For every record, the (feature name, contribution) pairs, the largest first.
+        """
+        indices, values, rows = self.encode_records(records)
+        contributions = self.weights[indices] * values
+        scores = np.bincount(rows, weights=contributions, minlength=len(records)) + self.intercept
+        if self._name_array is None:
+            self._name_array = np.array(self.feature_names, dtype=object)
+        return scores, top_contributions(rows, indices, contributions, len(records), top, self._name_array)
+
+    def score_variance(self, records):
+        """
+        This function estimates the variance of the decision values of several records over the members
+        of an averaged ensemble (saved with its members).
+
+        Inputs:
+            records (list): The feature records.
+
+        Returns:
+            variance (numpy.ndarray): The variance of the decision value of every record.
+        """
+        if self.members_weights is None:
+            raise ValueError('the artifact holds no ensemble members')
+        indices, values, rows = self.encode_records(records)
+        scores = np.stack([np.bincount(rows, weights=weights[indices] * values, minlength=len(records))
+                           for weights in self.members_weights], axis=1) + self.members_intercept
+        return scores.var(axis=1, ddof=1) if scores.shape[1] > 1 else np.zeros(len(records))
+
+    def score(self, record):
+        """
+        This function computes the decision value of a feature record (positive means malicious).
+        """
+        return float(self.score_records([record])[0])
+
+    def verdicts(self, scores):
+        """
+        This function turns decision values into labels.
+        """
+        return self.classes[(np.asarray(scores) > 0).astype(int)]
+
+    def classify(self, record):
+        """
+        This function predicts the label of a feature record.
+        """
+        return int(self.verdicts([self.score(record)])[0])
+
+
+def load_model_artifact(directory):
+    """
+    This function loads a model artifact for scoring.
+
+    Inputs:
+        directory (str): The folder of the artifact.
+
+    Returns:
+        model (ScoringModel): The model.
+    """
+    return ScoringModel(directory)
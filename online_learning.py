@@ -0,0 +1,407 @@
+import argparse
+import json
+import os
+import pickle
+import time
+import numpy as np
+from scipy import sparse
+from sklearn.base import BaseEstimator, ClassifierMixin
+from setting import config
+from utils import RecordEncoder, load_vocabulary, load_cached_data
+import warnings
+warnings.simplefilter(action='ignore', category=FutureWarning)
+
+# number of bytes before the read offset that must be unchanged to resume reading data.json there
+TAIL_SIZE = 64
+
+
+class OnlineSVM(BaseEstimator, ClassifierMixin):
+    """
+        A linear SVM (hinge loss) learned online by projected mini-batch subgradient steps, over a
+        feature space that can grow: the columns added to the vocabulary since the last update get a
+        zero weight. The scaling statistics (see classification_utils.build_scaler) are updated with
+        every batch, and the regularization follows the SecSVM objective, 0.5 * ||w||^2 + C * sum of
+        the hinge losses over all the apps seen so far.
+
+    Inputs:
+        C (float): The regularization parameter.
+        lb (float): The lower bound of the weights (-inf for an unbounded SVM).
+        ub (float): The upper bound of the weights.
+        batch_size (int): The number of rows of a mini-batch.
+        epochs (int): The number of passes over the rows of fit (partial_fit makes a single pass).
+        learning_rate (float): The initial step size.
+        scaling (str): 'standard' or 'maxabs'.
+        random_state (int): The seed of the mini-batch order.
+    """
+
+    def __init__(self, C=0.021, lb=-np.inf, ub=np.inf, batch_size=32, epochs=5,
+                 learning_rate=1.0, scaling='standard', random_state=None):
+        self.C = C
+        self.lb = lb
+        self.ub = ub
+        self.batch_size = batch_size
+        self.epochs = epochs
+        self.learning_rate = learning_rate
+        self.scaling = scaling
+        self.random_state = random_state
+
+    def _grow(self, n_features):
+        if getattr(self, 'coef_', None) is None:
+            self.coef_ = np.zeros((1, 0))
+            self.intercept_ = np.zeros(1)
+            self.n_seen_ = 0
+            self.t_ = 0
+            self.sum_ = np.zeros(0)
+            self.sum_squares_ = np.zeros(0)
+            self.max_abs_ = np.zeros(0)
+        extra = n_features - self.coef_.shape[1]
+        if extra > 0:
+            self.coef_ = np.hstack([self.coef_, np.zeros((1, extra))])
+            self.sum_ = np.concatenate([self.sum_, np.zeros(extra)])
+            self.sum_squares_ = np.concatenate([self.sum_squares_, np.zeros(extra)])
+            self.max_abs_ = np.concatenate([self.max_abs_, np.zeros(extra)])
+
+    @property
+    def n_features_(self):
+        return self.coef_.shape[1]
+
+    def _update_statistics(self, X):
+        X = sparse.csr_matrix(X)
+        self.n_seen_ += X.shape[0]
+        self.sum_ += np.asarray(X.sum(axis=0)).ravel()
+        self.sum_squares_ += np.asarray(X.multiply(X).sum(axis=0)).ravel()
+        self.max_abs_ = np.maximum(self.max_abs_, np.asarray(abs(X).max(axis=0).todense()).ravel())
+
+    def scale(self):
+        """
+        This function returns the current scale of every feature (1 for the constant features).
+        """
+        if self.scaling == 'maxabs':
+            scale = self.max_abs_.copy()
+        else:
+            n = max(self.n_seen_, 1)
+            scale = np.sqrt(np.maximum(self.sum_squares_ / n - (self.sum_ / n) ** 2, 0.0))
+        scale[scale == 0] = 1.0
+        return scale
+
+    def _transform(self, X):
+        X = sparse.csr_matrix(X)
+        if X.shape[1] < self.n_features_:
+            X = sparse.csr_matrix((X.data, X.indices, X.indptr), shape=(X.shape[0], self.n_features_))
+        return X @ sparse.diags(1.0 / self.scale())
+
+    def _steps(self, X, y_signed, rng):
+        w = self.coef_.ravel()
+        b = self.intercept_[0]
+        # the regularization of the objective divided by C * n, n being every app seen so far
+        lam = 1.0 / (self.C * max(self.n_seen_, 1))
+        order = rng.permutation(X.shape[0])
+        for start in range(0, X.shape[0], self.batch_size):
+            batch = order[start:start + self.batch_size]
+            margin = y_signed[batch] * (X[batch] @ w + b)
+            coefficients = np.where(margin < 1, y_signed[batch], 0.0)
+            eta = self.learning_rate / (1.0 + self.learning_rate * lam * self.t_)
+            w = np.clip(w * (1.0 - eta * lam) + eta / len(batch) * (X[batch].T @ coefficients),
+                        self.lb, self.ub)
+            b += eta / len(batch) * coefficients.sum()
+            self.t_ += 1
+        self.coef_ = w.reshape(1, -1)
+        self.intercept_ = np.array([b])
+
+    def partial_fit(self, X, y, classes=None):
+        """
+        This function updates the model with a batch of new apps (one pass).
+
+        Inputs:
+            X (scipy.sparse.csr_matrix): The unscaled feature values of the new apps. It can have more
+                                         columns than the model (new features) but not fewer.
+            y (numpy.ndarray): The labels of the new apps (0/1).
+            classes (list): Unused, the labels are 0 (benign) and 1 (malicious).
+
+        Returns:
+            self (OnlineSVM): The updated model.
+        """
+        self.classes_ = np.array([0, 1])
+        self._grow(X.shape[1])
+        if X.shape[0] == 0:
+            return self
+        self._update_statistics(X)
+        rng = np.random.default_rng(None if self.random_state is None else [self.random_state, self.t_])
+        self._steps(self._transform(X), np.where(np.asarray(y) == 1, 1.0, -1.0), rng)
+        return self
+
+    def fit(self, X, y):
+        """
+        This function trains the model from scratch on all the apps (epochs passes).
+
+        Inputs:
+            X (scipy.sparse.csr_matrix): The unscaled feature values.
+            y (numpy.ndarray): The labels (0/1).
+
+        Returns:
+            self (OnlineSVM): The trained model.
+        """
+        self.coef_ = None
+        self.classes_ = np.array([0, 1])
+        self._grow(X.shape[1])
+        self._update_statistics(X)
+        X_scaled = self._transform(X)
+        y_signed = np.where(np.asarray(y) == 1, 1.0, -1.0)
+        rng = np.random.default_rng(self.random_state)
+        for epoch in range(self.epochs):
+            self._steps(X_scaled, y_signed, rng)
+        return self
+
+    def decision_function(self, X):
+        return np.asarray(self._transform(X) @ self.coef_.ravel()).ravel() + self.intercept_[0]
+
+    def predict(self, X):
+        return (self.decision_function(X) > 0).astype(int)
+
+
+def _json_array(filename):
+    with open(filename, 'rb') as f:
+        return f.read(4096).lstrip()[:1] == b'['
+
+
+def _end_offset(filename):
+    # the offset right after the last record of data.json (before the closing bracket of an array)
+    size = os.path.getsize(filename)
+    if not _json_array(filename):
+        return size
+    with open(filename, 'rb') as f:
+        f.seek(max(0, size - 4096))
+        tail = f.read()
+    return size - len(tail) + tail.rfind(b']')
+
+
+def _read_tail(filename, offset):
+    with open(filename, 'rb') as f:
+        f.seek(max(0, offset - TAIL_SIZE))
+        return f.read(offset - max(0, offset - TAIL_SIZE))
+
+
+def read_new_records(filename, offset):
+    """
+    This function reads the records appended to data.json (or to a JSON lines file) after an offset,
+    without reading what comes before it.
+
+    Inputs:
+        filename (str): The filepath of the JSON file.
+        offset (int): The byte offset right after the last record already consumed.
+
+    Returns:
+        records (list): The new records.
+        offset (int): The byte offset right after the last new record.
+    """
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        text = f.read().decode('utf-8')
+    decoder = json.JSONDecoder()
+    records = []
+    pos = end = 0
+    while True:
+        while pos < len(text) and text[pos] in ' \t\r\n,[':
+            pos += 1
+        if pos >= len(text) or text[pos] == ']':
+            break
+        try:
+            record, pos = decoder.raw_decode(text, pos)
+        except ValueError:
+            # a record still being written
+            break
+        records.append(record)
+        end = pos
+    return records, offset + len(text[:end].encode('utf-8'))
+
+
+def _metrics(y, y_pred):
+    tp = int(np.sum((y_pred == 1) & (y == 1)))
+    fp = int(np.sum((y_pred == 1) & (y == 0)))
+    fn = int(np.sum((y_pred == 0) & (y == 1)))
+    accuracy = float(np.mean(y_pred == y)) if len(y) else 0.0
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    return accuracy, precision, recall
+
+
+class OnlineState:
+    """
+    The persisted state of the incremental training: the model, the feature names of its columns,
+    the position reached in data.json, and the drift metrics of every update.
+
+    Inputs:
+        path (str): The filepath of the pickle file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.model = None
+        self.feature_names = []
+        self.offset = 0
+        self.tail = b''
+        self.updates_since_reconciliation = 0
+        self.history = []
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls(path)
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        state.path = path
+        return state
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(self.path + '.tmp', 'wb') as f:
+            pickle.dump(self, f)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def reconcile(state, filename, vocabulary_filename=None, cache_dir=None, **params):
+    """
+    This function retrains the model from scratch on the whole data.json, to undo the drift
+    accumulated by the incremental updates, and reports how far the incremental model had drifted
+    (the fraction of apps it classifies differently and the cosine between the two weight vectors).
+
+    Inputs:
+        state (OnlineState): The state to reconcile.
+        filename (str): The filepath of data.json.
+        vocabulary_filename (str): The filepath of the feature vocabulary.
+        cache_dir (str): The folder of the feature matrix cache.
+        **params: The parameters of the OnlineSVM.
+
+    Returns:
+        report (dict): The reconciliation report.
+    """
+    start = time.perf_counter()
+    offset = _end_offset(filename)
+    X, y, feature_names, _ = load_cached_data(filename, vocabulary_filename, cache_dir)
+    model = OnlineSVM(**params).fit(X, y)
+    report = {'kind': 'reconcile', 'time': time.time(), 'n_apps': X.shape[0], 'n_features': X.shape[1]}
+    previous = state.model
+    if previous is not None:
+        disagreement = float(np.mean(previous.predict(X) != model.predict(X)))
+        w_previous = np.zeros(X.shape[1])
+        shared = min(previous.n_features_, X.shape[1])
+        w_previous[:shared] = previous.coef_.ravel()[:shared]
+        w = model.coef_.ravel()
+        norms = np.linalg.norm(w_previous) * np.linalg.norm(w)
+        report['disagreement'] = disagreement
+        report['weight_cosine'] = float(w_previous @ w / norms) if norms else 0.0
+    report['accuracy'], report['precision'], report['recall'] = _metrics(y, model.predict(X))
+    report['seconds'] = time.perf_counter() - start
+    state.model = model
+    state.feature_names = list(feature_names)
+    state.offset = offset
+    state.tail = _read_tail(filename, offset)
+    state.updates_since_reconciliation = 0
+    state.history.append(report)
+    state.save()
+    return report
+
+
+def update(state, filename, vocabulary_filename=None, cache_dir=None, reconcile_every=30, **params):
+    """
+    This function updates the persisted model with the records appended to data.json since the last
+    update. The new apps are first scored by the current model (the drift metrics: accuracy,
+    precision and recall on apps it has never seen, mean decision score, malicious rate and the share
+    of their features that are new), then learned with partial_fit.
+    The model is retrained from scratch (see reconcile) when there is no model yet, every
+    reconcile_every updates, or when data.json was rewritten before the read offset.
+
+    Inputs:
+        state (OnlineState): The state to update.
+        filename (str): The filepath of data.json.
+        vocabulary_filename (str): The filepath of the feature vocabulary.
+        cache_dir (str): The folder of the feature matrix cache.
+        reconcile_every (int): The number of updates between two full retrainings, None to never reconcile.
+        **params: The parameters of the OnlineSVM.
+
+    Returns:
+        report (dict): The update (or reconciliation) report.
+    """
+    if state.model is None or _read_tail(filename, state.offset) != state.tail or \
+            (reconcile_every is not None and state.updates_since_reconciliation >= reconcile_every):
+        return reconcile(state, filename, vocabulary_filename, cache_dir, **params)
+
+    start = time.perf_counter()
+    records, offset = read_new_records(filename, state.offset)
+    vocabulary = state.feature_names
+    if vocabulary_filename is not None and os.path.exists(vocabulary_filename):
+        vocabulary = load_vocabulary(vocabulary_filename)
+    encoder = RecordEncoder(vocabulary)
+    X, y, _ = encoder.encode(records)
+    model = state.model
+    report = {'kind': 'update', 'time': time.time(), 'n_apps': X.shape[0], 'n_features': X.shape[1]}
+    if X.shape[0]:
+        known = model.n_features_
+        report['new_features'] = X.shape[1] - known
+        report['new_feature_rate'] = float(np.mean(X.indices >= known)) if X.nnz else 0.0
+        scores = model.decision_function(X[:, :known])
+        report['accuracy'], report['precision'], report['recall'] = _metrics(y, (scores > 0).astype(int))
+        report['mean_score'] = float(scores.mean())
+        report['malicious_rate'] = float(np.mean(y == 1))
+        model.partial_fit(X, y)
+    report['seconds'] = time.perf_counter() - start
+    state.feature_names = list(encoder.get_feature_names())
+    state.offset = offset
+    state.tail = _read_tail(filename, offset)
+    state.updates_since_reconciliation += 1
+    state.history.append(report)
+    state.save()
+    return report
+
+
+def drift_summary(state, window=10):
+    """
+    This function compares the latest update with the mean of the previous ones since the last
+    reconciliation (a falling accuracy on new apps or a rising share of new features signals drift).
+
+    Inputs:
+        state (OnlineState): The state.
+        window (int): The number of previous updates to compare with.
+
+    Returns:
+        summary (dict): The latest value and the previous mean of every drift metric.
+    """
+    updates = []
+    for report in reversed(state.history):
+        if report['kind'] == 'reconcile':
+            break
+        if report['n_apps']:
+            updates.append(report)
+    summary = {}
+    if not updates:
+        return summary
+    latest, previous = updates[0], updates[1:window + 1]
+    for metric in ('accuracy', 'precision', 'recall', 'mean_score', 'malicious_rate', 'new_feature_rate'):
+        summary[metric] = {'latest': latest[metric],
+                           'previous_mean': float(np.mean([report[metric] for report in previous])) if previous else None}
+    return summary
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Incremental training of the detector from new feature reports.')
+    parser.add_argument('command', choices=['update', 'reconcile', 'status'])
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    state = OnlineState.load(config['onlineModelPath'])
+    params = {'C': 0.021, 'scaling': config['scaling'], 'random_state': 0}
+    if args.command == 'update':
+        print(update(state, config['apksResultJsonPath'], config['vocabularyPath'], config['featureCachePath'],
+                     reconcile_every=config['onlineReconcileEvery'], **params))
+    elif args.command == 'reconcile':
+        print(reconcile(state, config['apksResultJsonPath'], config['vocabularyPath'], config['featureCachePath'],
+                        **params))
+    for metric, values in drift_summary(state).items():
+        previous = 'n/a' if values['previous_mean'] is None else f'{values["previous_mean"]:.3f}'
+        print(f'{metric}: {values["latest"]:.3f} (previous mean {previous})')
+    print(f'{len(state.history)} updates, {state.updates_since_reconciliation} since the last reconciliation, '
+          f'{len(state.feature_names)} features')
@@ -0,0 +1,302 @@
+import multiprocessing
+import os
+import threading
+import time
+import numpy as np
+from scipy import sparse
+from classification_utils import SecSVM
+from shared_data import share_csr, attach_csr, release_blocks
+
+# phases of the synchronous workers, and the number of barriers every phase goes through
+_STEP, _LOSS, _STOP = 0, 1, 2
+_PHASE_WAITS = {_STEP: 3, _LOSS: 2, _STOP: 1}
+# seconds a process waits for the others at a barrier before giving up
+_BARRIER_TIMEOUT = 600
+# seconds between two checks of the shared counters (asynchronous mode)
+_POLL_INTERVAL = 0.0005
+# number of rows of the blocks the loss is computed on
+_LOSS_BLOCK = 4096
+
+
+def _shard(worker_id, n_rows, n_jobs):
+    return worker_id * n_rows // n_jobs, (worker_id + 1) * n_rows // n_jobs
+
+
+def _failed(workers):
+    # the exit codes of the workers that died (a negative code is a signal)
+    return [worker.exitcode for worker in workers if worker.exitcode]
+
+
+def _shard_hinge_loss(X, y, start, end, w, b):
+    loss = 0.0
+    for block in range(start, end, _LOSS_BLOCK):
+        stop = min(block + _LOSS_BLOCK, end)
+        margin = y[block:stop] * (X[block:stop] @ w + b)
+        loss += float(np.maximum(0, 1 - margin).sum())
+    return loss
+
+
+def _sync_worker(handle, worker_id, n_jobs, batch_size, seed, barrier, C, lb, ub, learning_rate, t):
+    X, arrays, blocks = attach_csr(handle)
+    y, params, grads = arrays['labels'], arrays['params'], arrays['grads']
+    counts, losses, control = arrays['counts'], arrays['losses'], arrays['control']
+    n_rows, n_features = X.shape
+    start, end = _shard(worker_id, n_rows, n_jobs)
+    # the weights this worker updates from the sum of the gradients (worker 0 also updates the intercept)
+    first, last = _shard(worker_id, n_features, n_jobs)
+    lam = 1.0 / (C * n_rows)
+    rng = np.random.default_rng([seed, worker_id])
+    order = start + rng.permutation(end - start)
+    position = 0
+    try:
+        while True:
+            barrier.wait(_BARRIER_TIMEOUT)
+            phase = control[0]
+            if phase == _STOP:
+                break
+            w, b = params[:n_features], params[n_features]
+            if phase == _STEP:
+                if position >= len(order):
+                    order = start + rng.permutation(end - start)
+                    position = 0
+                batch = order[position:position + batch_size]
+                position += batch_size
+                y_batch = y[batch]
+                margin = y_batch * (X[batch] @ w + b)
+                coefficients = np.where(margin < 1, y_batch, 0.0)
+                grads[worker_id, :n_features] = X[batch].T @ coefficients
+                grads[worker_id, n_features] = coefficients.sum()
+                counts[worker_id] = len(batch)
+                # every gradient is written (and every worker is done reading the weights)
+                barrier.wait(_BARRIER_TIMEOUT)
+                # the same projected step as SecSVM, the reduction being split by columns between the workers
+                scale = C * n_rows / max(int(counts.sum()), 1)
+                eta = learning_rate / (1.0 + learning_rate * lam * t)
+                w_part = params[first:last]
+                subgrad_w = w_part - scale * grads[:, first:last].sum(axis=0)
+                params[first:last] = np.clip(w_part - eta * lam * subgrad_w, lb, ub)
+                if worker_id == 0:
+                    params[n_features] = b + eta * lam * scale * grads[:, n_features].sum()
+                t += 1
+            elif phase == _LOSS:
+                losses[worker_id] = _shard_hinge_loss(X, y, start, end, w, b)
+            barrier.wait(_BARRIER_TIMEOUT)
+    except threading.BrokenBarrierError:
+        # the parent gave up (a worker died or timed out)
+        pass
+    finally:
+        del X, y, params, grads, counts, losses, control, arrays
+        release_blocks(blocks)
+
+
+def _async_worker(handle, worker_id, n_jobs, batch_size, seed, C, lb, ub, learning_rate, max_epochs, t):
+    X, arrays, blocks = attach_csr(handle)
+    y, params = arrays['labels'], arrays['params']
+    epochs_done, control = arrays['epochs_done'], arrays['control']
+    n_rows, n_features = X.shape
+    start, end = _shard(worker_id, n_rows, n_jobs)
+    rng = np.random.default_rng([seed, worker_id])
+    w = params[:n_features]
+    lam = 1.0 / (C * n_rows)
+    # t counts the steps of all the workers
+    t = t / n_jobs
+    try:
+        for epoch in range(max_epochs):
+            # the parent computes the objective between two epochs, while every worker waits
+            while control[1] < epoch and control[0] != _STOP:
+                time.sleep(_POLL_INTERVAL)
+            order = start + rng.permutation(end - start)
+            for position in range(0, len(order), batch_size):
+                if control[0] == _STOP:
+                    return
+                batch = order[position:position + batch_size]
+                y_batch = y[batch]
+                # lock-free (Hogwild) update: the shared weights are read and written
+                # without synchronization, concurrent updates may overwrite each other
+                margin = y_batch * (X[batch] @ w + params[n_features])
+                coefficients = np.where(margin < 1, y_batch, 0.0)
+                # every worker takes one of n_jobs concurrent steps: count them all in the step size
+                eta = learning_rate / (1.0 + learning_rate * lam * t * n_jobs)
+                scale = eta / len(batch)
+                w *= 1.0 - eta * lam
+                w += scale * (X[batch].T @ coefficients)
+                np.clip(w, lb, ub, out=w)
+                params[n_features] += scale * coefficients.sum()
+                t += 1
+            epochs_done[worker_id] = epoch + 1
+    finally:
+        del X, y, w, params, epochs_done, control, arrays
+        release_blocks(blocks)
+
+
+class ParallelSecSVM(SecSVM):
+    """
+        A SecSVM trained data-parallel on several processes. The training rows are split in
+        contiguous shards, one per worker, and the matrix is shared through shared memory instead
+        of being copied to every worker.
+
+        mode='sync': at every step each worker computes the hinge-loss subgradient of a mini-batch
+        of its shard, then the workers sum them (each one a slice of the columns) and take the same
+        projected step as SecSVM with a global batch of batch_size rows.
+        mode='async': within an epoch, every worker runs its own mini-batch steps on the shared weights
+        without locks (Hogwild); between two epochs the workers wait for the parent to check the objective.
+
+        In a daemonic process (e.g. a worker of a multiprocessing pool), which cannot start processes,
+        the model is trained in the process itself as a SecSVM.
+
+    Inputs:
+        n_jobs (int): The number of worker processes (default: all cores).
+        mode (str): 'sync' or 'async'.
+        The other parameters are the ones of SecSVM, with the same defaults (batch_size is the global
+        batch in 'sync' mode, so n_jobs=1 gives the same weights as SecSVM, and the batch of every
+        worker in 'async' mode).
+    """
+
+    def __init__(self, C=1.0, lb=-1.0, ub=1.0, batch_size=32, max_epochs=100, tol=1e-4,
+                 learning_rate=1.0, random_state=None, warm_start=False, n_jobs=None, mode='sync'):
+        super().__init__(C=C, lb=lb, ub=ub, batch_size=batch_size, max_epochs=max_epochs,
+                         tol=tol, learning_rate=learning_rate, random_state=random_state,
+                         warm_start=warm_start)
+        self.n_jobs = n_jobs
+        self.mode = mode
+
+    def _fit_signed(self, X, y_signed, w, b, t=0):
+        if multiprocessing.current_process().daemon:
+            return super()._fit_signed(X, y_signed, w, b, t)
+        if not sparse.issparse(X):
+            X = sparse.csr_matrix(X)
+        n_jobs = self.n_jobs or os.cpu_count()
+        n_jobs = max(1, min(n_jobs, X.shape[0]))
+        seed = self.random_state if self.random_state is not None else np.random.randint(2 ** 31)
+        n_features = X.shape[1]
+        handle, blocks = share_csr(
+            X, y_signed,
+            params=np.append(w, b).astype(np.float64),
+            grads=np.zeros((n_jobs, n_features + 1)),
+            counts=np.zeros(n_jobs, dtype=np.int64),
+            losses=np.zeros(n_jobs),
+            epochs_done=np.zeros(n_jobs, dtype=np.int64),
+            control=np.zeros(2, dtype=np.int64))
+        try:
+            X_shared, arrays, attached = attach_csr(handle)
+            try:
+                if self.mode == 'sync':
+                    self.t_ = self._fit_sync(handle, arrays, n_jobs, seed, t)
+                elif self.mode == 'async':
+                    self.t_ = self._fit_async(handle, X_shared, arrays, n_jobs, seed, t)
+                else:
+                    raise ValueError(f'unknown mode: {self.mode}')
+                params = arrays['params'].copy()
+            finally:
+                del X_shared, arrays
+                release_blocks(attached)
+        finally:
+            release_blocks(blocks, unlink=True)
+        self.coef_ = params[:n_features].reshape(1, -1)
+        self.intercept_ = np.array([params[n_features]])
+        return self
+
+    def _fit_sync(self, handle, arrays, n_jobs, seed, t):
+        params, losses, control = arrays['params'], arrays['losses'], arrays['control']
+        n_rows, n_features = handle['shape']
+        context = multiprocessing.get_context()
+        barrier = context.Barrier(n_jobs + 1)
+        per_worker = -(-self.batch_size // n_jobs)
+        workers = [context.Process(target=_sync_worker,
+                                   args=(handle, k, n_jobs, per_worker, seed, barrier, self.C, self.lb,
+                                         self.ub, self.learning_rate, t))
+                   for k in range(n_jobs)]
+        for worker in workers:
+            worker.start()
+        # a worker dying would leave the others waiting at the barrier: break it
+        watching = threading.Event()
+
+        def watch():
+            while not watching.wait(0.1):
+                if _failed(workers):
+                    barrier.abort()
+                    return
+
+        watcher = threading.Thread(target=watch, daemon=True)
+        watcher.start()
+
+        def run_phase(phase):
+            control[0] = phase
+            for _ in range(_PHASE_WAITS[phase]):
+                try:
+                    barrier.wait(_BARRIER_TIMEOUT)
+                except threading.BrokenBarrierError:
+                    barrier.abort()
+                    failed = _failed(workers)
+                    if failed:
+                        raise RuntimeError(f'a training worker exited with code {failed[0]}') from None
+                    raise RuntimeError(f'the training workers did not answer within {_BARRIER_TIMEOUT} s') from None
+
+        def objective():
+            run_phase(_LOSS)
+            w = params[:n_features]
+            return 0.5 * np.dot(w, w) + self.C * losses.sum()
+
+        try:
+            steps = -(-n_rows // (per_worker * n_jobs))
+            current = objective()
+            self.objective_ = [current]
+            self.n_iter_ = 0
+            for epoch in range(self.max_epochs):
+                for step in range(steps):
+                    run_phase(_STEP)
+                    t += 1
+                self.n_iter_ = epoch + 1
+                previous, current = current, objective()
+                self.objective_.append(current)
+                if abs(previous - current) <= self.tol * max(abs(previous), 1.0):
+                    break
+        finally:
+            watching.set()
+            watcher.join()
+            if not barrier.broken:
+                run_phase(_STOP)
+            for worker in workers:
+                worker.join()
+        return t
+
+    def _fit_async(self, handle, X, arrays, n_jobs, seed, t):
+        params, epochs_done, control = arrays['params'], arrays['epochs_done'], arrays['control']
+        y_signed = arrays['labels']
+        n_features = X.shape[1]
+        context = multiprocessing.get_context()
+        workers = [context.Process(target=_async_worker,
+                                   args=(handle, k, n_jobs, self.batch_size, seed, self.C,
+                                         self.lb, self.ub, self.learning_rate, self.max_epochs, t))
+                   for k in range(n_jobs)]
+        for worker in workers:
+            worker.start()
+
+        def objective():
+            w = params[:n_features].copy()
+            return 0.5 * np.dot(w, w) + self.C * _shard_hinge_loss(
+                X, y_signed, 0, X.shape[0], w, params[n_features])
+
+        try:
+            current = objective()
+            self.objective_ = [current]
+            self.n_iter_ = 0
+            for epoch in range(1, self.max_epochs + 1):
+                # every worker finished the epoch and waits, the weights are the ones of the epoch boundary
+                while epochs_done.min() < epoch:
+                    if _failed(workers):
+                        raise RuntimeError(f'a training worker exited with code {_failed(workers)[0]}')
+                    time.sleep(_POLL_INTERVAL)
+                self.n_iter_ = epoch
+                previous, current = current, objective()
+                self.objective_.append(current)
+                if abs(previous - current) <= self.tol * max(abs(previous), 1.0):
+                    break
+                control[1] = epoch
+        finally:
+            control[0] = _STOP
+            for worker in workers:
+                worker.join()
+        # the steps of the workers, approximately (they are not counted in shared memory)
+        n_rows = X.shape[0]
+        return t + self.n_iter_ * -(-n_rows // self.batch_size)
@@ -0,0 +1,107 @@
+import numpy as np
+from scipy import sparse
+from featureExtractor.extractionPlan import MANIFESTFAMILIES
+from feature_selection import family_columns
+
+# the features an attacker can add without breaking the app: manifest entries and API calls
+ADDABLE_FAMILIES = MANIFESTFAMILIES + ('api_calls', 'api_permissions')
+# the numbers of added features the detection rate is reported at
+BUDGETS = (0, 1, 2, 5, 10, 20, 50, 100)
+# the number of malicious apps attacked at once (bounds the dense blocks to rows x candidates)
+ROW_BLOCK = 2048
+
+
+def attack_candidates(coef, feature_names, scale=None, families=ADDABLE_FAMILIES):
+    """
+    This function ranks the features an attacker would add to lower the score of a linear model: the
+    addable features with a negative weight, the most negative first.
+
+    Inputs:
+        coef (numpy.ndarray): The weights of the model, one per column.
+        feature_names (list): The name of every column.
+        scale (numpy.ndarray): The scale the features are divided by before the model (default: none),
+                               adding a feature sets its column to 1 / scale.
+        families (tuple): The feature families the attacker can add.
+
+    Returns:
+        candidates (numpy.ndarray): The columns of the candidate features, best first.
+        deltas (numpy.ndarray): The change of the score when adding every candidate.
+    """
+    deltas = np.asarray(coef, dtype=np.float64).ravel()
+    if scale is not None:
+        deltas = deltas / np.asarray(scale, dtype=np.float64)
+    columns = family_columns(feature_names, families)
+    columns = columns[deltas[columns] < 0]
+    order = np.argsort(deltas[columns], kind='mergesort')
+    return columns[order], deltas[columns[order]]
+
+
+def evaluate_robustness(coef, intercept, X, y, feature_names, scale=None, budgets=BUDGETS,
+                        families=ADDABLE_FAMILIES):
+    """
+    This function simulates the strongest feature-addition attack on a linear model for every malicious
+    app at once: with a budget of k features, an app gets the k candidate features it lacks with the most
+    negative weights. The apps are processed in blocks, for every block the candidates an app already
+    has are masked out and the cumulative sum of the remaining weights gives the score after any budget.
+
+    Inputs:
+        coef (numpy.ndarray): The weights of the model, one per column of X.
+        intercept (float): The intercept of the model.
+        X (scipy.sparse.csr_matrix or numpy.ndarray): The feature values of the test apps, as given to the model.
+        y (numpy.ndarray): The labels of the test apps (1 for malicious).
+        feature_names (list): The name of every column of X.
+        scale (numpy.ndarray): The scale of every column (see attack_candidates).
+        budgets (tuple): The numbers of added features.
+        families (tuple): The feature families the attacker can add.
+
+    Returns:
+        results (dict): The detection rate and mean score of the malicious apps at every budget, and
+                        the number of added features needed to evade the model (its median and
+                        the share of apps that cannot evade with max(budgets) features).
+    """
+    X = sparse.csr_matrix(X)[np.flatnonzero(np.asarray(y) == 1)]
+    coef = np.asarray(coef, dtype=np.float64).ravel()
+    budgets = np.array(sorted(budgets))
+    max_budget = int(budgets[-1])
+    candidates, deltas = attack_candidates(coef, feature_names, scale, families)
+    n = X.shape[0]
+    scores = np.empty((n, len(budgets)))
+    needed = np.full(n, np.inf)
+    for start in range(0, n, ROW_BLOCK):
+        block = X[start:start + ROW_BLOCK]
+        base = block @ coef + intercept
+        # enough candidates for every app to find max_budget it does not have yet
+        present = block[:, candidates] != 0
+        width = min(len(candidates), max_budget + int(present.getnnz(axis=1).max(initial=0)))
+        available = ~present[:, :width].toarray()
+        rank = np.cumsum(available, axis=1)
+        reduction = np.cumsum(np.where(available, deltas[:width], 0.0), axis=1)
+        reduction = np.hstack([np.zeros((block.shape[0], 1)), reduction])
+        for b, budget in enumerate(budgets):
+            # the column of the budget-th available candidate (capped when there are fewer)
+            position = np.count_nonzero(rank < budget, axis=1) + (budget > 0)
+            scores[start:start + block.shape[0], b] = base + reduction[np.arange(block.shape[0]),
+                                                                       np.minimum(position, width)]
+        if width:
+            # the first budget pushing the score to the benign side
+            evaded = (base[:, None] + reduction[:, 1:] <= 0) & available
+            first = np.argmax(evaded, axis=1)
+            rows = np.flatnonzero(evaded.any(axis=1))
+            needed[start + rows] = rank[rows, first[rows]]
+        needed[start + np.flatnonzero(base <= 0)] = 0
+    needed[needed > max_budget] = np.inf
+    return {'budgets': budgets.tolist(), 'n_malicious': n, 'n_candidates': len(candidates),
+            'detection_rate': (scores > 0).mean(axis=0).tolist() if n else [0.0] * len(budgets),
+            'mean_score': scores.mean(axis=0).tolist() if n else [0.0] * len(budgets),
+            'median_evasion_budget': float(np.median(needed)) if n else float('inf'),
+            'robust_share': float(np.isinf(needed).mean()) if n else 0.0}
+
+
+def print_robustness(results):
+    print(f'feature-addition attack on {results["n_malicious"]} malicious apps '
+          f'({results["n_candidates"]} addable features with a negative weight)')
+    print(f'{"added":>6} {"detection":>10} {"mean score":>11}')
+    for budget, rate, score in zip(results['budgets'], results['detection_rate'], results['mean_score']):
+        print(f'{budget:>6} {rate:>10.1%} {score:>11.3f}')
+    print(f'median features to evade: {results["median_evasion_budget"]:g}, '
+          f'still detected after {results["budgets"][-1]}: {results["robust_share"]:.1%}')
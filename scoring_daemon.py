@@ -0,0 +1,325 @@
+import argparse
+import collections
+import json
+import os
+import queue
+import shutil
+import signal
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from setting import config
+from model_artifact import load_model_artifact
+
+# number of latencies the percentiles are computed on
+LATENCY_WINDOW = 10000
+
+
+class MicroBatcher:
+    """
+    Collects the feature records submitted by concurrent requests and scores them together: the
+    scoring thread waits for a first record, then for at most max_wait seconds for more, and scores
+    up to max_batch records with a single call to score_records.
+
+    Inputs:
+        model (model_artifact.ScoringModel): The model.
+        max_batch (int): The largest number of records scored at once.
+        max_wait (float): The longest time in seconds a record waits for others to join its batch.
+    """
+
+    def __init__(self, model, max_batch=64, max_wait=0.002):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+        self.started = time.time()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, record):
+        """
+        This function queues a feature record for scoring.
+
+        Inputs:
+            record (dict): The feature record.
+
+        Returns:
+            future (concurrent.futures.Future): Resolves to (score, verdict).
+        """
+        future = Future()
+        self.queue.put((record, future))
+        return future
+
+    def _loop(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                try:
+                    batch.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self.lock:
+                self.batches += 1
+            try:
+                self._score(batch)
+            except Exception:
+                # a malformed record must not fail the others: they are scored one at a time
+                for record, future in batch:
+                    try:
+                        self._score([(record, future)])
+                    except Exception as e:
+                        future.set_exception(e)
+
+    def _score(self, batch):
+        scores = self.model.score_records([record for record, _ in batch])
+        verdicts = self.model.verdicts(scores)
+        for (_, future), score, verdict in zip(batch, scores, verdicts):
+            future.set_result((float(score), int(verdict)))
+
+    def record_latency(self, seconds, error=False):
+        with self.lock:
+            self.requests += 1
+            self.errors += int(error)
+            self.latencies.append(seconds)
+
+    def stats(self):
+        """
+        This function reports the request count, the latency percentiles (in milliseconds) of the
+        last requests, the current queue depth and the mean batch size.
+        """
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            requests, batches, errors = self.requests, self.batches, self.errors
+        stats = {'requests': requests, 'errors': errors, 'queue_depth': self.queue.qsize(),
+                 'batches': batches, 'mean_batch_size': (requests - errors) / batches if batches else 0.0,
+                 'uptime_s': time.time() - self.started}
+        if len(latencies):
+            for percentile in (50, 90, 99):
+                stats[f'p{percentile}_ms'] = float(np.percentile(latencies, percentile))
+            stats['max_ms'] = float(latencies.max())
+        return stats
+
+
+# the extraction plan of the worker processes analysing the apks, None to extract every feature
+_plan = None
+
+
+def _init_analyzer(extractor_path, used_features=None):
+    global _plan
+    # the extractor resolves its tools (baksmali, API lists) relative to its folder
+    sys.path.insert(0, extractor_path)
+    os.chdir(extractor_path)
+    if used_features is not None:
+        from extractionPlan import ExtractionPlan
+        _plan = ExtractionPlan(used_features)
+
+
+def analyze_apk(path):
+    """
+    This function runs the feature extractor on an apk (in a worker process) and returns its
+    feature record, without adding it to data.json. With an extraction plan, only the features
+    the model uses are looked for.
+
+    Inputs:
+        path (str): The filepath of the apk.
+
+    Returns:
+        record (dict): The feature record ({feature name: value}, or hashed indices and values).
+    """
+    import settings
+    import staticAnalyzer
+    working_dir = tempfile.mkdtemp(prefix='analysis-')
+    try:
+        vector = staticAnalyzer.report_to_feature_vector(staticAnalyzer.analyze(path, working_dir, plan=_plan), label=0)
+        if settings.FEATUREFORMAT == 'hashed':
+            return staticAnalyzer.encodeFeatureVector(working_dir, vector)
+        # feature IDs would grow the shared vocabulary, the names are mapped by the model instead
+        return vector
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+class ScoringService:
+    """
+    Scores the requests of the daemon: a request holds either a ready feature record ('report')
+    or the path of an apk ('apk'), analysed by a pool of extractor processes first.
+
+    Inputs:
+        batcher (MicroBatcher): The micro-batcher scoring the records.
+        analysis_workers (int): The number of extractor processes.
+        full_extraction (bool): Whether to extract every feature, not only the ones the model uses.
+        weight_tolerance (float): The largest weight of a feature the extraction can skip.
+    """
+
+    def __init__(self, batcher, analysis_workers=2, full_extraction=False, weight_tolerance=0.0):
+        self.batcher = batcher
+        used_features = None if full_extraction else batcher.model.used_features(weight_tolerance)
+        self.analyzer = ProcessPoolExecutor(analysis_workers, initializer=_init_analyzer,
+                                            initargs=(config['featureExtractorPath'], used_features))
+
+    def handle(self, request):
+        if not isinstance(request, dict):
+            return {'error': 'a request must be a JSON object'}
+        if request.get('stats'):
+            return self.batcher.stats()
+        start = time.perf_counter()
+        try:
+            if 'report' in request:
+                record = request['report']
+                if not isinstance(record, dict):
+                    raise ValueError("a 'report' must be a JSON object")
+            elif 'apk' in request:
+                record = self.analyzer.submit(analyze_apk, os.path.abspath(request['apk'])).result()
+            else:
+                raise ValueError("a request needs a 'report' or an 'apk'")
+            score, verdict = self.batcher.submit(record).result()
+        except Exception as e:
+            self.batcher.record_latency(time.perf_counter() - start, error=True)
+            return {'error': str(e)}
+        latency = time.perf_counter() - start
+        self.batcher.record_latency(latency)
+        return {'sha256': record.get('sha256'), 'score': score, 'verdict': verdict,
+                'latency_ms': latency * 1000}
+
+
+def make_http_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        # POST /score with a JSON request, GET /stats
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._reply(200, service.batcher.stats())
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/score':
+                self._reply(404, {'error': 'not found'})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except ValueError as e:
+                self._reply(400, {'error': str(e)})
+                return
+            result = service.handle(request)
+            self._reply(400 if 'error' in result else 200, result)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def make_socket_handler(service):
+    class Handler(socketserver.StreamRequestHandler):
+        # one JSON request per line, one JSON reply per line
+
+        def handle(self):
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    result = service.handle(json.loads(line))
+                except ValueError as e:
+                    result = {'error': str(e)}
+                self.wfile.write((json.dumps(result) + '\n').encode('utf-8'))
+                self.wfile.flush()
+
+    return Handler
+
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(artifact_dir, host='127.0.0.1', port=8765, socket_path=None, max_batch=64, max_wait=0.002,
+          analysis_workers=2, full_extraction=False, weight_tolerance=0.0):
+    """
+    This function loads the model once and serves scoring requests on a localhost HTTP endpoint
+    and, optionally, on a Unix socket, until interrupted.
+
+    Inputs:
+        artifact_dir (str): The folder of the model artifact.
+        host (str): The HTTP address (localhost only by default), None to disable HTTP.
+        port (int): The HTTP port.
+        socket_path (str): The filepath of the Unix socket, None to disable it.
+        max_batch (int): The largest micro-batch.
+        max_wait (float): The longest wait in seconds for a micro-batch to fill.
+        analysis_workers (int): The number of extractor processes for apk requests.
+        full_extraction (bool): Whether to extract every feature of the apks, not only the ones the model uses.
+        weight_tolerance (float): The largest weight of a feature the extraction can skip.
+    """
+    service = ScoringService(MicroBatcher(load_model_artifact(artifact_dir), max_batch, max_wait),
+                             analysis_workers, full_extraction, weight_tolerance)
+    servers = []
+    if host is not None:
+        http_server = ThreadingHTTPServer((host, port), make_http_handler(service))
+        http_server.daemon_threads = True
+        servers.append(http_server)
+        print(f'serving on http://{host}:{port}')
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        servers.append(ThreadingUnixServer(socket_path, make_socket_handler(service)))
+        print(f'serving on {socket_path}')
+    threads = [threading.Thread(target=server.serve_forever, daemon=True) for server in servers]
+    for thread in threads:
+        thread.start()
+    # stop cleanly on SIGTERM too (the finally clause removes the socket)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
+        service.analyzer.shutdown()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Scoring daemon of the detector.')
+    parser.add_argument('--artifact', default=config['artifactPath'], help='the folder of the model artifact')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--no-http', action='store_true', help='serve on the Unix socket only')
+    parser.add_argument('--socket', default=None, help='the filepath of the Unix socket')
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    parser.add_argument('--analysis-workers', type=int, default=2)
+    parser.add_argument('--full-extraction', action='store_true',
+                        help='extract every feature of the apks, not only the ones the model uses')
+    parser.add_argument('--weight-tolerance', type=float, default=0.0,
+                        help='skip the extraction of the features whose weight is at most this value')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    serve(args.artifact, None if args.no_http else args.host, args.port, args.socket,
+          args.max_batch, args.max_wait_ms / 1000, args.analysis_workers, args.full_extraction,
+          args.weight_tolerance)
@@ -17,6 +17,16 @@ _project_path = os.path.dirname(os.path.realpath(__file__))
 jarPath = f'{_project_path}/{jarFolder}'
 apksPath = f'{_project_path}/data/{apkFolder}'
 apksResultJsonPath = f'{_project_path}/data/{apkFolder}/result/data.json'
+vocabularyPath = f'{_project_path}/data/{apkFolder}/result/vocabulary.txt'
+featureCachePath = f'{_project_path}/data/{apkFolder}/result/cache'
+featureStorePath = f'{_project_path}/data/{apkFolder}/result/store'
+modelPath = f'{_project_path}/data/{apkFolder}/result/model'
+preprocessorPath = f'{modelPath}/preprocessor.pkl'
+selectedFeaturesPath = f'{modelPath}/selected_features.txt'
+searchResultsPath = f'{modelPath}/search_results.csv'
+onlineModelPath = f'{modelPath}/online_model.pkl'
+artifactPath = f'{modelPath}/artifact'
+cascadePath = f'{modelPath}/cascade'
 trainPath = f'{_project_path}/data/{trainFolder}'
 testPath = f'{_project_path}/data/{testFolder}'
 featureExtractorPath = f'{_project_path}/featureExtractor'
@@ -24,6 +34,48 @@ AAPT = f"{_project_path}/{featureExtractorPath}/aapt"
 APICALLS = "APIcalls.txt"
 BACKSMALI = "baksmali-2.0.3.jar"  # location of the baksmali.jar file
 ADSLIBS = "ads.csv"
+# apps sampled from data.json for training: None keeps every app of the label,
+# and without sampleMalicious the malicious apps are maliciousRatio of the benign ones
+sampleBenign = None
+sampleMalicious = None
+maliciousRatio = 0.1
+# storage of the cached feature matrix: 'csr', or 'bits' to keep the binary features bit-packed
+# (one bit per app and feature, smaller than CSR when more than about 1% of the entries are set)
+featureStorage = 'csr'
+# feature scaling: 'standard' (divide by the std, no centering) or 'maxabs'
+scaling = 'standard'
+# model trained by main.py: 'linearsvc', 'secsvm' (weights bounded to [-1, 1]), 'parallel_secsvm'
+# (the SecSVM trained on trainJobs processes, None for all cores, in trainMode 'sync' or 'async')
+# or 'bagged' (an ensemble trained on trainJobs processes)
+classifier = 'linearsvc'
+trainJobs = None
+trainMode = 'sync'
+# classifier 'bagged': ensembleEstimators members of the ensembleBase classifier ('linearsvc' or 'secsvm'),
+# each trained on a stratified bootstrap sample and a fraction ensembleMaxFeatures of the features, averaged into one
+# model (with ensembleKeepMembers the members are saved too, to estimate the variance of the scores)
+ensembleEstimators = 10
+ensembleBase = 'linearsvc'
+ensembleMaxFeatures = 1.0
+ensembleKeepMembers = False
+# feature selection before training: None, 'chi2', 'mutual_info' or 'l1'
+# (features present in fewer than selectMinDf apps are always dropped when enabled)
+featureSelection = None
+selectK = 2000
+selectMinDf = 2
+# hyperparameter search (main.py --search): the score the configurations are ranked by
+# ('sum' is accuracy + precision + recall), successive halving, and the worker processes (None for all cores)
+searchMetric = 'sum'
+searchHalving = True
+searchJobs = None
+# incremental training (online_learning.py): number of updates between two full retrainings
+onlineReconcileEvery = 30
+# cascade (cascade.py): the apps whose manifest-only score falls in cascadeBand go through the dex
+# analysis; cascadeDexCost is the cost of the dex analysis relative to the manifest stages
+cascadeBand = (-1.0, 1.0)
+cascadeDexCost = 30.0
+# robustness gate of main.py (robustness.py): (number of added features, minimum detection rate of the
+# malicious test apps under the feature-addition attack) a retrained model must reach to be saved
+robustnessGate = None
 
 
 config = {
@@ -37,5 +89,37 @@ config = {
     'trainPath': trainPath,
     'testPath': testPath,
     'featureExtractorPath': featureExtractorPath,
-    'apksResultJsonPath': apksResultJsonPath
+    'apksResultJsonPath': apksResultJsonPath,
+    'vocabularyPath': vocabularyPath,
+    'featureCachePath': featureCachePath,
+    'featureStorePath': featureStorePath,
+    'sampleBenign': sampleBenign,
+    'sampleMalicious': sampleMalicious,
+    'maliciousRatio': maliciousRatio,
+    'featureStorage': featureStorage,
+    'scaling': scaling,
+    'modelPath': modelPath,
+    'preprocessorPath': preprocessorPath,
+    'classifier': classifier,
+    'trainJobs': trainJobs,
+    'trainMode': trainMode,
+    'ensembleEstimators': ensembleEstimators,
+    'ensembleBase': ensembleBase,
+    'ensembleMaxFeatures': ensembleMaxFeatures,
+    'ensembleKeepMembers': ensembleKeepMembers,
+    'featureSelection': featureSelection,
+    'selectK': selectK,
+    'selectMinDf': selectMinDf,
+    'selectedFeaturesPath': selectedFeaturesPath,
+    'searchResultsPath': searchResultsPath,
+    'searchMetric': searchMetric,
+    'searchHalving': searchHalving,
+    'searchJobs': searchJobs,
+    'onlineModelPath': onlineModelPath,
+    'artifactPath': artifactPath,
+    'cascadePath': cascadePath,
+    'cascadeBand': cascadeBand,
+    'cascadeDexCost': cascadeDexCost,
+    'robustnessGate': robustnessGate,
+    'onlineReconcileEvery': onlineReconcileEvery
 }
@@ -0,0 +1,96 @@
+from multiprocessing import shared_memory
+import numpy as np
+from scipy import sparse
+
+
+def share_arrays(arrays):
+    """
+    This function copies arrays into shared memory blocks that other processes can attach to without copying.
+
+    Inputs:
+        arrays (dict): The arrays, by name.
+
+    Returns:
+        handle (dict): The picklable description of the blocks, to pass to attach_arrays.
+        blocks (list): The shared memory blocks (keep them alive, then release them with release_blocks).
+    """
+    handle = {}
+    blocks = []
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        handle[name] = (block.name, array.shape, array.dtype.str)
+        blocks.append(block)
+    return handle, blocks
+
+
+def attach_arrays(handle):
+    """
+    This function attaches to the shared memory blocks described by a handle of share_arrays.
+
+    Inputs:
+        handle (dict): The handle.
+
+    Returns:
+        arrays (dict): The arrays, by name (views on the shared memory).
+        blocks (list): The attached blocks (keep them alive while the arrays are used).
+    """
+    arrays = {}
+    blocks = []
+    for name, (block_name, shape, dtype) in handle.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        blocks.append(block)
+    return arrays, blocks
+
+
+def release_blocks(blocks, unlink=False):
+    """
+    This function closes shared memory blocks, and frees them when unlink is True (owner side).
+    """
+    for block in blocks:
+        block.close()
+        if unlink:
+            block.unlink()
+
+
+def share_csr(X, y=None, **extra):
+    """
+    This function puts a CSR matrix (with its labels and any extra arrays) in shared memory.
+
+    Inputs:
+        X (scipy.sparse.csr_matrix): The feature matrix.
+        y (numpy.ndarray): The labels.
+        **extra: Extra arrays to share (e.g. the weights updated by the workers).
+
+    Returns:
+        handle (dict): The picklable description of the matrix, to pass to attach_csr.
+        blocks (list): The shared memory blocks.
+    """
+    X = sparse.csr_matrix(X)
+    arrays = {'data': X.data, 'indices': X.indices, 'indptr': X.indptr}
+    if y is not None:
+        arrays['labels'] = np.asarray(y)
+    arrays.update(extra)
+    handle, blocks = share_arrays(arrays)
+    return {'shape': X.shape, 'arrays': handle}, blocks
+
+
+def attach_csr(handle):
+    """
+    This function attaches to a CSR matrix shared by share_csr, without copying it.
+
+    Inputs:
+        handle (dict): The handle of share_csr.
+
+    Returns:
+        X (scipy.sparse.csr_matrix): The feature matrix.
+        arrays (dict): All the shared arrays ('labels' and the extra ones included).
+        blocks (list): The attached blocks (keep them alive while the arrays are used).
+    """
+    arrays, blocks = attach_arrays(handle['arrays'])
+    X = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                          shape=handle['shape'], copy=False)
+    X.has_sorted_indices = True
+    return X, arrays, blocks
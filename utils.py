@@ -1,6 +1,12 @@
-import pandas as pd
+from array import array
 import json
+import os
 import random
+import numpy as np
+from scipy import sparse
+import feature_cache
+from bitmatrix import BitMatrix
+from featureExtractor.featureRegistry import loadVocabulary
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
@@ -11,17 +17,6 @@ def is_2d(value):
     return False
 
 
-def count_apps(app_list):
-    malicious_count = 0
-    benign_count = 0
-    for item in app_list:
-        if int(item['label']) == 1:
-            malicious_count += 1
-        else:
-            benign_count += 1
-    return malicious_count, benign_count
-
-
 def get_random_number(start, end, isInt=True):
     rand = random.randrange(start, end+1)
     randU = random.uniform(start, end)
@@ -34,51 +29,308 @@ def get_random_number(start, end, isInt=True):
     return randU
 
 
-def filter_apps(num_malicious, num_benign, app_list):
-    malicious_apps = [app for app in app_list if app["label"] == 1]
-    benign_apps = [app for app in app_list if app["label"] == 0]
+def load_vocabulary(filename):
+    """
+    This function loads the feature vocabulary written by the feature extractor.
 
-    filtered_malicious_apps = random.sample(malicious_apps, num_malicious)
-    filtered_benign_apps = random.sample(benign_apps, num_benign)
+    Inputs:
+        filename (str): The filepath of the vocabulary file (one feature name per line, the ID being the line number).
 
-    filtered_apps = filtered_malicious_apps + filtered_benign_apps
-    random.shuffle(filtered_apps)
-    return filtered_apps
+    Returns:
+        vocabulary (list): The feature names, in ID order.
+    """
+    # the extractor writes the vocabulary, its reader skips a line still being appended
+    return loadVocabulary(filename)
 
 
-def removePropertyFromJson(property, json):
-    for i in range(len(json)):
-        del json[i][property]
+def iter_records(filename, chunk_size=1 << 20):
+    """
+    This function streams the records of a JSON array file (data.json) or of a JSON lines file
+    without loading the whole file in memory.
 
-    return json
+    Inputs:
+        filename (str): The filepath of the file.
+        chunk_size (int): The number of characters read at once.
 
+    Returns:
+        records (generator): The records, one dict at a time.
+    """
+    decoder = json.JSONDecoder()
+    with open(filename, 'r') as f:
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith('['):
+            # JSON lines: one record per line
+            f.seek(0)
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        pos = 1
+        eof = False
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if buffer[pos:pos + 1] == ']':
+                return
+            record = None
+            if pos < len(buffer):
+                try:
+                    record, pos = decoder.raw_decode(buffer, pos)
+                except ValueError:
+                    # the record continues in the next chunk
+                    if eof:
+                        raise
+            if record is None:
+                if eof:
+                    return
+                chunk = f.read(chunk_size)
+                eof = chunk == ''
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield record
 
-def load_data(filename):
+
+class RecordEncoder:
     """
-    This function loads data from a JSON file and returns a Pandas DataFrame. If the DataFrame contains any NaN values, they are replaced with 0.
+    Maps the feature records of the JSON file to sparse CSR rows. Records can hold {feature name: value}
+    entries, sorted feature IDs of the vocabulary, or hashed sparse vectors. Names met for the first time
+    get the next free column, so the columns stay consistent across several calls to encode.
+    All the records must have the same format: a name and the ID of the same feature would get two columns.
+
+    Inputs:
+        vocabulary (list): The feature names of the vocabulary, in ID order (the first columns).
+    """
+
+    def __init__(self, vocabulary=None):
+        self.feature_names = list(vocabulary or [])
+        self.columns = {name: i for i, name in enumerate(self.feature_names)}
+        self.hash_dim = 0
+        # the format of the records encoded so far: 'ids', 'hashed' or 'names'
+        self.record_format = None
+
+    @property
+    def n_features(self):
+        return self.hash_dim or len(self.feature_names)
+
+    def get_feature_names(self):
+        if self.hash_dim:
+            return [f'hash::{i}' for i in range(self.hash_dim)]
+        return self.feature_names
+
+    def encode(self, records):
+        """
+        This function encodes records as the rows of a CSR matrix.
+
+        Inputs:
+            records (iterable): The records.
+
+        Returns:
+            X (scipy.sparse.csr_matrix): The feature matrix, as wide as the columns known so far.
+            y (numpy.ndarray): The labels.
+            sha256 (list): The sha256 of every row of X.
+
+        Raises:
+            ValueError: If the records do not all have the same format (e.g. data.json extracted with
+                        the "names" format, then appended to with the "ids" format).
+        """
+        feature_names = self.feature_names
+        columns = self.columns
+        indptr = array('q', [0])
+        indices = array('i')
+        values = array('d')
+        labels = array('b')
+        sha256 = []
+        for record in records:
+            record_format = 'ids' if 'feature_ids' in record else 'hashed' if 'hashed_indices' in record else 'names'
+            if record_format != self.record_format:
+                if self.record_format is not None:
+                    raise ValueError(f'the records mix the {self.record_format!r} and {record_format!r} feature '
+                                     f'formats (record {record.get("sha256")}): re-extract them with a single '
+                                     f'FEATUREFORMAT')
+                self.record_format = record_format
+            if record_format == 'ids':
+                indices.extend(record['feature_ids'])
+                values.extend([1.0] * len(record['feature_ids']))
+            elif record_format == 'hashed':
+                self.hash_dim = record['hash_dim']
+                indices.extend(record['hashed_indices'])
+                values.extend(record['hashed_values'])
+            else:
+                for name, value in record.items():
+                    if name == 'sha256' or name == 'label':
+                        continue
+                    column = columns.get(name)
+                    if column is None:
+                        column = columns[name] = len(feature_names)
+                        feature_names.append(name)
+                    indices.append(column)
+                    values.append(value)
+            indptr.append(len(indices))
+            labels.append(int(record['label']))
+            sha256.append(record.get('sha256'))
+
+        X = sparse.csr_matrix((np.frombuffer(values, dtype=np.float64),
+                               np.frombuffer(indices, dtype=np.int32),
+                               np.frombuffer(indptr, dtype=np.int64)),
+                              shape=(len(labels), self.n_features))
+        X.sort_indices()
+        return X, np.frombuffer(labels, dtype=np.int8).astype(np.int64), sha256
+
+
+def load_sparse_data(filename, vocabulary_filename=None):
+    """
+    This function streams the records of the JSON file and builds a sparse CSR feature matrix directly,
+    without going through a dense DataFrame.
 
     Inputs:
         filename (str): The filepath of the JSON file to be loaded.
+        vocabulary_filename (str): The filepath of the feature vocabulary, needed when the records are stored as feature IDs.
 
     Returns:
-        result (pandas.DataFrame): The resulting DataFrame containing the data from the JSON file.
+        X (scipy.sparse.csr_matrix): The feature matrix, one row per app.
+        y (numpy.ndarray): The labels.
+        feature_names (list): The name of every column of X.
+        sha256 (list): The sha256 of every row of X.
     """
-    with open(filename, 'r') as f:
-        data = json.load(f)
-    data = removePropertyFromJson('sha256', data)
-
-    malicious_count, benign_count = count_apps(data)
-    # print(f'malicious_apps_size in json file = {malicious_count}')
-    # print(f'benign_apps_size in json file = {benign_count}')
-
-    benign_count = int(benign_count * 0.9)
-    malicious_count = int(benign_count * 0.1)
-    data = filter_apps(benign_count, malicious_count, data)
-    print(f'malicious_apps_size selected by 0.1 = {malicious_count}')
-    print(f'benign_apps_size selected by 0.9 = {benign_count}')
-    print(f'total application = {len(data)}')
+    vocabulary = None
+    if vocabulary_filename is not None and os.path.exists(vocabulary_filename):
+        vocabulary = load_vocabulary(vocabulary_filename)
+    encoder = RecordEncoder(vocabulary)
+    X, y, sha256 = encoder.encode(iter_records(filename))
+    return X, y, encoder.get_feature_names(), sha256
+
+
+def stratified_sample(items, n_benign=None, n_malicious=None, malicious_ratio=None, seed=None):
+    """
+    This function draws a random sample of each label in a single pass over a stream, keeping a
+    reservoir per label (Algorithm R), so the memory is proportional to the sample and not to the corpus.
+    The number of malicious items given by malicious_ratio is only known at the end of the stream when
+    n_benign is None: the malicious reservoir then holds every malicious item until the end (and the
+    benign one every benign item), the memory being bounded by the corpus, not by the sample.
+
+    Inputs:
+        items (iterable): The stream of (label, item) pairs.
+        n_benign (int): The number of benign items to keep, None to keep them all.
+        n_malicious (int): The number of malicious items to keep, None to keep them all
+            (or to derive it from malicious_ratio).
+        malicious_ratio (float): When n_malicious is None, the number of malicious items to keep
+            as a fraction of the kept benign items.
+        seed (int): The seed of the sampling.
+
+    Returns:
+        sample (list): The kept items, shuffled.
+        malicious_count (int): The number of kept malicious items.
+        benign_count (int): The number of kept benign items.
+    """
+    rng = random.Random(seed)
+    if n_malicious is None and malicious_ratio is not None and n_benign is not None:
+        # at most this many malicious items are kept, fewer if the stream has fewer benign items
+        n_malicious_kept = int(n_benign * malicious_ratio)
+    else:
+        n_malicious_kept = n_malicious
+    capacities = {0: n_benign, 1: n_malicious_kept}
+    reservoirs = {0: [], 1: []}
+    seen = {0: 0, 1: 0}
+    for label, item in items:
+        label = 1 if int(label) == 1 else 0
+        seen[label] += 1
+        reservoir = reservoirs[label]
+        capacity = capacities[label]
+        if capacity is None or len(reservoir) < capacity:
+            reservoir.append(item)
+        else:
+            j = rng.randrange(seen[label])
+            if j < capacity:
+                reservoir[j] = item
+
+    malicious = reservoirs[1]
+    if n_malicious is None and malicious_ratio is not None:
+        wanted = int(len(reservoirs[0]) * malicious_ratio)
+        if wanted < len(malicious):
+            malicious = rng.sample(malicious, wanted)
+    sample = reservoirs[0] + malicious
+    rng.shuffle(sample)
+    return sample, len(malicious), len(reservoirs[0])
+
+
+def load_cached_data(filename, vocabulary_filename=None, cache_dir=None, storage='csr'):
+    """
+    This function returns the same result as load_sparse_data, but goes through an on-disk cache
+    keyed by the hash of the JSON file (and vocabulary): when the extraction output did not change,
+    the matrix is memory-mapped from the cache instead of being rebuilt.
+
+    Inputs:
+        filename (str): The filepath of the JSON file to be loaded.
+        vocabulary_filename (str): The filepath of the feature vocabulary.
+        cache_dir (str): The cache folder, None to disable the cache.
+        storage (str): The storage of the cached matrix (see feature_cache.save_cache).
+
+    Returns:
+        X (scipy.sparse.csr_matrix or bitmatrix.BitMatrix): The feature matrix, one row per app
+                                                           (bit-packed when cached with storage='bits').
+        y (numpy.ndarray): The labels.
+        feature_names (list): The name of every column of X.
+        sha256 (list): The sha256 of every row of X.
+    """
+    if cache_dir is None:
+        return load_sparse_data(filename, vocabulary_filename)
+    key = feature_cache.cache_key(cache_dir, [filename, vocabulary_filename])
+    cached = feature_cache.load_cache(cache_dir, key, storage=storage)
+    if cached is None:
+        feature_cache.save_cache(cache_dir, key, *load_sparse_data(filename, vocabulary_filename), storage=storage)
+        cached = feature_cache.load_cache(cache_dir, key, storage=storage)
+    return cached
+
+
+def load_data(filename, vocabulary_filename=None, cache_dir=None, n_benign=None,
+              n_malicious=None, malicious_ratio=0.1, seed=None, storage='csr'):
+    """
+    This function loads data from a JSON file as a sparse feature matrix and a label vector,
+    keeping a random sample of the benign and malicious apps (see stratified_sample).
+    Without a cache the records are sampled while they are streamed, so only the sample is encoded.
+
+    Inputs:
+        filename (str): The filepath of the JSON file to be loaded.
+        vocabulary_filename (str): The filepath of the feature vocabulary, needed when the records are stored as feature IDs.
+        cache_dir (str): The folder of the feature matrix cache, None to always rebuild the matrix.
+        n_benign (int): The number of benign apps to keep, None to keep them all.
+        n_malicious (int): The number of malicious apps to keep, None to derive it from malicious_ratio.
+        malicious_ratio (float): The number of malicious apps as a fraction of the benign apps (None to keep them all).
+        seed (int): The seed of the sampling.
+        storage (str): The storage of the cached matrix, 'bits' to keep it bit-packed until the sample is
+                       drawn (see feature_cache.save_cache).
+
+    Returns:
+        X (scipy.sparse.csr_matrix): The feature matrix of the selected apps.
+        y (numpy.ndarray): The labels of the selected apps.
+        feature_names (list): The name of every column of X.
+        malicious_count (int): The number of selected malicious apps.
+        benign_count (int): The number of selected benign apps.
+    """
+    if cache_dir is not None:
+        X, y, feature_names, _ = load_cached_data(filename, vocabulary_filename, cache_dir, storage)
+        rows, malicious_count, benign_count = stratified_sample(
+            zip(y, range(len(y))), n_benign, n_malicious, malicious_ratio, seed)
+        rows = np.array(rows, dtype=np.int64)
+        X = X[rows]
+        if isinstance(X, BitMatrix):
+            # only the selected rows are unpacked, in the format the classifiers expect
+            X = X.to_csr()
+        y = np.asarray(y[rows], dtype=np.int64)
+    else:
+        records, malicious_count, benign_count = stratified_sample(
+            ((record['label'], record) for record in iter_records(filename)),
+            n_benign, n_malicious, malicious_ratio, seed)
+        vocabulary = None
+        if vocabulary_filename is not None and os.path.exists(vocabulary_filename):
+            vocabulary = load_vocabulary(vocabulary_filename)
+        encoder = RecordEncoder(vocabulary)
+        X, y, _ = encoder.encode(records)
+        feature_names = encoder.get_feature_names()
+
+    print(f'malicious_apps_size selected = {malicious_count}')
+    print(f'benign_apps_size selected = {benign_count}')
+    print(f'total application = {len(y)}')
     print()
-    malicious_count, benign_count = count_apps(data)
-    result = pd.DataFrame(data)
-    result = result.fillna(0)
-    return result, malicious_count, benign_count
+    return X, y, feature_names, malicious_count, benign_count